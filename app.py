@@ -1,46 +1,81 @@
-from flask import Flask, render_template, request, jsonify, abort
+from flask import Flask, render_template, request, jsonify, abort, Response
 from islamic_times.islamic_times import ITLocation
-from islamic_times.it_dataclasses import Visibilities
+from islamic_times.it_dataclasses import Visibilities, SunInfo, PrayerTimes, Prayer
+from islamic_times import sun_equations as se, prayer_times as pt
 from islamic_times.time_equations import gregorian_to_hijri
-from timezonefinder import TimezoneFinder
-from datetime import datetime
-from functools import lru_cache
+from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from misc import hijri_to_gregorian
-import requests, math, sys, time, os, logging
-import subprocess, pathlib, tempfile
+from assets import asset_url
+from metrics import phase, cache_hit, cache_miss, counted_lru_cache
+import assets, metrics, profiler, polar_regimes
+import math, sys, time, os, json, logging, pathlib, threading
 
-OSM_NOMINATIM = "https://nominatim.openstreetmap.org/search"
-IPINFO        = "https://ipapi.co/json/"
+# requests, timezonefinder, subprocess and tempfile are imported where used so a
+# worker only pays for them when needed; PRELOAD_APP=1 loads the heavy
+# read-only state once in the gunicorn master instead (see gunicorn.conf.py).
+PRELOAD = os.getenv("PRELOAD_APP", "0") == "1"
+
+# upstreams; overridable so scripts/loadtest.py can point them at local stand-ins
+OSM_NOMINATIM = os.getenv("OSM_NOMINATIM", "https://nominatim.openstreetmap.org/search")
+IPINFO        = os.getenv("IPINFO", "https://ipapi.co/json/")
 
 app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
+assets.init_app(app)
+metrics.init_app(app)
+profiler.init_app(app)
 app.logger.info("GUNICORN_CMD_ARGS=" + os.getenv("GUNICORN_CMD_ARGS", ""))
 app.logger.info("sys.argv: " + " ".join(sys.argv))
 
-tf = TimezoneFinder()
+_tf = None
+_tf_lock = threading.Lock()
 
 # Mapper
-MAPS_BASE      = "https://islamictimes-maps.onrender.com"
+MAPS_BASE      = os.getenv("MAPS_BASE", "https://islamictimes-maps.onrender.com")
 MAPS_INDEX_URL = f"{MAPS_BASE}/maps_index.json"
 
 MAP_OUT_DIR = pathlib.Path("static/maps")      # served by Flask’s static route
 MAP_OUT_DIR.mkdir(parents=True, exist_ok=True)
 CACHE_TTL = 24 * 3600          # seconds (≈ 1 day)
+PRAYER_COORD_DECIMALS = 4      # ≈ 11 m; rounding used to key the prayer-time cache
+
+# islamic_times' prayer order and names, its latitude (90 - obliquity - max Fajr
+# angle) above which a missing event triggers the high-latitude rule, and the
+# reason it reports then
+PRAYER_NAMES = ('Fajr', 'Sunrise', 'Ẓuhr', 'ʿAṣr', 'Sunset', 'Maghrib', 'ʿIshāʾ', 'Midnight')
+EXTREME_LATITUDE = 46.5
+EXTREME_LATITUDE_RULES = ("ANGLEBASED", "ONESEVENTH", "MIDDLENIGHT", "NEARESTLAT", "NONE")
+EXTREME_LATITUDE_REASON = ("One or more required solar events were unavailable for standard-angle "
+                           "solving at this latitude/date.")
+
 _MAP_CACHE: dict[str, tuple[str, float]] = {}     # key → (filename, timestamp)
 
 # ---------------------------------------------------------------------------#
 # Helpers                                                                    #
 # ---------------------------------------------------------------------------#
 
-@lru_cache(maxsize=128)
+def get_tf():
+    """TimezoneFinder, built on first use (or in the master when preloading)."""
+    global _tf
+    if _tf is None:
+        with _tf_lock:
+            if _tf is None:
+                from timezonefinder import TimezoneFinder
+                # in_memory only pays off when the data is shared copy-on-write
+                _tf = TimezoneFinder(in_memory=PRELOAD)
+    return _tf
+
+@counted_lru_cache("geocode", maxsize=128)
 def geocode(q: str) -> tuple[float, float]:
     """Lat/lon from OpenStreetMap Nominatim."""
-    r = requests.get(OSM_NOMINATIM,
-                     params={"q": q, "format": "json", "limit": 1},
-                     timeout=6)
-    r.raise_for_status()
-    data = r.json()
+    import requests
+    with phase("outbound_http"):
+        r = requests.get(OSM_NOMINATIM,
+                         params={"q": q, "format": "json", "limit": 1},
+                         timeout=6)
+        r.raise_for_status()
+        data = r.json()
     if not data:
         abort(400, "Address not found.")
     return float(data[0]["lat"]), float(data[0]["lon"])
@@ -48,8 +83,10 @@ def geocode(q: str) -> tuple[float, float]:
 
 def ip_location() -> tuple[float, float]:
     """Fast but coarse - fallback only."""
+    import requests
     try:
-        d = requests.get(IPINFO, timeout=3).json()
+        with phase("outbound_http"):
+            d = requests.get(IPINFO, timeout=3).json()
         return float(d["latitude"]), float(d["longitude"])
     except Exception:
         return 0.0, 0.0
@@ -59,10 +96,10 @@ def _iso(dt):
     """Serialize datetime preserving its local timezone offset."""
     return dt.isoformat()
 
-@lru_cache(maxsize=256)
+@counted_lru_cache("lookup_tz", maxsize=256)
 def lookup_tz(lat: float, lon: float) -> ZoneInfo:
     """Cache lat/lon → IANA tz lookup."""
-    name = tf.timezone_at(lat=lat, lng=lon)
+    name = get_tf().timezone_at(lat=lat, lng=lon)
     return ZoneInfo(name or "UTC")
 
 def _format_prayer(prayer):
@@ -95,104 +132,351 @@ def upcoming_hijri():
 # Core Map Generator                                                         #
 # ---------------------------------------------------------------------------#
 
-# NOT USED
-@app.post("/generate_map")
-def generate_map():
-    """
-    Kick off mapper.py with the POSTed JSON payload and return
-    the image URL when it finishes.  Long-running -- front-end shows spinner.
-    """
-    p = request.get_json(silent=True) or {}
-    try:
-        hijri_month      = int(p["month"])        # 1‑12
-        hijri_year       = int(p["year"])         # 1‑2000 (per your UI text)
-        days             = int(p["days"])         # 1‑3    (dropdown)
-        criterion        = int(p["criterion"])    # 0 = Odeh, 1 = Yallop
-        resolution       = int(p["resolution"])   # 1‑500
-    except (KeyError, ValueError):
-        abort(400, "Bad parameters.")
+class MapRenderError(RuntimeError):
+    """mapper.py failed or produced nothing."""
 
-    if resolution < 50 or resolution > 500 or resolution % 50 != 0:
-        abort(400, "Resolution must be a multiple of 50 between 50 and 500.")
 
-    # --------  caching key ----------------------------------------
-    cache_key = f"{hijri_year}:{hijri_month}:{days}:{criterion}:{resolution}"
+MAP_REGIONS = ("WORLD", "NORTH_AMERICA", "EUROPE", "MIDDLE_EAST", "IRAN")
+MAP_FILE_TTL = 35 * 24 * 3600   # a rendered month stays valid on disk
+
+
+def _map_name(hijri_year, hijri_month, days, criterion, resolution, region="WORLD") -> str:
+    name = f"{hijri_year}-{hijri_month:02d}-{days}-{criterion}-{resolution}.jpg"
+    return name if region == "WORLD" else f"{region.lower()}-{name}"
+
+
+def cached_map(hijri_year, hijri_month, days, criterion, resolution, region="WORLD") -> str | None:
+    """File name of an already-rendered map (in this worker's cache or on disk)."""
+    cache_key = f"{region}:{hijri_year}:{hijri_month}:{days}:{criterion}:{resolution}"
     now = time.time()
     # purge expired
-    _MAP_CACHE.update({
-        k: v for k, v in _MAP_CACHE.items() if now - v[1] < CACHE_TTL
-    })
+    for k in [k for k, v in _MAP_CACHE.items() if now - v[1] >= CACHE_TTL]:
+        del _MAP_CACHE[k]
     if cache_key in _MAP_CACHE:
-        fname, _ = _MAP_CACHE[cache_key]
-        return jsonify({"url": f"/static/maps/{fname}"})
+        return _MAP_CACHE[cache_key][0]
+
+    # rendered by another worker
+    out_name = _map_name(hijri_year, hijri_month, days, criterion, resolution, region)
+    out_path = MAP_OUT_DIR / out_name
+    if out_path.exists() and now - out_path.stat().st_mtime < MAP_FILE_TTL:
+        _MAP_CACHE[cache_key] = (out_name, now)
+        return out_name
+    return None
+
+
+PROJECT_ROOT = pathlib.Path(__file__).resolve().parent
+
+
+def mapper_command(today_iso: str, master_path: str, region: str, days: int, criterion: int,
+                   resolution: int, *extra: str) -> list[str]:
+    """mapper.py call rendering the month of ``today_iso`` under ``master_path``; run it from PROJECT_ROOT."""
+    return [
+        sys.executable, str(PROJECT_ROOT / "scripts" / "mapper.py"),
+        "--today", today_iso,
+        "--master_path", master_path,  # mapper writes here
+        "--total_months", "1",
+        "--map_region", region,
+        "--map_mode",   "category",
+        "--resolution", str(resolution),
+        "--days_to_generate", str(days),
+        "--criterion", str(criterion),
+        "--save_logs",
+        *extra,
+    ]
+
+
+def render_map(hijri_year, hijri_month, days, criterion, resolution, region="WORLD") -> str:
+    """Run mapper.py for one month and move the JPEG (+ variants) into MAP_OUT_DIR."""
+    import subprocess, tempfile
+
+    cache_key = f"{region}:{hijri_year}:{hijri_month}:{days}:{criterion}:{resolution}"
 
     # --------  convert Hijri → Gregorian (first day of that month) ----
     starting_iso = datetime.replace(hijri_to_gregorian(hijri_year, hijri_month, 1), tzinfo=ZoneInfo("UTC")).isoformat()
 
-    out_name = f"{hijri_year}-{hijri_month:02d}-{days}-{criterion}-{resolution}.jpg"
+    out_name = _map_name(hijri_year, hijri_month, days, criterion, resolution, region)
     out_path = MAP_OUT_DIR / out_name
 
-    project_root = pathlib.Path(__file__).resolve().parent
-    mapper_script = project_root / "scripts" / "mapper.py"
-
-    # mapper.py CLI call – execute in temp dir so concurrent runs don’t clash
+    # mapper.py CLI call – execute in temp dir so concurrent runs don’t clash
     with tempfile.TemporaryDirectory() as tmp:
-        cmd = [
-            sys.executable, str(mapper_script),
-            "--today", starting_iso,
-            "--master_path", f"{tmp}/",  # mapper writes here
-            "--total_months", "1",
-            "--map_region", "WORLD",
-            "--map_mode",   "category",
-            "--resolution", str(resolution),
-            "--days_to_generate", str(days),
-            "--criterion", str(criterion),
-            "--save_logs"
-        ]
-        proc = subprocess.run(cmd, cwd=str(project_root),
+        cmd = mapper_command(starting_iso, f"{tmp}/", region, days, criterion, resolution)
+        proc = subprocess.run(cmd, cwd=str(PROJECT_ROOT),
                                         capture_output=True, text=True)
 
         if proc.returncode != 0:
             app.logger.error(proc.stderr)
-            abort(500, "Map generation error.")
+            raise MapRenderError("Map generation error.")
 
         jpgs = list(pathlib.Path(tmp).rglob("*.jpg"))
         if not jpgs:
-            abort(500, "No map produced.")
-            
+            raise MapRenderError("No map produced.")
+
         MAP_OUT_DIR.mkdir(parents=True, exist_ok=True)
         src = pathlib.Path(jpgs[0])
 
         try:
+            # Move the modern-format siblings first so a client that sees the
+            # new JPEG never gets negotiated onto a stale WebP/AVIF.
+            for variant in (src.with_suffix(".webp"), src.with_suffix(".avif")):
+                if variant.exists():
+                    os.replace(variant, out_path.with_suffix(variant.suffix))
             # If an old file with that exact name exists, atomically replace it
             os.replace(src, out_path)        # works even if out_path already exists
         except Exception as e:
             app.logger.exception(f"Failed to move generated map into static: {e}")
-            abort(500, "Server error saving map.")
+            raise MapRenderError("Server error saving map.") from e
+
+    _MAP_CACHE[cache_key] = (out_name, time.time())
+    return out_name
+
+# NOT USED
+@app.post("/generate_map")
+def generate_map():
+    """
+    Kick off mapper.py with the POSTed JSON payload and return
+    the image URL when it finishes.  Long-running -- front-end shows spinner.
+    """
+    p = request.get_json(silent=True) or {}
+    try:
+        hijri_month      = int(p["month"])        # 1‑12
+        hijri_year       = int(p["year"])         # 1‑2000 (per your UI text)
+        days             = int(p["days"])         # 1‑3    (dropdown)
+        criterion        = int(p["criterion"])    # 0 = Odeh, 1 = Yallop
+        resolution       = int(p["resolution"])   # 1‑500
+        region           = str(p.get("region", "WORLD")).upper()
+    except (KeyError, ValueError):
+        abort(400, "Bad parameters.")
+
+    if resolution < 50 or resolution > 500 or resolution % 50 != 0:
+        abort(400, "Resolution must be a multiple of 50 between 50 and 500.")
+    if region not in MAP_REGIONS:
+        abort(400, f"Region must be one of {', '.join(MAP_REGIONS)}.")
 
+    fname = cached_map(hijri_year, hijri_month, days, criterion, resolution, region)
+    if fname:
+        cache_hit("map_cache")
+        return jsonify({"url": asset_url(f"maps/{fname}")})
+    cache_miss("map_cache")
+
+    try:
+        fname = render_map(hijri_year, hijri_month, days, criterion, resolution, region)
+    except MapRenderError as e:
+        abort(500, str(e))
+    return jsonify({"url": asset_url(f"maps/{fname}")})
+
+def local_maps_index() -> list[dict]:
+    """Entries mapper.py wrote for maps rendered into MAP_OUT_DIR (scheduler.py), re-read when it changes."""
+    path = MAP_OUT_DIR / "maps_index.json"
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return []
+    cached = getattr(app, "_local_index_cache", None)
+    if cached is None or cached[1] != mtime:
+        try:
+            cached = (json.loads(path.read_text(encoding="utf-8")), mtime)
+        except (OSError, ValueError):
+            return cached[0] if cached else []
+        app._local_index_cache = cached
+    return cached[0]
 
-    _MAP_CACHE[cache_key] = (out_name, now)
-    return jsonify({"url": f"/static/maps/{out_name}"})
 
 @app.get("/maps_index")
 def maps_index():
+    """The hosted index with the locally rendered months merged in; files in
+    either are fetched through /maps/<file>."""
+    from grid_store import merge_index
+
     if not hasattr(app, "_index_cache") or time.time() - app._index_cache[1] > 3600:
+        cache_miss("maps_index")
         import requests
-        data = requests.get(MAPS_INDEX_URL, timeout=5).json()
+        with phase("outbound_http"):
+            data = requests.get(MAPS_INDEX_URL, timeout=5).json()
         app._index_cache = (data, time.time())
-    return jsonify(app._index_cache[0])
+    else:
+        cache_hit("maps_index")
+    return jsonify(merge_index(app._index_cache[0], local_maps_index()))
+
+
+@app.get("/maps/<path:name>")
+def maps_file(name):
+    """A file listed in /maps_index: from MAP_OUT_DIR when rendered here, otherwise
+    from MAPS_BASE.  GeoJSON is proxied (the page fetches it, and the maps host
+    sends no CORS headers); images are redirected, as <img> needs no CORS."""
+    from flask import send_from_directory, redirect
+    from urllib.parse import quote
+
+    if (MAP_OUT_DIR / name).is_file():
+        return send_from_directory(MAP_OUT_DIR.resolve(), name, max_age=3600)
+    url = f"{MAPS_BASE}/{quote(name)}"
+    if not name.endswith(".geojson"):
+        return redirect(url)
+
+    import requests
+    with phase("outbound_http"):
+        try:
+            r = requests.get(url, timeout=10)
+        except requests.RequestException:
+            abort(502, "Maps host unreachable.")
+    if r.status_code != 200:
+        abort(404 if r.status_code == 404 else 502)
+    return Response(r.content, mimetype="application/geo+json",
+                    headers={"Cache-Control": "public, max-age=3600"})
 
 # ---------------------------------------------------------------------------#
 # Core ITLocation builder                                                    #
 # ---------------------------------------------------------------------------#
 
 def build_itlocation(payload: dict) -> ITLocation:
-    """Create and configure an ITLocation instance from request JSON."""
+    """Create and configure an ITLocation instance from request JSON, with the
+    full sun + moon astronomy calculated."""
+    loc = configure_itlocation(payload)
+    with phase("astronomy"):
+        loc.calculate_astro()
+        loc.calculate_prayer_times()
+    return loc
+
+
+def compute_prayer_times(payload: dict) -> PrayerTimes:
+    """Prayer times for request JSON, computing only the sun.
+
+    ``calculate_astro`` also computes the moon's position, rise/transit/set and
+    illumination -- about 40% of the astronomy per request -- none of which
+    prayer times use.  This is its sun half, fed straight to the library's
+    prayer-time calculation.
+
+    Days the polar-regime map says need the high-latitude rule skip the event
+    solves that would fail, see ``_high_latitude_prayer_times``.
+    """
+    loc = configure_itlocation(payload)
+    if loc.method.extreme_lats == "NEARESTLAT" and "Makkah" in loc.method.name:
+        # the rule re-solves ʿIshāʾ from its angle; Makkah's (under any of its names)
+        # is a fixed delay after Maghrib
+        abort(400, "NEARESTLAT can't be used with the Makkah method, whose ʿIshāʾ has no angle.")
+    with phase("astronomy"):
+        dateinfo, observer = loc.observer_dateinfo, loc.observer_info
+        lat, doy = observer.latitude.decimal, dateinfo.date.timetuple().tm_yday
+        horizon = polar_regimes.regime(lat, doy, polar_regimes.HORIZON_ANGLE)
+        sun = se.sunpos(dateinfo, observer)
+        sun_info = SunInfo(
+            sunrise=_sun_event(dateinfo, observer, "rise", horizon),
+            sun_transit=se.find_sun_transit(dateinfo, observer),
+            sunset=_sun_event(dateinfo, observer, "set", horizon),
+            apparent_altitude=sun.apparent_altitude,
+            true_azimuth=sun.true_azimuth,
+            geocentric_distance=sun.geocentric_distance,
+            apparent_declination=sun.apparent_declination,
+            apparent_right_ascension=sun.apparent_right_ascension,
+            greenwich_hour_angle=sun.greenwich_hour_angle,
+            local_hour_angle=sun.local_hour_angle,
+        )
+        if abs(lat) > EXTREME_LATITUDE:
+            missing = _missing_events(lat, doy, loc.method, horizon)
+            if missing:
+                return _high_latitude_prayer_times(dateinfo, observer, sun_info, loc.method, missing)
+        try:
+            return pt.calculate_prayer_times(dateinfo, observer, sun_info, loc.method)
+        except (ArithmeticError, TypeError):
+            # the library applies the rule itself here, and can fail the same way
+            _rule_failed(loc.method)
+
+
+def _rule_failed(method):
+    """The high-latitude rule has no answer for this method on this day: a bad request, not a crash."""
+    abort(422, f"The {method.extreme_lats} high-latitude rule can't be applied to this method "
+               f"at this latitude and date.")
+
+
+def _sun_event(dateinfo, observer, event: str, regime: int = polar_regimes.EXISTS):
+    # same fallback as ITLocation's own sunrise/sunset
+    if regime in (polar_regimes.ALWAYS_ABOVE, polar_regimes.ALWAYS_BELOW):
+        return f"Sun{event} does not exist."
+    try:
+        return se.find_proper_suntime(dateinfo, observer, event)
+    except ArithmeticError:
+        return f"Sun{event} does not exist."
+
+
+def _missing_events(lat: float, doy: int, method, horizon: int) -> set | None:
+    """Events the polar-regime map says can't be solved for on this day, or None
+    if any of them is too close to a regime boundary to tell without solving."""
+    events = {"fajr": method.fajr_angle.decimal, "sunrise": polar_regimes.HORIZON_ANGLE,
+              "sunset": polar_regimes.HORIZON_ANGLE}
+    if method.maghrib_angle.decimal > 0:
+        events["maghrib"] = method.maghrib_angle.decimal
+    if "Makkah" not in method.name:           # Makkah's ʿIshāʾ is a fixed delay after Maghrib
+        events["isha"] = method.isha_angle.decimal
+    missing = set()
+    for name, angle in events.items():
+        regime = horizon if angle == polar_regimes.HORIZON_ANGLE else polar_regimes.regime(lat, doy, angle)
+        if regime == polar_regimes.BORDERLINE:
+            return None
+        if regime != polar_regimes.EXISTS:
+            missing.add(name)
+    return missing
+
+
+def _high_latitude_prayer_times(dateinfo, observer, sun_info: SunInfo, method, missing: set) -> PrayerTimes:
+    """``pt.calculate_prayer_times`` for a day that needs the high-latitude rule.
+
+    Events in ``missing`` are not solved for -- the library's solve would only
+    fail -- and neither is Midnight, which every rule recomputes.  The rule
+    itself is the library's ``extreme_latitudes``, so results are the same.
+    """
+    def solve(name, event, angle):
+        if name in missing:
+            return math.inf
+        try:
+            return pt.safe_sun_time(dateinfo, observer, event, angle)
+        except ArithmeticError:
+            return math.inf
+
+    fajr = solve("fajr", "rise", method.fajr_angle)
+    try:
+        asr = pt.asr_time(sun_info.sun_transit, observer.latitude, sun_info.apparent_declination, method.asr_type)
+    except ArithmeticError as e:
+        asr = str(e)
+
+    if method.maghrib_angle.decimal > 0:
+        maghrib = solve("maghrib", "set", method.maghrib_angle)
+    elif isinstance(sun_info.sunset, datetime):
+        maghrib = sun_info.sunset + timedelta(minutes=1)
+    else:
+        maghrib = math.inf
+
+    if "Makkah" not in method.name:
+        isha = solve("isha", "set", method.isha_angle)
+        if isinstance(isha, datetime) and isha.time() < sun_info.sun_transit.time() \
+                and isha.day == sun_info.sun_transit.day:
+            try:
+                isha = pt.find_tomorrow_time(dateinfo, observer, method.isha_angle, "set")
+            except ArithmeticError:
+                isha = math.inf
+    elif isinstance(maghrib, datetime):
+        isha = maghrib + timedelta(hours=2 if dateinfo.hijri is not None and dateinfo.hijri.hijri_month == 9 else 1.5)
+    else:
+        isha = math.inf                         # no Maghrib to count from; the rule fills it in
+
+    times = (fajr, sun_info.sunrise, sun_info.sun_transit, asr, sun_info.sunset, maghrib, isha, math.inf)
+    try:
+        prayers = pt.extreme_latitudes(dateinfo, observer,
+                                       [Prayer(name, t, method) for name, t in zip(PRAYER_NAMES, times)],
+                                       sun_info.apparent_declination)
+    except (ArithmeticError, TypeError):
+        _rule_failed(method)
+    return PrayerTimes(method, *prayers,
+                       extreme_latitude_applied=True,
+                       extreme_latitude_rule=method.extreme_lats,
+                       extreme_latitude_reason=EXTREME_LATITUDE_REASON)
+
+
+def configure_itlocation(payload: dict) -> ITLocation:
+    """Create an ITLocation from request JSON with its method set; no astronomy yet."""
     lat = float(payload["lat"])
     lon = float(payload["lon"])
 
-    date_str = payload.get("date")
-    tz = lookup_tz(lat, lon)
+    with phase("tz_lookup"):
+        tz = lookup_tz(lat, lon)
 
     date_str = payload.get("date")
     if date_str:
@@ -201,11 +485,15 @@ def build_itlocation(payload: dict) -> ITLocation:
     else:
         base_dt = datetime.now(tz)
 
-    loc = ITLocation(
-        latitude       = lat,
-        longitude      = lon,
-        date           = base_dt,
-    )
+    # auto_calculate=False: the method below would otherwise trigger a second
+    # prayer computation; the astronomy runs once at the end.
+    with phase("itlocation"):
+        loc = ITLocation(
+            latitude       = lat,
+            longitude      = lon,
+            date           = base_dt,
+            auto_calculate = False,
+        )
 
     # ── advanced / method settings ──
     m = payload.get("method", {})
@@ -228,12 +516,47 @@ def build_itlocation(payload: dict) -> ITLocation:
         if "midnight_type" in m:
             loc.set_midnight_type(int(m["midnight_type"]))
 
+    # high-latitude rule, one of EXTREME_LATITUDE_RULES; ANGLEBASED is the library default
+    if m.get("extreme_lats"):
+        loc.set_extreme_latitude_rule(str(m["extreme_lats"]))
+
     return loc
 
 # ---------------------------------------------------------------------------#
 # Routes                                                                     #
 # ---------------------------------------------------------------------------#
 
+@app.get("/vis_stats")
+def vis_stats():
+    """Category area fractions (region box, land, per country), eastern limits as
+    GeoJSON and per-city categories, from the stored grid behind a rendered map."""
+    import region_stats
+    import islamic_times.astro_core as fast_astro
+    try:
+        hijri_year  = int(request.args["year"])
+        hijri_month = int(request.args["month"])
+        day         = int(request.args.get("day", 1))
+        criterion   = int(request.args.get("criterion", 1))
+        resolution  = int(request.args.get("resolution", 300))
+        region      = request.args.get("region", "WORLD").upper()
+    except (KeyError, ValueError):
+        abort(400, "Need year & month (and optionally day, criterion, resolution, region).")
+    if region not in MAP_REGIONS:
+        abort(400, f"Region must be one of {', '.join(MAP_REGIONS)}.")
+    if criterion not in (0, 1) or not 1 <= day <= 3 or not 1 <= hijri_month <= 12:
+        abort(400, "Bad day, month or criterion.")
+
+    # the conjunction mapper.py derives for render_map's --today
+    start = datetime.replace(hijri_to_gregorian(hijri_year, hijri_month, 1), tzinfo=ZoneInfo("UTC"))
+    with phase("astronomy"):
+        conjunction = fast_astro.next_phases_of_moon_utc(start)[0]
+    with phase("grid_stats"):     # grid-store reads and reductions, no astronomy
+        stats = region_stats.region_stats(conjunction, region, resolution, criterion, day - 1)
+    if stats is None:
+        abort(404, "No stored grid for that map yet.")
+    with phase("serialization"):
+        return jsonify(stats)
+
 @app.post("/vis_calc")
 def vis_calc():
     payload = request.get_json(silent=True) or {}
@@ -247,28 +570,36 @@ def vis_calc():
 
     g_date = hijri_to_gregorian(hijri_year, hijri_month, 1)
 
-    # Build ITLocation (using Yallop, 3-day default)
-    loc = ITLocation(
-        latitude  = lat,
-        longitude = lon,
-        elevation = 0.0,
-        temperature = 15.0,
-        pressure = 101.325,
-        date = g_date,
-        find_local_tz=True
-    )
-    vis: Visibilities = loc.visibilities()
+    # Build ITLocation (using Yallop, 3-day default); the tz lookup happens inside
+    with phase("itlocation"):
+        loc = ITLocation(
+            latitude  = lat,
+            longitude = lon,
+            elevation = 0.0,
+            temperature = 15.0,
+            pressure = 101.325,
+            date = g_date,
+            find_local_tz=True,
+            auto_calculate=False,
+        )
+    with phase("astronomy"):
+        vis: Visibilities = loc.visibilities()
 
     # Build JSON directly from the dataclass attributes
+    with phase("serialization"):
+        return _vis_response(vis)
+
+def _split_classification(cls: str) -> tuple[str, str]:
+    parts = cls.split(": ", 1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    # No colon (e.g. "-998.0 Moonset before sunset.")
+    return "X", parts[0]
+
+def _vis_response(vis: Visibilities):
     entries = []
     for dt, q, cls in zip(vis.dates, vis.q_values, vis.classifications):
-        parts = cls.split(": ", 1)
-        if len(parts) == 2:
-            cat, desc = parts
-        else:
-            # No colon (e.g. "-998.0 Moonset before sunset.")
-            cat = "X"
-            desc = parts[0]
+        cat, desc = _split_classification(cls)
         entries.append({
             "datetime":    dt.strftime("%X %d-%m-%Y"),
             "q":           f"{q:+.3f}",
@@ -281,6 +612,64 @@ def vis_calc():
         "entries":   entries
     })
 
+VIS_RANGE_MAX_MONTHS = 24
+
+@app.post("/vis_range")
+def vis_range():
+    """Crescent visibility at one location for ``months`` consecutive Hijri months
+    from (hijri_year, hijri_month), as parallel columns with one row per evening.
+
+    Same observer model as /vis_calc, but the tz lookup is done once (per-month
+    UTC offsets come from it, so DST is still right) and no ITLocation is built.
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        lat = float(payload["lat"])
+        lon = float(payload["lon"])
+        hijri_month = int(payload["hijri_month"])
+        hijri_year  = int(payload["hijri_year"])
+        months      = int(payload.get("months", 12))
+        days        = int(payload.get("days", 3))
+        criterion   = int(payload.get("criterion", 1))
+    except (KeyError, TypeError, ValueError):
+        abort(400, "Need lat, lon, hijri_month & hijri_year in JSON.")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        abort(400, "lat/lon out of range.")
+    if not (1 <= hijri_month <= 12 and hijri_year >= 1):
+        abort(400, "Bad Hijri month.")
+    if not 1 <= months <= VIS_RANGE_MAX_MONTHS:
+        abort(400, f"months must be between 1 and {VIS_RANGE_MAX_MONTHS}.")
+    if not 1 <= days <= 3:
+        abort(400, "days must be between 1 and 3.")
+    if criterion not in (0, 1, 2):
+        abort(400, "criterion must be 0, 1 or 2.")
+
+    import islamic_times.astro_core as fast_astro
+
+    with phase("tz_lookup"):
+        tz = lookup_tz(lat, lon)
+
+    cols = {k: [] for k in ("hijri_year", "hijri_month", "datetime", "q", "category", "description")}
+    name = None
+    with phase("astronomy"):
+        for i in range(months):
+            y, m = hijri_year + (hijri_month - 1 + i) // 12, (hijri_month - 1 + i) % 12 + 1
+            date = hijri_to_gregorian(y, m, 1).replace(tzinfo=tz)
+            vis = fast_astro.compute_visibilities(date, date.utcoffset().total_seconds() / 3600,
+                                                  lat, lon, 0.0, 15.0, 101.325, days, criterion)
+            name = vis.criterion
+            for dt, q, cls in zip(vis.dates, vis.q_values, vis.classifications):
+                cat, desc = _split_classification(cls)
+                cols["hijri_year"].append(y)
+                cols["hijri_month"].append(m)
+                cols["datetime"].append(dt.strftime("%X %d-%m-%Y"))
+                cols["q"].append(round(float(q), 3))
+                cols["category"].append(cat)
+                cols["description"].append(desc)
+
+    with phase("serialization"):
+        return jsonify({"criterion": name, "timezone": str(tz), "days": days, **cols})
+
 # ---------------------------------------------------------------------------#
 # Routes                                                                     #
 # ---------------------------------------------------------------------------#
@@ -299,10 +688,43 @@ def prayer_times():
     payload = request.get_json(silent=True) or {}
     if "lat" not in payload or "lon" not in payload:
         abort(400, "JSON must include lat & lon.")
+    rule = (payload.get("method") or {}).get("extreme_lats")
+    if rule and str(rule).strip().upper() not in EXTREME_LATITUDE_RULES:
+        abort(400, f"extreme_lats must be one of {', '.join(EXTREME_LATITUDE_RULES)}.")
 
-    loc = build_itlocation(payload)
-    times = loc.prayer_times()  # returns PrayerTimes dataclass
-
+    if payload.get("date"):
+        # dated requests (what the front-end sends) go through the shared cache
+        try:
+            lat = round(float(payload["lat"]), PRAYER_COORD_DECIMALS)
+            lon = round(float(payload["lon"]), PRAYER_COORD_DECIMALS)
+        except (TypeError, ValueError):
+            abort(400, "lat & lon must be numbers.")
+        method_json = json.dumps(payload.get("method", {}), sort_keys=True)
+        out = cached_prayer_times(lat, lon, str(payload["date"]), method_json)
+        with phase("serialization"):
+            return jsonify(out)
+
+    times = compute_prayer_times(payload)
+
+    with phase("serialization"):
+        return jsonify(_prayer_dict(times))
+
+@counted_lru_cache("prayer_times", maxsize=4096)
+def cached_prayer_times(lat: float, lon: float, date_str: str, method_json: str) -> dict:
+    """Prayer-time response for one (rounded location, date, method); shared, don't mutate.
+
+    Also filled ahead of time by the scheduler, which shares what it computed
+    with every worker (see scheduler.py).
+    """
+    import scheduler
+    warmed = scheduler.warmed(lat, lon, date_str, method_json)
+    if warmed is not None:
+        return warmed
+    times = compute_prayer_times({"lat": lat, "lon": lon, "date": date_str,
+                                  "method": json.loads(method_json)})
+    return _prayer_dict(times)
+
+def _prayer_dict(times) -> dict:
     # build out each prayer, catching inf→message
     out = {}
     for key in ("fajr","sunrise","zuhr","asr","sunset","maghrib","isha","midnight"):
@@ -319,7 +741,13 @@ def prayer_times():
         "isha_angle":     {"decimal": getattr(m, "isha_angle", None)},
     }
 
-    return jsonify(out)
+    return out
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    data, content_type = metrics.render()
+    return Response(data, content_type=content_type)
 
 
 @app.get("/__debug/gunicorn_args")
@@ -330,7 +758,27 @@ def _debug_gunicorn_args():
     })
 
 
+# ---------------------------------------------------------------------------#
+# Preloading                                                                 #
+# ---------------------------------------------------------------------------#
+
+def preload_shared_state():
+    """Load heavy read-only state up front so forked workers share it copy-on-write."""
+    import requests  # noqa: F401 -- module import cost paid once in the master
+    get_tf()
+    lookup_tz(21.4225, 39.8262)
+    # first ITLocation pages in the C core and the library's lookup tables
+    ITLocation(latitude=21.4225, longitude=39.8262,
+               date=datetime(2025, 1, 1, tzinfo=ZoneInfo("UTC"))).prayer_times()
+    polar_regimes.regime(60.0, 172, 18.0)   # builds the polar-regime table
+
+if PRELOAD:
+    preload_shared_state()
+
 # ---------------------------------------------------------------------------#
 
 if __name__ == "__main__":
+    if os.getenv("SCHEDULER_ENABLED", "0") == "1":
+        import scheduler
+        scheduler.start_background()
     app.run(debug=False)
@@ -0,0 +1,153 @@
+"""
+Static asset serving: content-hashed URLs, precompressed variants and
+long-lived cache headers for everything under ``static/`` (generated maps
+included).
+
+Run ``python assets.py`` at build time to write the ``.br`` / ``.gz``
+siblings of every text asset.
+"""
+import gzip, hashlib, mimetypes, os, pathlib, sys
+from functools import lru_cache
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+STATIC_DIR = pathlib.Path(__file__).resolve().parent / "static"
+
+IMMUTABLE     = "public, max-age=31536000, immutable"
+REVALIDATE    = "public, max-age=0, must-revalidate"
+
+COMPRESSIBLE  = (".js", ".css", ".svg", ".json", ".webmanifest")
+ENCODINGS     = (("br", ".br"), ("gzip", ".gz"))              # preference order
+IMAGE_VARIANTS = {                                            # jpg → modern formats
+    ".jpg":  (("image/avif", ".avif"), ("image/webp", ".webp")),
+    ".jpeg": (("image/avif", ".avif"), ("image/webp", ".webp")),
+}
+
+# ---------------------------------------------------------------------------#
+# Hashed URLs                                                                #
+# ---------------------------------------------------------------------------#
+
+@lru_cache(maxsize=1024)
+def _digest(path: str, mtime_ns: int, size: int) -> str:
+    """sha256 prefix of a file; (mtime, size) in the key invalidates on rewrite."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+def file_hash(filename: str) -> str | None:
+    """Content hash of ``static/<filename>``, or None if it doesn't exist."""
+    path = safe_join(str(STATIC_DIR), filename)
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _digest(path, st.st_mtime_ns, st.st_size)
+
+
+def asset_url(filename: str) -> str:
+    """``/static/<filename>?v=<hash>`` -- safe to cache forever."""
+    v = file_hash(filename)
+    url = f"/static/{filename}"
+    return f"{url}?v={v}" if v else url
+
+# ---------------------------------------------------------------------------#
+# Serving                                                                    #
+# ---------------------------------------------------------------------------#
+
+def _fresh_variant(path: str, variant: str) -> str | None:
+    """``variant`` if it exists and isn't older than ``path``."""
+    try:
+        if os.stat(variant).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return variant
+    except OSError:
+        pass
+    return None
+
+
+def serve_static(filename: str):
+    """Replacement for Flask's ``static`` endpoint."""
+    path = safe_join(str(STATIC_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    base, ext = os.path.splitext(path)
+    ext = ext.lower()
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    chosen, encoding, vary = path, None, None
+
+    if ext in IMAGE_VARIANTS:
+        vary = "Accept"
+        accept = request.headers.get("Accept", "")
+        for mime, suffix in IMAGE_VARIANTS[ext]:
+            variant = _fresh_variant(path, base + suffix) if mime in accept else None
+            if variant:
+                chosen, mimetype = variant, mime
+                break
+    elif ext in COMPRESSIBLE:
+        vary = "Accept-Encoding"
+        accepted = request.headers.get("Accept-Encoding", "")
+        for enc, suffix in ENCODINGS:
+            variant = _fresh_variant(path, path + suffix) if enc in accepted else None
+            if variant:
+                chosen, encoding = variant, enc
+                break
+
+    resp = send_file(chosen, mimetype=mimetype, conditional=True, etag=True)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if vary:
+        resp.vary.add(vary)
+
+    # Only a URL carrying the current content hash may be cached forever;
+    # bare or stale URLs (e.g. a map regenerated under the same name) revalidate.
+    if request.args.get("v") and request.args.get("v") == file_hash(filename):
+        resp.headers["Cache-Control"] = IMMUTABLE
+    else:
+        resp.headers["Cache-Control"] = REVALIDATE
+    return resp
+
+
+def init_app(app):
+    """Route ``/static/...`` through :func:`serve_static` and expose ``asset_url``."""
+    app.view_functions["static"] = serve_static
+    app.jinja_env.globals["asset_url"] = asset_url
+
+# ---------------------------------------------------------------------------#
+# Build step                                                                 #
+# ---------------------------------------------------------------------------#
+
+def precompress(path: pathlib.Path) -> list[pathlib.Path]:
+    """Write ``.gz`` (and ``.br`` when brotli is installed) next to ``path``."""
+    data = path.read_bytes()
+    written = []
+
+    gz = path.with_name(path.name + ".gz")
+    gz.write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    written.append(gz)
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if brotli is not None:
+        br = path.with_name(path.name + ".br")
+        br.write_bytes(brotli.compress(data, quality=11))
+        written.append(br)
+    return written
+
+
+def build(static_dir: pathlib.Path = STATIC_DIR) -> None:
+    for path in sorted(static_dir.rglob("*")):
+        if path.is_file() and path.suffix.lower() in COMPRESSIBLE:
+            for out in precompress(path):
+                print(f"{out.relative_to(static_dir)}: {path.stat().st_size} -> {out.stat().st_size} bytes")
+
+
+if __name__ == "__main__":
+    build(pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else STATIC_DIR)
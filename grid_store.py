@@ -0,0 +1,373 @@
+"""
+On-disk store of mapper visibility grids, so a changed map only recomputes
+what actually changed.
+
+Astronomy results are kept one day at a time, keyed by (conjunction, region,
+resolution, criterion, mode)::
+
+    GRID_STORE/<conjunction>/<REGION>_<resolution>_c<criterion>_<mode>/day<N>.npy
+                                                                    .../meta.json
+
+``meta.json`` records the grid axes, the ``islamic_times`` version and a
+content hash per day; a day whose axes or library version no longer match is
+treated as missing.  A region can also be sliced out of any stored grid for the
+same conjunction that covers its bounding box on an equal-or-finer lattice
+(normally the WORLD grid), instead of being recomputed.
+
+Renders are recorded in ``renders.json`` next to the images, keyed by
+(grid hash, overlay hash, style), so only images whose inputs changed are
+plotted again.  Finished months are listed in ``maps_index.json`` at the root
+of the output tree, in the format the visibilities page reads.
+
+A multi-month mapper run checkpoints its progress under ``GRID_STORE/_runs/``
+(see RunCheckpoint), so a crashed or killed run only redoes the unfinished
+latitude chunks of the month it was in.
+"""
+import os, json, time, fcntl, shutil, hashlib, pathlib
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+from importlib.metadata import version, PackageNotFoundError
+
+GRID_STORE = pathlib.Path(os.getenv("GRID_STORE", pathlib.Path(__file__).resolve().parent / "grids"))
+
+try:
+    ENGINE_VERSION = version("islamic_times")
+except PackageNotFoundError:
+    ENGINE_VERSION = "unknown"
+
+# Axis values are linspace outputs; compare them with a tolerance well below any grid step.
+AXIS_TOL = 1e-6
+
+
+class GridKey(NamedTuple):
+    conjunction: datetime
+    region: str
+    resolution: int
+    criterion: int
+    mode: str
+
+    @property
+    def dirname(self) -> str:
+        return f"{self.region}_{self.resolution}_c{self.criterion}_{self.mode}"
+
+
+def _conj_dir(root: pathlib.Path, conjunction: datetime) -> pathlib.Path:
+    return root / conjunction.strftime("%Y%m%dT%H%M%S")
+
+
+def _same_axis(a, b) -> bool:
+    return len(a) == len(b) and np.allclose(a, b, rtol=0, atol=AXIS_TOL)
+
+
+def _axis_slice(axis: np.ndarray, lo: float, hi: float) -> slice | None:
+    """Index range of ``axis`` covering [lo, hi], or None if the axis doesn't reach."""
+    if axis[0] > lo + AXIS_TOL or axis[-1] < hi - AXIS_TOL:
+        return None
+    start = int(np.searchsorted(axis, lo - AXIS_TOL))
+    stop  = int(np.searchsorted(axis, hi + AXIS_TOL, side="right"))
+    return slice(start, stop)
+
+# ---------------------------------------------------------------------------#
+# Grids                                                                      #
+# ---------------------------------------------------------------------------#
+
+class GridStore:
+    def __init__(self, root: str | os.PathLike = GRID_STORE):
+        self.root = pathlib.Path(root)
+
+    def _dir(self, key: GridKey) -> pathlib.Path:
+        return _conj_dir(self.root, key.conjunction) / key.dirname
+
+    def meta(self, key: GridKey) -> dict | None:
+        try:
+            meta = json.loads((self._dir(key) / "meta.json").read_text())
+        except (OSError, ValueError):
+            return None
+        if meta.get("engine") != ENGINE_VERSION:
+            return None
+        return meta
+
+    def available_days(self, key: GridKey, lon_vals, lat_vals) -> set[int]:
+        """Days stored for ``key`` on exactly this lattice."""
+        meta = self.meta(key)
+        if meta is None or not (_same_axis(meta["lon"], lon_vals) and _same_axis(meta["lat"], lat_vals)):
+            return set()
+        d = self._dir(key)
+        return {int(day) for day in meta["days"] if (d / f"day{day}.npy").exists()}
+
+    def load_day(self, key: GridKey, day: int) -> np.ndarray:
+        return np.load(self._dir(key) / f"day{day}.npy", mmap_mode="r")
+
+    def read_rows(self, key: GridKey, day: int, rows: slice, cols: slice = slice(None)) -> np.ndarray:
+        """In-memory copy of a band of one stored day; the file is unmapped again at once."""
+        mm = self.load_day(key, day)
+        band = np.array(mm[rows, cols])
+        del mm
+        return band
+
+    def save_day(self, key: GridKey, day: int, arr, lon_vals, lat_vals, band_rows: int | None = None) -> str:
+        """Store one day's (ny, nx) grid, copying ``band_rows`` rows at a time from
+        anything row-sliceable.  Writes are atomic and idempotent: saving the same
+        result twice leaves the same file and hash."""
+        d = self._dir(key)
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / f".day{day}.{os.getpid()}.npy"
+        ny = arr.shape[0]
+        step = band_rows or ny
+        h = hashlib.sha1()
+        with open(tmp, "wb") as f:
+            np.lib.format.write_array_header_1_0(f, {
+                "descr": np.lib.format.dtype_to_descr(np.dtype(arr.dtype)),
+                "fortran_order": False, "shape": tuple(arr.shape)})
+            for r in range(0, ny, step):
+                band = np.ascontiguousarray(arr[r:r + step])
+                h.update(band.data)
+                f.write(band.data)
+        os.replace(tmp, d / f"day{day}.npy")
+        digest = h.hexdigest()
+
+        with open(d / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            meta = self.meta(key)
+            if meta is None or not (_same_axis(meta["lon"], lon_vals) and _same_axis(meta["lat"], lat_vals)):
+                meta = {"engine": ENGINE_VERSION,
+                        "lon": [float(x) for x in lon_vals], "lat": [float(y) for y in lat_vals],
+                        "days": {}}
+            meta["days"][str(day)] = digest
+            tmp_meta = d / f".meta.{os.getpid()}.json"
+            tmp_meta.write_text(json.dumps(meta))
+            os.replace(tmp_meta, d / "meta.json")
+        return digest
+
+    def grid_hash(self, key: GridKey, days: int) -> str:
+        """Hash of days 0..days-1 of a stored grid (identifies a render's input)."""
+        meta = self.meta(key) or {"days": {}}
+        parts = [meta["days"].get(str(d), "") for d in range(days)]
+        return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+    def find_covering(self, key: GridKey, bounds, lon_step: float, lat_step: float, days: int):
+        """Stored grid for the same conjunction/criterion/mode that covers ``bounds``
+        with every requested day on a lattice at least as fine as the given steps.
+
+        Returns ``(source_key, lon_vals, lat_vals, (lat_slice, lon_slice))`` for
+        the coarsest such grid, or None.
+        """
+        minx, maxx, miny, maxy = bounds
+        best = None
+        conj_dir = _conj_dir(self.root, key.conjunction)
+        if not conj_dir.is_dir():
+            return None
+        for d in conj_dir.iterdir():
+            try:
+                region, res, crit, mode = d.name.rsplit("_", 3)
+                src = GridKey(key.conjunction, region, int(res), int(crit[1:]), mode)
+            except ValueError:
+                continue
+            if src == key or src.criterion != key.criterion or src.mode != key.mode:
+                continue
+            meta = self.meta(src)
+            if meta is None or not all(str(day) in meta["days"] for day in range(days)):
+                continue
+            lon, lat = np.asarray(meta["lon"]), np.asarray(meta["lat"])
+            if len(lon) < 2 or len(lat) < 2:
+                continue
+            src_lon_step, src_lat_step = lon[1] - lon[0], lat[1] - lat[0]
+            if src_lon_step > lon_step + AXIS_TOL or src_lat_step > lat_step + AXIS_TOL:
+                continue
+            lon_sl, lat_sl = _axis_slice(lon, minx, maxx), _axis_slice(lat, miny, maxy)
+            if lon_sl is None or lat_sl is None:
+                continue
+            cells = (lon_sl.stop - lon_sl.start) * (lat_sl.stop - lat_sl.start)
+            if best is None or cells < best[0]:
+                best = (cells, src, lon[lon_sl], lat[lat_sl], (lat_sl, lon_sl))
+        return None if best is None else best[1:]
+
+# ---------------------------------------------------------------------------#
+# Renders                                                                    #
+# ---------------------------------------------------------------------------#
+
+def overlay_hash(bounds, cities, *paths) -> str:
+    """Identity of everything drawn over the grid: region box, city list, shapefiles."""
+    h = hashlib.sha1(json.dumps([list(bounds), sorted(cities)]).encode())
+    for p in paths:
+        for sibling in sorted(pathlib.Path(p).parent.glob(pathlib.Path(p).stem + ".*")):
+            st = sibling.stat()
+            h.update(f"{sibling.name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def render_key(grid: str, overlay: str, style: str) -> dict:
+    return {"grid": grid, "overlay": overlay, "style": style}
+
+
+def render_is_current(out_dir: str | os.PathLike, name: str, key: dict) -> bool:
+    out_dir = pathlib.Path(out_dir)
+    try:
+        manifest = json.loads((out_dir / "renders.json").read_text())
+    except (OSError, ValueError):
+        return False
+    return manifest.get(name) == key and (out_dir / name).exists()
+
+
+def record_render(out_dir: str | os.PathLike, name: str, key: dict):
+    out_dir = pathlib.Path(out_dir)
+    path = out_dir / "renders.json"
+    with open(out_dir / ".renders.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            manifest = json.loads(path.read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        manifest[name] = key
+        tmp = out_dir / f".renders.{os.getpid()}.json"
+        tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp, path)
+
+# ---------------------------------------------------------------------------#
+# Maps index                                                                 #
+# ---------------------------------------------------------------------------#
+
+# Entries identify a month's maps by these fields; the first two are all the
+# hosted index has, the rest default to what it holds (WORLD, Yallop, category).
+INDEX_FIELDS = (("year", None), ("month", None), ("region", "WORLD"), ("criterion", 1), ("mode", "category"))
+
+
+def index_key(entry: dict) -> tuple:
+    return tuple(entry.get(field, default) for field, default in INDEX_FIELDS)
+
+
+def merge_index(entries: list[dict], updates: list[dict]) -> list[dict]:
+    """``entries`` with each update merged into the entry for the same month
+    (its fields win), or appended."""
+    merged = {index_key(e): dict(e) for e in entries}
+    for u in updates:
+        merged.setdefault(index_key(u), {}).update(u)
+    return list(merged.values())
+
+
+def record_index(master_path: str | os.PathLike, entry: dict):
+    """Merge ``entry`` into ``maps_index.json`` at the root of ``master_path``,
+    the index the visibilities page reads (paths in it are relative to that root)."""
+    root = pathlib.Path(master_path)
+    path = root / "maps_index.json"
+    with open(root / ".maps_index.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entries = []
+        entries = merge_index(entries, [entry])
+        tmp = root / f".maps_index.{os.getpid()}.json"
+        tmp.write_text(json.dumps(entries, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+# ---------------------------------------------------------------------------#
+# Run checkpoints                                                            #
+# ---------------------------------------------------------------------------#
+
+# Checkpoints of runs that were abandoned (never resumed) are pruned after this long.
+RUN_MAX_AGE = 7 * 24 * 3600
+
+
+def _prune_runs(runs: pathlib.Path):
+    for d in runs.iterdir():
+        try:
+            if time.time() - d.stat().st_mtime < RUN_MAX_AGE:
+                continue
+            with open(d / ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                shutil.rmtree(d)
+        except OSError:         # in use, or already gone
+            continue
+
+
+class RunCheckpoint:
+    """
+    Progress of one mapper run, in ``GRID_STORE/_runs/<run id>/manifest.json``.
+
+    The run id hashes the run's parameters, so re-running the same command
+    resumes it: finished months are skipped, and for the month in progress the
+    latitude chunks already written to ``partial.dat`` are not recomputed.  The
+    directory is removed once every month is done.  Only one process can hold a
+    given run at a time.
+    """
+    def __init__(self, params: dict, root: str | os.PathLike = GRID_STORE, restart: bool = False):
+        runs = pathlib.Path(root) / "_runs"
+        runs.mkdir(parents=True, exist_ok=True)
+        _prune_runs(runs)
+        self.id = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        self.dir = runs / self.id
+        self.dir.mkdir(exist_ok=True)
+        self._lock = open(self.dir / ".lock", "w")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            raise RuntimeError(f"another mapper run with the same parameters is using {self.dir}")
+
+        self.manifest = None
+        if not restart:
+            try:
+                self.manifest = json.loads((self.dir / "manifest.json").read_text())
+            except (OSError, ValueError):
+                pass
+        if self.manifest is None:
+            (self.dir / "partial.dat").unlink(missing_ok=True)
+            self.manifest = {"params": params, "started": datetime.now().isoformat(),
+                             "months": {}, "partial": None}
+            self._save()
+
+    def _save(self):
+        tmp = self.dir / f".manifest.{os.getpid()}.json"
+        tmp.write_text(json.dumps(self.manifest, indent=2, default=str))
+        os.replace(tmp, self.dir / "manifest.json")
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.manifest["months"] or self.manifest["partial"])
+
+    def month_done(self, conjunction: datetime) -> bool:
+        return conjunction.isoformat() in self.manifest["months"]
+
+    def finish_month(self, conjunction: datetime):
+        self.manifest["months"][conjunction.isoformat()] = datetime.now().isoformat()
+        self._save()
+
+    def partial(self, tag: str, shape, dtype) -> tuple[str, np.ndarray]:
+        """Backing file for a grid computed in latitude chunks.
+
+        Returns ``(path, done)``, ``done`` being a boolean mask of the rows
+        already written.  If the interrupted run was computing the same grid
+        (``tag``), its file and finished rows are reused, whatever chunk size
+        it used; otherwise a fresh file is created."""
+        tag = f"{tag}|{tuple(shape)}|{np.dtype(dtype).str}"
+        path = self.dir / "partial.dat"
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        done = np.zeros(shape[0], dtype=bool)
+        p = self.manifest["partial"]
+        if p and p["tag"] == tag and path.exists() and path.stat().st_size == size:
+            for r0, r1 in p["done"]:
+                done[r0:r1] = True
+            return str(path), done
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self.manifest["partial"] = {"tag": tag, "done": []}
+        self._save()
+        return str(path), done
+
+    def chunk_done(self, r0: int, r1: int):
+        """Record rows ``r0:r1`` as finished; they must already be on disk."""
+        self.manifest["partial"]["done"].append([r0, r1])
+        self._save()
+
+    def drop_partial(self):
+        (self.dir / "partial.dat").unlink(missing_ok=True)
+        self.manifest["partial"] = None
+        self._save()
+
+    def close(self, remove: bool = True):
+        if remove:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        self._lock.close()
@@ -0,0 +1,57 @@
+# Loaded automatically by gunicorn from the working directory; command-line
+# flags (Procfile, Dockerfile, GUNICORN_CMD_ARGS) still take precedence.
+import os, glob, shutil, tempfile
+
+# ---------------------------------------------------------------------------#
+# Prometheus multiprocess metrics                                            #
+# ---------------------------------------------------------------------------#
+# Must be set before any worker imports prometheus_client (see metrics.py).
+# Without one from the operator, a fresh temp directory is made here (and
+# removed at exit).  An operator's directory is only cleared of the sample
+# files (*.db), so samples from a previous run don't leak in.
+_OWN_PROM_DIR = "ISLAMICTIMES_OWN_METRICS_DIR"     # marks the directory as ours across config reloads
+
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR") is None:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = os.environ[_OWN_PROM_DIR] = \
+        tempfile.mkdtemp(prefix="islamictimes_metrics_")
+_prom_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+os.makedirs(_prom_dir, exist_ok=True)
+for _db in glob.glob(os.path.join(_prom_dir, "*.db")):
+    os.remove(_db)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if os.environ.get(_OWN_PROM_DIR) == _prom_dir:
+        shutil.rmtree(_prom_dir, ignore_errors=True)
+
+# ---------------------------------------------------------------------------#
+# Preload mode                                                               #
+# ---------------------------------------------------------------------------#
+# PRELOAD_APP=1 imports app.py once in the master (which then builds the tz
+# data, imports and warms islamic_times -- see app.preload_shared_state) and
+# forks the workers from it, so that state is shared copy-on-write.
+preload_app = os.getenv("PRELOAD_APP", "0") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far out of the GC's reach: collections in
+        # the workers would otherwise touch (and so un-share) those pages.
+        import gc
+        gc.freeze()
+
+# ---------------------------------------------------------------------------#
+# Scheduler                                                                  #
+# ---------------------------------------------------------------------------#
+# SCHEDULER_ENABLED=1 starts scheduler.py's loop in each worker; only the one
+# holding its lock file runs it, and another takes over when that worker exits.
+
+def post_worker_init(worker):
+    if os.getenv("SCHEDULER_ENABLED", "0") == "1":
+        import scheduler
+        scheduler.start_background()
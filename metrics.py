@@ -0,0 +1,146 @@
+"""
+Prometheus metrics for the request hot paths, caches and the mapper.
+
+Works across gunicorn workers through prometheus_client's multiprocess mode:
+``gunicorn.conf.py`` points ``PROMETHEUS_MULTIPROC_DIR`` at a cleared directory
+before any worker (or mapper subprocess) imports this module, and ``/metrics``
+aggregates every process's samples from there.  Without that variable (e.g.
+``python app.py``) the default in-process registry is used.
+"""
+import os, functools
+from time import perf_counter, time
+from contextlib import contextmanager
+
+import psutil
+from flask import g, has_request_context, request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess)
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+MAPPER_BUCKETS  = (.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests served.", ["endpoint", "method", "status"])
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "End-to-end request latency.", ["endpoint"],
+    buckets=LATENCY_BUCKETS)
+PHASE_LATENCY = Histogram(
+    "hot_path_phase_seconds",
+    "Time per phase: tz_lookup, itlocation, astronomy, grid_stats, serialization, outbound_http.",
+    ["endpoint", "phase"], buckets=LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Lookups per cache (hits = lookups - misses).", ["cache"])
+CACHE_MISSES = Counter(
+    "cache_misses_total", "Misses per cache.", ["cache"])
+MAPPER_PHASE = Histogram(
+    "mapper_phase_seconds", "mapper.py phases: compute, shapefile_load, plot, save.",
+    ["phase"], buckets=MAPPER_BUCKETS)
+WORKER_RSS = Gauge(
+    "worker_rss_bytes", "Resident set size per live worker process.",
+    multiprocess_mode="liveall")
+
+RSS_INTERVAL = 10.0          # seconds between RSS samples per worker
+_last_rss = 0.0
+
+# ---------------------------------------------------------------------------#
+# Timers                                                                     #
+# ---------------------------------------------------------------------------#
+
+def _endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or "unmatched"
+    return "none"
+
+
+@contextmanager
+def phase(name: str):
+    """Time a block as one phase of the current request."""
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_LATENCY.labels(_endpoint(), name).observe(perf_counter() - t0)
+
+
+@contextmanager
+def mapper_phase(name: str):
+    """Time one mapper.py phase (compute, shapefile_load, plot, save)."""
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        MAPPER_PHASE.labels(name).observe(perf_counter() - t0)
+
+# ---------------------------------------------------------------------------#
+# Caches                                                                     #
+# ---------------------------------------------------------------------------#
+
+def cache_hit(name: str):
+    CACHE_LOOKUPS.labels(name).inc()
+
+
+def cache_miss(name: str):
+    CACHE_LOOKUPS.labels(name).inc()
+    CACHE_MISSES.labels(name).inc()
+
+
+def counted_lru_cache(name: str, maxsize: int = 128):
+    """``functools.lru_cache`` that reports lookups/misses under ``name``.
+
+    The miss counter lives inside the cached function, so it only runs when
+    the body actually executes -- exact even with concurrent threads.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def on_miss(*args, **kwargs):
+            CACHE_MISSES.labels(name).inc()
+            return fn(*args, **kwargs)
+
+        cached = functools.lru_cache(maxsize=maxsize)(on_miss)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            CACHE_LOOKUPS.labels(name).inc()
+            return cached(*args, **kwargs)
+
+        wrapper.cache_info  = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
+# ---------------------------------------------------------------------------#
+# Flask wiring                                                               #
+# ---------------------------------------------------------------------------#
+
+def _before_request():
+    g._metrics_t0 = perf_counter()
+
+
+def _after_request(resp):
+    global _last_rss
+    t0 = g.pop("_metrics_t0", None)
+    if t0 is not None:
+        endpoint = _endpoint()
+        REQUEST_LATENCY.labels(endpoint).observe(perf_counter() - t0)
+        REQUESTS.labels(endpoint, request.method, str(resp.status_code)).inc()
+
+    now = time()
+    if now - _last_rss > RSS_INTERVAL:
+        _last_rss = now
+        WORKER_RSS.set(psutil.Process(os.getpid()).memory_info().rss)
+    return resp
+
+
+def render() -> tuple[bytes, str]:
+    """Exposition payload for ``/metrics``, aggregated across processes if configured."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
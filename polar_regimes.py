@@ -0,0 +1,96 @@
+"""
+Precomputed polar-regime map: for a latitude band, day of year and solar
+depression angle, whether the sun crosses that angle at all that day.
+
+Past about 48° the sun stops getting down to the Fajr/ʿIshāʾ angles around
+the June solstice, and past the polar circles sunrise and sunset stop existing.
+``islamic_times`` finds that out by running its event solver until it fails,
+then applies the method's high-latitude rule.  ``regime`` answers the same
+question in constant time from a table, so a request can skip the solves that
+would fail (see app.compute_prayer_times).  Cells near a regime boundary are
+BORDERLINE and still go through the solver.
+
+The table covers |latitude| >= LAT_MIN in LAT_STEP bands and depression angles
+below ANGLE_MAX in ANGLE_STEP bands, for day-of-year 1-366 in each hemisphere.
+It is built from the solar declination (Spencer's series, good to ~0.04°)
+over WINDOW_DAYS either side of each day, which covers time zones, the leap
+year cycle and the drift between years, plus MARGIN degrees of altitude.
+"""
+import math
+import threading
+
+import numpy as np
+
+# Regimes of "the sun crosses altitude -angle on this day"
+EXISTS       = 0        # it does: the event can be solved for
+ALWAYS_ABOVE = 1        # the sun never gets that low (white nights, midnight sun)
+ALWAYS_BELOW = 2        # the sun never gets that high (polar night)
+BORDERLINE   = 3        # too close to call from the table; use the solver
+
+HORIZON_ANGLE = 5 / 6   # sunrise/sunset: refraction + semi-diameter, as in the library
+
+LAT_MIN     = 40.0      # below this every angle < ANGLE_MAX is crossed every day
+LAT_STEP    = 0.5
+ANGLE_STEP  = 0.5
+ANGLE_MAX   = 24.0
+WINDOW_DAYS = 2.0
+MARGIN      = 0.2
+
+_N_LAT = int((90.0 - LAT_MIN) / LAT_STEP)
+_N_ANGLE = int(ANGLE_MAX / ANGLE_STEP)
+
+_table = None
+_lock = threading.Lock()
+
+
+def declination(day_of_year) -> np.ndarray:
+    """Approximate solar declination in degrees for a (fractional) day of year."""
+    g = 2 * math.pi * (np.asarray(day_of_year, dtype=np.float64) - 1) / 365.0
+    return np.degrees(0.006918 - 0.399912 * np.cos(g) + 0.070257 * np.sin(g)
+                      - 0.006758 * np.cos(2 * g) + 0.000907 * np.sin(2 * g)
+                      - 0.002697 * np.cos(3 * g) + 0.00148 * np.sin(3 * g))
+
+
+def build_table() -> np.ndarray:
+    """uint8 regimes indexed [hemisphere (0 N, 1 S), latitude band, day of year - 1, angle band]."""
+    days = np.arange(1, 367, dtype=np.float64)
+    dec = declination(days[:, None] + np.linspace(-WINDOW_DAYS, WINDOW_DAYS, 33)[None, :])
+    dec_lo, dec_hi = dec.min(axis=1), dec.max(axis=1)
+
+    lat0 = (LAT_MIN + LAT_STEP * np.arange(_N_LAT))[:, None, None]
+    lat1 = lat0 + LAT_STEP
+    ang0 = (ANGLE_STEP * np.arange(_N_ANGLE))[None, None, :]
+    ang1 = ang0 + ANGLE_STEP
+
+    table = np.empty((2, _N_LAT, len(days), _N_ANGLE), dtype=np.uint8)
+    for hemi, (lo, hi) in enumerate(((dec_lo, dec_hi), (-dec_hi, -dec_lo))):
+        lo, hi = lo[None, :, None], hi[None, :, None]
+        # altitude at upper (90 - |lat - dec|) and lower (|lat + dec| - 90)
+        # culmination; with |lat| >= LAT_MIN both are linear over a cell
+        high_lo, high_hi = 90 - lat1 + lo, 90 - lat0 + hi
+        low_lo, low_hi = lat0 + lo - 90, lat1 + hi - 90
+        regime = np.full(np.broadcast_shapes(lat0.shape, lo.shape, ang0.shape), BORDERLINE, dtype=np.uint8)
+        regime[(low_hi + MARGIN < -ang1) & (high_lo - MARGIN > -ang0)] = EXISTS
+        regime[low_lo - MARGIN > -ang0] = ALWAYS_ABOVE
+        regime[high_hi + MARGIN < -ang1] = ALWAYS_BELOW
+        table[hemi] = regime
+    return table
+
+
+def _get_table() -> np.ndarray:
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = build_table()
+    return _table
+
+
+def regime(lat: float, day_of_year: int, angle: float) -> int:
+    """Whether the sun crosses ``angle`` degrees below the horizon at ``lat`` on that day."""
+    if not 0 <= angle < ANGLE_MAX:
+        return BORDERLINE
+    if abs(lat) < LAT_MIN:
+        return EXISTS
+    i_lat = min(int((abs(lat) - LAT_MIN) / LAT_STEP), _N_LAT - 1)
+    return int(_get_table()[0 if lat >= 0 else 1, i_lat, day_of_year - 1, int(angle / ANGLE_STEP)])
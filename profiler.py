@@ -0,0 +1,172 @@
+"""
+Opt-in sampling profiler for diagnosing production hot spots.
+
+Nothing runs unless ``PROFILE_ENABLED=1``.  When enabled, a request to one of
+``PROFILE_ENDPOINTS`` is profiled if it carries ``X-Profile-Token`` equal to
+``PROFILE_SECRET``, or at random with probability ``PROFILE_SAMPLE_RATE``
+(0.01 keeps it cheap enough to leave on).  A single daemon thread samples the
+stacks of the profiled threads every ``PROFILE_INTERVAL_MS`` and the counts are
+aggregated per label into collapsed-stack files (``<label>.<pid>.folded``)
+under ``PROFILE_DIR``, ready for ``flamegraph.pl`` or speedscope.
+
+Time spent inside the C astronomy core shows up on the Python frame that
+called into it.
+"""
+import os, sys, hmac, random, threading, pathlib, tempfile
+from time import sleep
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+
+ENABLED     = os.getenv("PROFILE_ENABLED", "0") == "1"
+SECRET      = os.getenv("PROFILE_SECRET", "")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+INTERVAL    = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+ENDPOINTS   = set(filter(None, os.getenv("PROFILE_ENDPOINTS", "prayer_times,vis_calc").split(",")))
+PROFILE_DIR = pathlib.Path(os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "islamictimes_profiles")))
+TOKEN_HEADER = "X-Profile-Token"
+
+_ROOT = str(pathlib.Path(__file__).resolve().parent) + os.sep
+
+# ---------------------------------------------------------------------------#
+# Sampler                                                                    #
+# ---------------------------------------------------------------------------#
+
+class _Sampler:
+    """One background thread sampling every registered thread's stack."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.active: dict[int, Counter] = {}        # thread id → stack counts
+        self.totals: dict[str, Counter] = {}        # label → aggregated stack counts
+        self.thread = None
+        self.pid = None
+
+    def _ensure_running(self):
+        # (Re)start after a gunicorn fork: threads don't survive into the child.
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                if not self.active:
+                    self.wake.clear()
+                    continue
+                frames = sys._current_frames()
+                for tid, counts in self.active.items():
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        counts[_fold(frame)] += 1
+            sleep(INTERVAL)
+
+    def start(self) -> Counter:
+        counts = Counter()
+        with self.lock:
+            self._ensure_running()
+            self.active[threading.get_ident()] = counts
+            self.wake.set()
+        return counts
+
+    def stop(self, label: str, counts: Counter) -> pathlib.Path | None:
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+            if not counts:
+                return None
+            total = self.totals.setdefault(label, Counter())
+            total.update(counts)
+            snapshot = sorted(total.items())
+        return _write_folded(label, snapshot)
+
+
+_sampler = _Sampler()
+
+
+def _frame_name(frame) -> str:
+    path = frame.f_code.co_filename
+    if path.startswith(_ROOT):
+        path = path[len(_ROOT):]
+    elif "site-packages" + os.sep in path:
+        path = path.split("site-packages" + os.sep, 1)[1]
+    return f"{frame.f_code.co_name} ({path})"
+
+
+def _fold(frame) -> str:
+    """Collapsed ``root;...;leaf`` representation of a stack."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _write_folded(label: str, snapshot: list[tuple[str, int]]) -> pathlib.Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"{label}.{os.getpid()}.folded"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text("".join(f"{stack} {n}\n" for stack, n in snapshot), encoding="utf-8")
+    os.replace(tmp, path)
+    return path
+
+# ---------------------------------------------------------------------------#
+# Public API                                                                 #
+# ---------------------------------------------------------------------------#
+
+def sampled() -> bool:
+    return ENABLED and random.random() < SAMPLE_RATE
+
+
+@contextmanager
+def profile(label: str, force: bool = False):
+    """Sample the current thread for the duration of the block (if selected)."""
+    if not (force and ENABLED) and not sampled():
+        yield
+        return
+    counts = _sampler.start()
+    try:
+        yield
+    finally:
+        _sampler.stop(label, counts)
+
+
+def _token_ok() -> bool:
+    token = request.headers.get(TOKEN_HEADER)
+    return bool(SECRET) and token is not None and hmac.compare_digest(token, SECRET)
+
+
+def _before_request():
+    if request.endpoint not in ENDPOINTS:
+        return
+    forced = _token_ok()
+    if forced or sampled():
+        g._profile = (request.endpoint, _sampler.start(), forced)
+
+
+def _after_request(resp):
+    state = g.pop("_profile", None)
+    if state is not None:
+        label, counts, forced = state
+        path = _sampler.stop(label, counts)
+        if forced and path is not None:
+            resp.headers["X-Profile-File"] = path.name
+    return resp
+
+
+def _teardown_request(exc):
+    # after_request is skipped on unhandled errors; don't leave the thread registered
+    state = g.pop("_profile", None)
+    if state is not None:
+        _sampler.stop(state[0], state[1])
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
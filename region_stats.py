@@ -0,0 +1,321 @@
+"""
+Region, country and city statistics read straight off stored visibility grids
+(see grid_store.py) -- no astronomy is re-run.
+
+For one day of a category grid:
+
+* area fractions per category over the region box, over its land, and per
+  country.  Countries come from ``combined_polygons.shp``, rasterized once per
+  grid lattice with ``shapely.contains_xy`` into a label array that is cached
+  in memory and under ``GRID_STORE/_masks``.  All fractions come from a single
+  weighted ``bincount``, with cells weighted by cos(latitude) for area;
+* for each visible category, the easternmost longitude where it (or better)
+  is seen -- None once it reaches the box's eastern edge, since the limit then
+  lies outside the box -- and its boundary as GeoJSON lines.  The lines are the
+  marching-squares contours mapper.category_geojson traces the "this category
+  or better" regions with, so they stop at the box border instead of running
+  along it.  These are the familiar visibility curves, which open westwards;
+* the category at each of the region's labelled cities (nearest grid cell).
+
+    python region_stats.py --today 2025-02-28 --region EUROPE --day 1
+"""
+import os, json, hashlib, pathlib, threading, argparse
+from datetime import datetime
+
+import numpy as np
+
+from grid_store import GridStore, GridKey, GRID_STORE
+from regions import REGION_COORDINATES, REGION_CITIES
+
+ROOT          = pathlib.Path(__file__).resolve().parent
+POLYGONS_PATH = ROOT / "scripts" / "map_shp_files" / "combined_polygons.shp"
+POINTS_PATH   = ROOT / "scripts" / "map_shp_files" / "combined_points.shp"
+
+# First attribute present is used as the country name (Natural Earth spellings).
+COUNTRY_FIELDS = ("ADMIN", "admin", "SOVEREIGNT", "sovereignt", "GEOUNIT", "geounit", "NAME", "name")
+
+NO_COUNTRY = -1
+
+_rasters: dict[str, tuple[np.ndarray, list[str]]] = {}
+_rasters_lock = threading.Lock()
+
+# ---------------------------------------------------------------------------#
+# Categories                                                                 #
+# ---------------------------------------------------------------------------#
+
+def grid_categories(criterion: int) -> list[str]:
+    """Labels in the order stored grids index them (mapper.get_category_colors):
+    worst to best, without the polar "doesn't exist" codes the mapper folds into
+    "Moonset before sunset."."""
+    from islamic_times.mapper.palette import category_labels
+    labels = list(category_labels(criterion))
+    return labels[:2] + labels[5:]
+
+
+def short_label(label: str) -> str:
+    """"A: Easily visible." -> "A"; the no-crescent cases keep their full text."""
+    head = label.split(": ", 1)
+    return head[0] if len(head) == 2 else label
+
+# ---------------------------------------------------------------------------#
+# Country rasters                                                            #
+# ---------------------------------------------------------------------------#
+
+def _files_signature(path: pathlib.Path) -> str:
+    h = hashlib.sha1()
+    for sibling in sorted(path.parent.glob(path.stem + ".*")):
+        st = sibling.stat()
+        h.update(f"{sibling.name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def _lattice_key(lon_vals, lat_vals, polygons: pathlib.Path) -> str:
+    h = hashlib.sha1()
+    h.update(np.asarray(lon_vals, dtype=np.float64).tobytes())
+    h.update(np.asarray(lat_vals, dtype=np.float64).tobytes())
+    h.update(_files_signature(polygons).encode())
+    return h.hexdigest()[:20]
+
+
+def _rasterize(lon_vals, lat_vals, polygons: pathlib.Path) -> tuple[np.ndarray, list[str]]:
+    import geopandas as gpd, shapely
+
+    gdf = gpd.read_file(polygons)
+    field = next((f for f in COUNTRY_FIELDS if f in gdf.columns), None)
+    names = sorted(set(gdf[field].astype(str))) if field else ["land"]
+    index = {n: i for i, n in enumerate(names)}
+
+    lon_vals, lat_vals = np.asarray(lon_vals), np.asarray(lat_vals)
+    labels = np.full((len(lat_vals), len(lon_vals)), NO_COUNTRY, dtype=np.int16)
+    for geom, name in zip(gdf.geometry, gdf[field].astype(str) if field else ["land"] * len(gdf)):
+        if geom is None or geom.is_empty:
+            continue
+        minx, miny, maxx, maxy = geom.bounds
+        c0, c1 = np.searchsorted(lon_vals, minx), np.searchsorted(lon_vals, maxx, side="right")
+        r0, r1 = np.searchsorted(lat_vals, miny), np.searchsorted(lat_vals, maxy, side="right")
+        if c0 >= c1 or r0 >= r1:
+            continue
+        # only the cells inside the polygon's bounding box are tested
+        inside = shapely.contains_xy(geom, lon_vals[None, c0:c1], lat_vals[r0:r1, None])
+        labels[r0:r1, c0:c1][inside] = index[name]
+    return labels, names
+
+
+def country_raster(lon_vals, lat_vals, polygons: str | os.PathLike = POLYGONS_PATH,
+                   cache_dir: str | os.PathLike | None = None) -> tuple[np.ndarray, list[str]]:
+    """(ny, nx) int16 country index per cell centre (NO_COUNTRY at sea) and the
+    country names, for this lattice.  Built once per lattice and polygon file."""
+    polygons = pathlib.Path(polygons)
+    key = _lattice_key(lon_vals, lat_vals, polygons)
+    with _rasters_lock:
+        if key in _rasters:
+            return _rasters[key]
+
+        cache = pathlib.Path(cache_dir or GRID_STORE) / "_masks" / f"{key}.npz"
+        try:
+            with np.load(cache) as z:
+                result = z["labels"], [str(n) for n in z["names"]]
+        except (OSError, KeyError, ValueError):
+            result = _rasterize(lon_vals, lat_vals, polygons)
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache.with_name(f".{key}.{os.getpid()}.npz")
+            with open(tmp, "wb") as f:
+                np.savez_compressed(f, labels=result[0], names=np.array(result[1]))
+            os.replace(tmp, cache)
+        _rasters[key] = result
+        return result
+
+# ---------------------------------------------------------------------------#
+# Statistics                                                                 #
+# ---------------------------------------------------------------------------#
+
+def area_weights(lat_vals) -> np.ndarray:
+    """Per-row cell area on a regular lon/lat lattice, up to a constant."""
+    return np.cos(np.radians(np.asarray(lat_vals, dtype=np.float64)))
+
+
+def category_fractions(codes: np.ndarray, weights: np.ndarray, n_categories: int,
+                       labels: np.ndarray | None = None, n_labels: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Area fraction of each category over all cells, and per label (one row per
+    label; cells labelled < 0 count towards the total only).  One weighted bincount each."""
+    w = np.broadcast_to(weights[:, None], codes.shape).ravel()
+    flat = codes.ravel().astype(np.int64)
+    total = np.bincount(flat, weights=w, minlength=n_categories)[:n_categories]
+    total = total / max(total.sum(), 1e-300)
+    if labels is None:
+        return total, np.zeros((0, n_categories))
+
+    lab = labels.ravel()
+    keep = lab >= 0
+    per = np.bincount(lab[keep].astype(np.int64) * n_categories + flat[keep], weights=w[keep],
+                      minlength=n_labels * n_categories).reshape(n_labels, n_categories)
+    sums = per.sum(axis=1, keepdims=True)
+    return total, np.divide(per, sums, out=np.zeros_like(per), where=sums > 0)
+
+
+def eastern_limits(codes: np.ndarray, lon_vals, lat_vals, first_visible: int = 2):
+    """For each category index c >= first_visible: per latitude row the easternmost
+    longitude where c or better is seen.  NaN where it isn't seen, and where it
+    reaches the last column (the limit is past the box edge)."""
+    lon_vals = np.asarray(lon_vals)
+    nx = codes.shape[1]
+    out = {}
+    for c in range(first_visible, int(codes.max(initial=0)) + 1):
+        seen = codes >= c
+        inside = seen.any(axis=1) & ~seen[:, -1]
+        east = nx - 1 - np.argmax(seen[:, ::-1], axis=1)
+        out[c] = np.where(inside, lon_vals[east], np.nan)
+    return out
+
+
+def boundary_lines(codes: np.ndarray, lon_vals, lat_vals, categories, tolerance: float = 0.5) -> dict:
+    """For each category index c in ``categories``: the boundary of the region where
+    c or better is seen, as GeoJSON line strings.  Traced and simplified as in
+    mapper.category_geojson (marching squares at c - 0.5, ``tolerance`` in grid cells);
+    contour lines end at the grid border, so the box edge never counts as a boundary."""
+    import contourpy, shapely
+
+    lon_vals, lat_vals = np.asarray(lon_vals, dtype=np.float64), np.asarray(lat_vals, dtype=np.float64)
+    step = min(abs(lon_vals[1] - lon_vals[0]), abs(lat_vals[1] - lat_vals[0]))
+    gen = contourpy.contour_generator(lon_vals, lat_vals, np.asarray(codes, dtype=np.float32))
+    out = {}
+    for c in categories:
+        lines = []
+        for pts in gen.lines(c - 0.5):
+            if len(pts) < 2:
+                continue
+            simple = shapely.simplify(shapely.LineString(pts), tolerance * step, preserve_topology=True)
+            lines.append([[round(float(x), 4), round(float(y), 4)] for x, y in simple.coords])
+        out[c] = lines
+    return out
+
+
+def city_points(region: str, points: str | os.PathLike | None = None) -> list[tuple[str, float, float]]:
+    """(name, lat, lon) of the region's labelled cities, picked as mapper.py does."""
+    import geopandas as gpd
+    places = gpd.read_file(points or POINTS_PATH)
+    places = places[places["NAME"].isin(REGION_CITIES[region])]
+    places = places.loc[places.groupby("NAME")["POP_MAX"].idxmax()]
+    return [(row["NAME"], row.geometry.y, row.geometry.x) for _, row in places.iterrows()]
+
+
+def _nearest(axis: np.ndarray, values) -> np.ndarray:
+    idx = np.clip(np.searchsorted(axis, values), 1, len(axis) - 1)
+    return np.where(np.abs(axis[idx - 1] - values) <= np.abs(axis[idx] - values), idx - 1, idx)
+
+
+def day_stats(codes: np.ndarray, lon_vals, lat_vals, criterion: int, bounds=None,
+              cities: list[tuple[str, float, float]] | None = None,
+              polygons: str | os.PathLike | None = POLYGONS_PATH, cache_dir=None) -> dict:
+    """Everything above for one day's (ny, nx) category grid, as a JSON-ready dict."""
+    lon_vals, lat_vals = np.asarray(lon_vals), np.asarray(lat_vals)
+    if bounds is not None:
+        minx, maxx, miny, maxy = bounds
+        cols = (lon_vals >= minx - 1e-9) & (lon_vals <= maxx + 1e-9)
+        rows = (lat_vals >= miny - 1e-9) & (lat_vals <= maxy + 1e-9)
+        codes, lon_vals, lat_vals = codes[np.ix_(rows, cols)], lon_vals[cols], lat_vals[rows]
+    codes = np.asarray(codes)
+    categories = grid_categories(criterion)
+    names = [short_label(c) for c in categories]
+    weights = area_weights(lat_vals)
+
+    labels, countries = (country_raster(lon_vals, lat_vals, polygons, cache_dir)
+                         if polygons is not None else (None, []))
+    box, per_country = category_fractions(codes, weights, len(categories), labels, len(countries))
+    fractions = lambda row: {n: round(float(f), 6) for n, f in zip(names, row) if f > 0}
+
+    out = {"categories": categories, "box": fractions(box)}
+    if labels is not None:
+        land = labels >= 0
+        w = np.broadcast_to(weights[:, None], codes.shape)[land]
+        land_fracs = np.bincount(codes[land].astype(np.int64), weights=w, minlength=len(categories))
+        out["land"] = fractions(land_fracs / max(land_fracs.sum(), 1e-300))
+        out["countries"] = {countries[i]: fractions(per_country[i]) for i in np.unique(labels[land])}
+
+    limits = eastern_limits(codes, lon_vals, lat_vals)
+    # past the box edge in any row, the limit is unknown rather than the edge itself
+    out["eastern_limit"] = {names[c]: (None if np.all(np.isnan(v)) or (codes[:, -1] >= c).any()
+                                       else round(float(np.nanmax(v)), 4))
+                            for c, v in limits.items()}
+    lines = boundary_lines(codes, lon_vals, lat_vals, list(limits)) if min(codes.shape) > 1 else {}
+    out["boundaries"] = {"type": "FeatureCollection", "features": [
+        {"type": "Feature",
+         "properties": {"category": names[c], "label": categories[c]},
+         "geometry": {"type": "MultiLineString", "coordinates": lines[c]}}
+        for c in limits if lines.get(c)]}
+
+    if cities:
+        lat_q = np.array([c[1] for c in cities])
+        lon_q = np.array([c[2] for c in cities])
+        inside = ((lat_q >= lat_vals[0]) & (lat_q <= lat_vals[-1])
+                  & (lon_q >= lon_vals[0]) & (lon_q <= lon_vals[-1]))
+        r, c = _nearest(lat_vals, lat_q), _nearest(lon_vals, lon_q)
+        out["cities"] = [{"name": name, "lat": round(float(la), 4), "lon": round(float(lo), 4),
+                          "category": names[codes[ri, ci]]}
+                         for (name, la, lo), ri, ci, ok in zip(cities, r, c, inside) if ok]
+    return out
+
+# ---------------------------------------------------------------------------#
+# Stored grids                                                               #
+# ---------------------------------------------------------------------------#
+
+def stored_day(store: GridStore, conjunction: datetime, region: str, resolution: int,
+               criterion: int, day: int):
+    """(codes, lon_vals, lat_vals) for one stored category-grid day covering ``region``
+    (the region's own grid, or one it can be sliced from), or None."""
+    key = GridKey(conjunction, region, resolution, criterion, "category")
+    bounds = REGION_COORDINATES[region]
+    meta = store.meta(key)
+    if meta is not None and str(day) in meta["days"]:
+        return store.load_day(key, day), np.asarray(meta["lon"]), np.asarray(meta["lat"])
+
+    minx, maxx, miny, maxy = bounds
+    covering = store.find_covering(key, bounds, (maxx - minx) / (resolution - 1),
+                                   (maxy - miny) / (resolution - 1), day + 1)
+    if covering is None:
+        return None
+    src, lon_vals, lat_vals, window = covering
+    return store.load_day(src, day)[window], lon_vals, lat_vals
+
+
+def region_stats(conjunction: datetime, region: str, resolution: int, criterion: int, day: int,
+                 store: GridStore | None = None, with_cities: bool = True) -> dict | None:
+    """Statistics for day ``day`` (0-based) after ``conjunction``; None if no stored grid covers it."""
+    store = store or GridStore()
+    found = stored_day(store, conjunction, region, resolution, criterion, day)
+    if found is None:
+        return None
+    codes, lon_vals, lat_vals = found
+    cities = None
+    if with_cities:
+        try:
+            cities = city_points(region)
+        except Exception:
+            cities = None       # points file missing or without NAME/POP_MAX
+    polygons = POLYGONS_PATH if POLYGONS_PATH.exists() else None
+    stats = day_stats(np.asarray(codes), lon_vals, lat_vals, criterion, REGION_COORDINATES[region],
+                      cities, polygons, store.root)
+    return {"region": region, "conjunction": conjunction.isoformat(), "criterion": criterion,
+            "resolution": resolution, "day": day + 1, **stats}
+
+
+if __name__ == "__main__":
+    import islamic_times.astro_core as fast_astro
+
+    parser = argparse.ArgumentParser(description="Visibility statistics from stored mapper grids")
+    parser.add_argument("--today",      type=str, default=None, help="ISO date near the conjunction (as for mapper.py)")
+    parser.add_argument("--region",     type=str, default="WORLD", choices=list(REGION_COORDINATES))
+    parser.add_argument("--resolution", type=int, default=300)
+    parser.add_argument("--criterion",  type=int, default=1, choices=(0, 1))
+    parser.add_argument("--day",        type=int, default=1, help="Evening after the conjunction (1-based)")
+    parser.add_argument("--grid_store", type=str, default=None)
+    args = parser.parse_args()
+
+    today = datetime.fromisoformat(args.today) if args.today else datetime.now()
+    conjunction = fast_astro.next_phases_of_moon_utc(today)[0]
+    stats = region_stats(conjunction, args.region, args.resolution, args.criterion, args.day - 1,
+                         GridStore(args.grid_store) if args.grid_store else None)
+    if stats is None:
+        raise SystemExit(f"No stored grid for {args.region} at resolution {args.resolution} "
+                         f"(conjunction {conjunction}); run mapper.py first.")
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
@@ -0,0 +1,110 @@
+"""
+Map regions shared by mapper.py, the tile broker and the app: each region's
+bounding box (min lon, max lon, min lat, max lat) and the cities labelled on it.
+"""
+
+CITIES_WORLD: list[str] = [
+        # PACIFIC
+        'Honolulu', 
+        
+        # NORTH AMERICA
+        'Vancouver', 'Los Angeles', 'Mexico City',
+        'Toronto', 'Miami', 'Washington,  D.C.',
+
+        # SOUTH AMERICA
+        'Lima', 'Bogota', 'Santiago', 'São Paulo',
+
+        # WEST AFRICA
+        'Dakar', 'Lagos',
+
+        # EUROPE
+        'Madrid', 'London', 'Vienna', 'Moscow',
+
+        # SOUTH AFRICA
+        'Cape Town', 
+
+        # MIDDLE EAST
+        'Istanbul', 'Cairo', 'Makkah', 'Tehran',
+
+        # EAST AFRICA
+        'Nairobi', 'Addis Ababa', 
+
+        # SOUTH ASIA
+        'Islamabad', 'Mumbai',
+
+        # SOUTH EAST ASIA
+        'Bangkok',  'Singapore',
+
+        # EAST ASIA
+        'Hong Kong', 'Beijing', 'Tokyo', 
+        
+        # AUSTRALIA
+        'Sydney', 'Perth' 
+    ]
+
+CITIES_IRAN: list[str] = [
+    'Tehran', 'Mashhad', 'Kerman', 'Shiraz', 'Zanjan', 
+    'Ardabil', 'Isfahan', 'Gorgan', 'Tabriz', 'Semnan', 
+    'Yazd', 'Rasht', 'Arak', 'Boshruyeh', 'Mehran', 'Dargaz', 
+    'Chabahar', 'Zahedan', 'Birjand', 'Sanandaj', 'Ahvaz', 
+    'Saravan', 'Hamadan', 'Khorramabad', 'Qomsheh', 'Ilam', 
+    'Sari', 'Qazvin', 'Bandar-e-Abbas', 'Bandar-e Bushehr', 
+    'Sirjan', 'Kashmar', 'Bojnurd', 'Qom', 'Urmia', 'Khvoy',
+    'Yasuj'
+    ]
+
+CITIES_MIDDLE_EAST: list[str] = [
+    'Istanbul', 'Khartoum', 'Cairo', 'Luxor', 'Ankara', 
+    'Beirut', 'Aleppo', 'Medina', 'Makkah', 'Djibouti',
+    'Sanaa', 'Irbil', 'Baghdad', 'Riyadh', 'Kuwait City',
+    'Baku', 'Tehran', 'Doha', 'Dubai', 'Kerman', 'Muscat', 
+    'Mashhad', 'Karachi', 'Kabul'
+    ]
+
+CITIES_NORTH_AMERICA: list[str] = [
+    # Pacific
+    'Honolulu',
+    
+    # CANADA
+    'Vancouver', 'Edmonton', 'Calgary', 'Winnipeg', 'Thunder Bay', 
+    'Toronto', 'Montréal', 'Halifax', 'St. John\'s',
+
+    # UNITED STATES
+    'Portland', 'San Francisco', 'Los Angeles', 'Billings', 
+    'Albuquerque', 'Denver', 'Kansas City', 'Dallas', 'Houston', 
+    'Minneapolis', 'Chicago', 'Orlando', 'Atlanta', 'Miami', 
+    'Washington,  D.C.', 'Boston',
+
+    # MEXICO
+    'Hermosillo', 'Monterrey', 'Mexico City', 'Mérida',
+
+    # CARIBBEAN
+    'Havana', 'Kingston',
+]
+
+CITIES_EUROPE: list[str] = [
+    'Lisbon', 'Dublin', 'Madrid', 'Edinburgh',
+    'London', 'Barcelona', 'Paris', 'Amsterdam', 'Zürich', 
+    'Oslo', 'Rome', 'København', 'Venice', 'Berlin', 
+    'Vienna', 'Stockholm', 'Sarajevo', 'Warsaw', 'Athens',
+    'Riga', 'Bucharest', 'Minsk', 'Istanbul', 'Kyiv',
+    'Ankara', 'Moscow', 'Rostov', 'Tbilisi'
+]
+
+REGION_COORDINATES: dict[str, tuple[int, int, int, int]] = {
+    'WORLD'         :   (-179, 180, -61, 61),
+    'WORLD_FULL'    :   (-179, 180, -89, 90),
+    'NORTH_AMERICA' :   (-170, -40, 15, 61),
+    'EUROPE'        :   (-15, 50, 34, 61),
+    'MIDDLE_EAST'   :   (25, 75, 10, 45),
+    'IRAN'          :   (43.5, 63.5, 24.5, 40)
+}
+
+REGION_CITIES: dict[str, list[str]] = {
+    'WORLD'         : CITIES_WORLD,
+    'WORLD_FULL'    : CITIES_WORLD, # NOT YET SUPPORTED
+    'NORTH_AMERICA' : CITIES_NORTH_AMERICA,
+    'EUROPE'        : CITIES_EUROPE,
+    'MIDDLE_EAST'   : CITIES_MIDDLE_EAST,
+    'IRAN'          : CITIES_IRAN 
+}
@@ -0,0 +1,331 @@
+"""
+Off-peak scheduler: pre-renders the coming month's maps and warms the
+prayer-time / tz caches for the busiest cities before their local midnight,
+so peak moments (Ramadan, Eid) are served from cache.
+
+    python scheduler.py prerender           # render every missing upcoming map now
+    python scheduler.py warm                # compute and share the warm entries now
+    python scheduler.py run                 # loop forever (both jobs, on schedule)
+
+Maps are rendered by mapper.py into the app's ``static/maps/``, which records
+them in the ``maps_index.json`` the visibilities page reads (see /maps_index).
+Warmed responses are written to ``SCHEDULER_WARM_DIR``, one file per date, and
+every worker looks there before computing (see app.cached_prayer_times).
+
+Only one scheduler runs at a time: ``run`` and the ``SCHEDULER_ENABLED=1``
+thread gunicorn starts in each worker (see gunicorn.conf.py) first take the
+``SCHEDULER_LOCK`` file lock; the others wait and take over if its holder exits.
+"""
+import os, json, fcntl, pathlib, logging, argparse, tempfile, threading
+from time import sleep
+from datetime import datetime, timedelta, timezone
+
+import islamic_times.astro_core as fast_astro
+from islamic_times.time_equations import gregorian_to_hijri
+
+log = logging.getLogger("scheduler")
+
+INTERVAL       = int(os.getenv("SCHEDULER_INTERVAL", "600"))          # seconds between ticks
+OFFPEAK_UTC    = tuple(int(h) for h in os.getenv("SCHEDULER_OFFPEAK_UTC", "1-5").split("-"))
+LOOKAHEAD_DAYS = int(os.getenv("SCHEDULER_LOOKAHEAD_DAYS", "10"))     # render once conjunction is this close
+RESOLUTION     = int(os.getenv("SCHEDULER_RESOLUTION", "300"))
+WARM_FROM_HOUR = int(os.getenv("SCHEDULER_WARM_HOUR", "22"))          # local hour to warm tomorrow
+
+MAP_DAYS       = int(os.getenv("SCHEDULER_MAP_DAYS", "3"))            # evenings per map, as hosted
+WARM_DIR       = pathlib.Path(os.getenv("SCHEDULER_WARM_DIR", os.path.join(tempfile.gettempdir(), "islamictimes_warm")))
+LOCK_PATH      = os.getenv("SCHEDULER_LOCK", os.path.join(tempfile.gettempdir(), "islamictimes_scheduler.lock"))
+
+AVERAGE_LUNAR_MONTH_DAYS = 29.53059
+
+CRITERIA = (0, 1)
+
+# Busiest locations (name, lat, lon); the name is geocoded when possible so the
+# cache key matches what the front-end's Nominatim lookup sends.
+TOP_CITIES: list[tuple[str, float, float]] = [
+    ("Jakarta",       -6.1754,  106.8272), ("Karachi",      24.8608,   67.0104),
+    ("Lahore",        31.5656,   74.3242), ("Dhaka",        23.7644,   90.3890),
+    ("Cairo",         30.0444,   31.2357), ("Istanbul",     41.0091,   28.9662),
+    ("Tehran",        35.6892,   51.3890), ("Mashhad",      36.2972,   59.6067),
+    ("Riyadh",        24.6333,   46.7167), ("Makkah",       21.4225,   39.8262),
+    ("Medina",        24.4672,   39.6024), ("Dubai",        25.2048,   55.2708),
+    ("Baghdad",       33.3152,   44.3661), ("Kuala Lumpur",  3.1516,  101.6942),
+    ("Lagos",          6.4550,    3.3941), ("Casablanca",   33.5731,   -7.5898),
+    ("Mumbai",        19.0550,   72.8692), ("Hyderabad",    17.3606,   78.4741),
+    ("London",        51.5074,   -0.1278), ("Paris",        48.8535,    2.3484),
+    ("Berlin",        52.5108,   13.3989), ("Toronto",      43.6535,  -79.3839),
+    ("New York",      40.7127,  -74.0059), ("Chicago",      41.8756,  -87.6244),
+    ("Houston",       29.7589,  -95.3677), ("Los Angeles",  34.0537, -118.2428),
+    ("Sydney",       -33.8698,  151.2083), ("Doha",         25.2856,   51.5310),
+]
+
+# the front-end's method presets with the ʿAṣr / midnight settings it sends for
+# them (static/js/main.js: Jaʿfarī midnight for JAFARI, its default method)
+WARM_METHODS: list[dict] = [
+    {"name": name, "asr_type": 0, "midnight_type": 1 if name == "JAFARI" else 0}
+    for name in ("JAFARI", "TEHRAN", "ISNA", "MWL", "MAKKAH", "EGYPT", "KARACHI")
+] + [{"name": "KARACHI", "asr_type": 1, "midnight_type": 0}]
+
+# ---------------------------------------------------------------------------#
+# Maps                                                                       #
+# ---------------------------------------------------------------------------#
+
+def hijri_month_of(conjunction: datetime) -> tuple[int, int]:
+    """Hijri (year, month) a conjunction starts, labelled the way mapper.py does."""
+    h_year, h_month, h_day = gregorian_to_hijri(conjunction.year, conjunction.month, conjunction.day)
+    if h_day > 6:
+        h_month += 1
+        if h_month > 12:
+            h_month, h_year = 1, h_year + 1
+    return h_year, h_month
+
+
+def months_to_render(now: datetime | None = None, force: bool = False) -> list[tuple[datetime, int, int]]:
+    """(conjunction, Hijri year, month) still worth rendering: the month whose first
+    evenings are underway (conjunction in the last 3 days) and the next one once it
+    is within LOOKAHEAD_DAYS."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    # next_phases_of_moon_utc returns the *nearest* new moon, which may be behind us
+    nearest = fast_astro.next_phases_of_moon_utc(now)[0]
+    if nearest <= now:
+        previous = nearest
+        upcoming = fast_astro.next_phases_of_moon_utc(nearest + timedelta(days=AVERAGE_LUNAR_MONTH_DAYS))[0]
+    else:
+        previous = fast_astro.next_phases_of_moon_utc(nearest - timedelta(days=AVERAGE_LUNAR_MONTH_DAYS))[0]
+        upcoming = nearest
+
+    months = []
+    if now - previous < timedelta(days=3):
+        months.append((previous, *hijri_month_of(previous)))
+    if force or upcoming - now <= timedelta(days=LOOKAHEAD_DAYS):
+        months.append((upcoming, *hijri_month_of(upcoming)))
+    return months
+
+
+def rendered(h_year: int, h_month: int, region: str, criterion: int) -> set[str]:
+    """Outputs ("file", "vector") static/maps/maps_index.json already lists for a month."""
+    import app
+    from grid_store import index_key
+    from islamic_times.time_equations import get_islamic_month
+
+    want = index_key({"year": h_year, "month": get_islamic_month(h_month), "region": region, "criterion": criterion})
+    for entry in app.local_maps_index():
+        if index_key(entry) == want:
+            files = ([entry["file"]] if "file" in entry else []) + entry.get("vector", [])
+            if all((app.MAP_OUT_DIR / f).exists() for f in files):
+                return {kind for kind in ("file", "vector") if kind in entry}
+    return set()
+
+
+def prerender(force: bool = False) -> int:
+    """Render every region × criterion map (JPEG and GeoJSON) for the current/upcoming
+    month into static/maps/; returns the count rendered."""
+    import subprocess, app
+
+    months = months_to_render(force=force)
+    if not months:
+        log.info("No conjunction within %d days; nothing to pre-render yet.", LOOKAHEAD_DAYS)
+        return 0
+
+    app.MAP_OUT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(app.MAP_OUT_DIR / ".prerender.lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log.info("Another process is pre-rendering; skipping.")
+            return 0
+
+        count = 0
+        for conjunction, h_year, h_month in months:
+            log.info("Conjunction %s → %d/%d", conjunction, h_month, h_year)
+            for region in app.MAP_REGIONS:
+                for criterion in CRITERIA:
+                    done = rendered(h_year, h_month, region, criterion)
+                    # the vector run reuses the grid the JPEG run stored
+                    for kind, extra in (("file", ()), ("vector", ("--vector",))):
+                        if kind in done:
+                            continue
+                        params = (region, criterion, kind)
+                        log.info("Pre-rendering %s", params)
+                        cmd = app.mapper_command(conjunction.isoformat(), f"{app.MAP_OUT_DIR.resolve()}/", region,
+                                                 MAP_DAYS, criterion, RESOLUTION, *extra)
+                        proc = subprocess.run(cmd, cwd=str(app.PROJECT_ROOT), capture_output=True, text=True)
+                        # mapper.py only indexes a month once all its outputs are written
+                        if kind in rendered(h_year, h_month, region, criterion):
+                            count += 1
+                        else:
+                            log.error("Pre-render of %s failed: %s", params, (proc.stderr or proc.stdout)[-2000:])
+        return count
+
+# ---------------------------------------------------------------------------#
+# Prayer-time / tz caches                                                    #
+# ---------------------------------------------------------------------------#
+
+_coords: dict[str, tuple[float, float]] = {}
+
+
+def city_coords(name: str, lat: float, lon: float) -> tuple[float, float]:
+    """Geocoded coordinates for a city (once), falling back to the built-in ones."""
+    if name not in _coords:
+        import app
+        try:
+            _coords[name] = app.geocode(name)
+            sleep(1)                        # Nominatim usage policy: ≤ 1 request/s
+        except Exception:
+            _coords[name] = (lat, lon)
+    return _coords[name]
+
+
+def due_dates(tz, now_utc: datetime) -> list[str]:
+    """Local dates worth warming for a city now: today, plus tomorrow late in the evening."""
+    local = now_utc.astimezone(tz)
+    dates = [local.date().isoformat()]
+    if local.hour >= WARM_FROM_HOUR:
+        dates.append((local + timedelta(days=1)).date().isoformat())
+    return dates
+
+
+def warm(geocode: bool = True, _done: set | None = None) -> int:
+    """Fill the tz and prayer-time caches for TOP_CITIES and share the entries
+    with every worker (see warmed); returns the entries computed."""
+    import app
+
+    done = _done if _done is not None else set()
+    now = datetime.now(timezone.utc)
+    fresh: dict[str, list] = {}
+    for name, lat, lon in TOP_CITIES:
+        if geocode:
+            lat, lon = city_coords(name, lat, lon)
+        lat = round(lat, app.PRAYER_COORD_DECIMALS)
+        lon = round(lon, app.PRAYER_COORD_DECIMALS)
+        for date_str in due_dates(app.lookup_tz(lat, lon), now):
+            for method in WARM_METHODS:
+                key = (lat, lon, date_str, json.dumps(method, sort_keys=True))
+                if key in done:
+                    continue
+                fresh.setdefault(date_str, []).append([*key, app.cached_prayer_times(*key)])
+                done.add(key)
+    for date_str, entries in fresh.items():
+        _save_warm(date_str, entries)
+    return sum(map(len, fresh.values()))
+
+
+def _save_warm(date_str: str, entries: list):
+    import app
+    WARM_DIR.mkdir(parents=True, exist_ok=True)
+    path = WARM_DIR / f"{date_str}.json"
+    try:
+        entries = json.loads(path.read_text()) + entries
+    except (OSError, ValueError):
+        pass
+    latest = {tuple(e[:4]): e for e in entries}
+    tmp = WARM_DIR / f".{date_str}.{os.getpid()}.json"
+    # serialised as jsonify does (Angle and friends are dataclasses)
+    tmp.write_text(app.app.json.dumps(list(latest.values())))
+    os.replace(tmp, path)
+
+
+_warm_files: dict[str, tuple[int, dict]] = {}     # date → (file mtime, {key: response})
+
+
+def warmed(lat: float, lon: float, date_str: str, method_json: str) -> dict | None:
+    """The scheduler's response for this prayer-time key, if it warmed it."""
+    path = WARM_DIR / f"{date_str}.json"
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+    cached = _warm_files.get(date_str)
+    if cached is None or cached[0] != mtime:
+        try:
+            entries = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        cached = (mtime, {tuple(e[:4]): e[4] for e in entries})
+        _warm_files[date_str] = cached
+    return cached[1].get((lat, lon, date_str, method_json))
+
+
+def prune_warm(cutoff: str):
+    """Drop shared warm files for dates before ``cutoff`` (ISO)."""
+    for path in WARM_DIR.glob("*.json"):
+        if path.stem < cutoff:
+            path.unlink(missing_ok=True)
+    for date_str in [d for d in _warm_files if d < cutoff]:
+        del _warm_files[date_str]
+
+# ---------------------------------------------------------------------------#
+# Loop                                                                       #
+# ---------------------------------------------------------------------------#
+
+def in_offpeak(now: datetime) -> bool:
+    start, end = OFFPEAK_UTC
+    return start <= now.hour < end if start <= end else (now.hour >= start or now.hour < end)
+
+
+def run_forever(geocode: bool = True):
+    warmed_keys: set = set()
+    while True:
+        try:
+            n = warm(geocode, warmed_keys)
+            if n:
+                log.info("Warmed %d prayer-time entries.", n)
+            if in_offpeak(datetime.now(timezone.utc)):
+                prerender()
+        except Exception:
+            log.exception("Scheduler tick failed.")
+        # forget entries for dates that have passed everywhere
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=2)).date().isoformat()
+        warmed_keys = {k for k in warmed_keys if k[2] >= cutoff}
+        prune_warm(cutoff)
+        sleep(INTERVAL)
+
+
+_lock = None
+
+
+def lead():
+    """Wait until this process holds LOCK_PATH, checking every INTERVAL.  The lock
+    is held until the process exits, so another one takes over only then."""
+    global _lock
+    lock = open(LOCK_PATH, "w")
+    while True:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            _lock = lock
+            return
+        except BlockingIOError:
+            sleep(INTERVAL)
+
+
+def run_as_leader(geocode: bool = True):
+    lead()
+    log.info("Scheduler running in process %d.", os.getpid())
+    run_forever(geocode)
+
+
+_thread = None
+
+
+def start_background():
+    """Run the scheduler loop in a daemon thread of the current process (once), if
+    no other process runs it."""
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _thread = threading.Thread(target=run_as_leader, name="scheduler", daemon=True)
+        _thread.start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(message)s", datefmt="%X %d-%m-%Y")
+    parser = argparse.ArgumentParser(description="Pre-render maps and warm caches ahead of peak times")
+    parser.add_argument("command", choices=("prerender", "warm", "run"))
+    parser.add_argument("--force",       action="store_true", help="prerender: ignore the look-ahead window")
+    parser.add_argument("--no_geocode",  action="store_true", help="Use built-in city coordinates only")
+    args = parser.parse_args()
+
+    if args.command == "prerender":
+        log.info("Rendered %d maps.", prerender(force=args.force))
+    elif args.command == "warm":
+        log.info("Warmed %d prayer-time entries.", warm(not args.no_geocode))
+    else:
+        run_as_leader(not args.no_geocode)
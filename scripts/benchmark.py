@@ -0,0 +1,405 @@
+"""
+Offline benchmark harness for the prayer, visibility, mapper and HTTP hot paths.
+
+Geocoding and the maps host are stubbed, so this runs without network access.
+Results are written as JSON so consecutive releases can be compared:
+
+    python scripts/benchmark.py                          # every suite
+    python scripts/benchmark.py --suite prayer http      # a subset
+    python scripts/benchmark.py --quick                  # fewer repeats, small grids
+    python scripts/benchmark.py --compare benchmarks/<previous>.json
+"""
+import os, sys, json, platform, statistics, subprocess, argparse, pathlib, tempfile, gc
+import socket, urllib.request
+
+from time import perf_counter, sleep
+from datetime import datetime
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# (name, lat, lon) -- equator to the Arctic, both hemispheres
+LOCATIONS: list[tuple[str, float, float]] = [
+    ("Quito",         -0.18,  -78.47),
+    ("Makkah",        21.42,   39.83),
+    ("Cape Town",    -33.92,   18.42),
+    ("Toronto",       43.65,  -79.38),
+    ("London",        51.51,   -0.13),
+    ("Oslo",          59.91,   10.75),
+    ("Reykjavik",     64.15,  -21.94),
+    ("Tromsø",        69.65,   18.96),
+    ("Longyearbyen",  78.22,   15.65),
+]
+
+DATES: list[str] = ["2025-03-20", "2025-06-21", "2025-12-21"]
+
+METHODS: list[dict] = [
+    {"name": "JAFARI"},
+    {"name": "ISNA", "asr_type": 1},
+    {"name": "CUSTOM", "fajr_angle": 18, "maghrib_angle": 4, "isha_angle": 17},
+]
+
+FIXED_CONJUNCTION = datetime(2025, 2, 28, 0, 44, 44)
+
+STUB_MAPS_INDEX = [
+    {"month": "Ramaḍān", "year": 1446, "file": "World/1446/2025-02-28 Ramadan 1446—Yallop.jpg"},
+]
+
+# ---------------------------------------------------------------------------#
+# Helpers                                                                    #
+# ---------------------------------------------------------------------------#
+
+def print_ts(message: str):
+    print(f"[{datetime.now().strftime('%X %d-%m-%Y')}] {message}", flush=True)
+
+
+def rss_mb() -> float:
+    return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+
+
+def timeit(fn, repeat: int, warmup: int = 1) -> dict:
+    """Run ``fn`` ``warmup`` + ``repeat`` times and summarise wall time in seconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        fn()
+        samples.append(perf_counter() - t0)
+    samples.sort()
+    return {
+        "n":        repeat,
+        "mean_s":   statistics.fmean(samples),
+        "median_s": statistics.median(samples),
+        "min_s":    samples[0],
+        "p95_s":    samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        "max_s":    samples[-1],
+    }
+
+
+def result(name: str, params: dict, stats: dict, **extra) -> dict:
+    row = {"name": name, "params": params, **stats, **extra}
+    print_ts(f"{name} {params}: median {row.get('median_s', 0) * 1000:.2f} ms")
+    return row
+
+
+class _StubResponse:
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        pass
+
+
+def _stub_requests_get(url, *args, **kwargs):
+    """Offline replacement for ``requests.get`` covering every upstream app.py calls."""
+    if "nominatim" in url:
+        return _StubResponse([{"lat": "43.65", "lon": "-79.38"}])
+    if "ipapi" in url:
+        return _StubResponse({"latitude": 43.65, "longitude": -79.38})
+    if "maps_index" in url:
+        return _StubResponse(STUB_MAPS_INDEX)
+    raise RuntimeError(f"benchmark: unexpected outbound request to {url}")
+
+
+def offline():
+    return mock.patch("requests.get", _stub_requests_get)
+
+# ---------------------------------------------------------------------------#
+# Suites                                                                     #
+# ---------------------------------------------------------------------------#
+
+def bench_prayer(quick: bool) -> list[dict]:
+    """``compute_prayer_times`` across latitudes, dates and methods."""
+    import app
+
+    repeat = 5 if quick else 30
+    rows = []
+    for place, lat, lon in LOCATIONS:
+        for date in DATES:
+            for method in METHODS:
+                payload = {"lat": lat, "lon": lon, "date": date, "method": method}
+                stats = timeit(lambda: app.compute_prayer_times(payload), repeat)
+                times = app.compute_prayer_times(payload)
+                undefined = [k for k in ("fajr", "sunrise", "sunset", "isha")
+                             if app._format_prayer(getattr(times, k))["time"] == "Does not exist"]
+                rows.append(result("prayer.build_and_compute",
+                                   {"place": place, "lat": lat, "date": date, "method": method["name"]},
+                                   stats, undefined=undefined))
+    return rows
+
+
+def bench_hijri(quick: bool) -> list[dict]:
+    from misc import hijri_to_gregorian
+
+    n = 1_000 if quick else 20_000
+    def run():
+        for i in range(n):
+            hijri_to_gregorian(1400 + i % 100, 1 + i % 12, 1 + i % 29)
+    stats = timeit(run, 3 if quick else 10)
+    return [result("misc.hijri_to_gregorian", {"calls": n}, stats,
+                   per_call_us=stats["median_s"] / n * 1e6)]
+
+
+def bench_vis(quick: bool) -> list[dict]:
+    """``/vis_calc`` through the Flask test client (includes the tz lookup)."""
+    import app
+
+    client = app.app.test_client()
+    repeat = 3 if quick else 15
+    rows = []
+    for place, lat, lon in LOCATIONS:
+        for h_month in (9, 10, 12):
+            payload = {"lat": lat, "lon": lon, "hijri_month": h_month, "hijri_year": 1446}
+            def run():
+                r = client.post("/vis_calc", json=payload)
+                assert r.status_code == 200, r.status_code
+            rows.append(result("http.vis_calc", {"place": place, "hijri_month": h_month},
+                               timeit(run, repeat)))
+    return rows
+
+
+def bench_mapper_compute(quick: bool) -> list[dict]:
+    """``compute_visibility_map_parallel`` at several resolutions and worker counts."""
+    import mapper
+
+    resolutions = (50, 100) if quick else (50, 100, 200, 300)
+    workers = sorted({1, 2, min(4, os.cpu_count() or 1), os.cpu_count() or 1})
+    repeat = 1 if quick else 3
+    rows = []
+    for res in resolutions:
+        lon_vals, lat_vals, nx, ny = mapper.create_grid(res, *mapper.REGION_COORDINATES["WORLD"])
+        for w in workers:
+            files = []
+            def run():
+                mm, path = mapper.compute_visibility_map_parallel(
+                    lon_vals, lat_vals, FIXED_CONJUNCTION, 3, 1, max_workers=w)
+                del mm
+                files.append(path)
+            stats = timeit(run, repeat, warmup=0)
+            for path in files:
+                os.remove(path)
+            rows.append(result("mapper.compute", {"resolution": res, "workers": w, "days": 3},
+                               stats, points_per_s=nx * ny * 3 / stats["median_s"]))
+    return rows
+
+
+def bench_mapper_plot(quick: bool) -> list[dict]:
+    """``plot_map`` (category mode) on a precomputed grid, with overlays when available."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import geopandas as gpd
+    import mapper
+
+    res = 100 if quick else 300
+    coords = mapper.REGION_COORDINATES["WORLD"]
+    lon_vals, lat_vals, nx, ny = mapper.create_grid(res, *coords)
+    mm, path = mapper.compute_visibility_map_parallel(lon_vals, lat_vals, FIXED_CONJUNCTION, 3, 1)
+    categories, colors = mapper.get_category_colors(1)
+
+    try:
+        t0 = perf_counter()
+        states, places = mapper.load_shapefiles("scripts/map_shp_files/combined_polygons.shp",
+                                                "scripts/map_shp_files/combined_points.shp",
+                                                mapper.REGION_CITIES["WORLD"])
+        states, places = mapper.clip_map(states, places, *coords)
+        load_s, overlays = perf_counter() - t0, True
+    except Exception as e:                      # shapefiles are optional for the timing
+        print_ts(f"mapper.plot: overlays unavailable ({e}); plotting without them")
+        states = places = gpd.GeoDataFrame(geometry=[])
+        load_s, overlays = None, False
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        stats = timeit(lambda: mapper.plot_map(
+            lon_vals, lat_vals, mm, states, places, list(categories.keys()), colors,
+            FIXED_CONJUNCTION, 3, out_dir, "Ramadan", 1446, 1, 3, "category"),
+            1 if quick else 3, warmup=0)
+        jpgs = list(pathlib.Path(out_dir).glob("*.jpg"))
+        size = jpgs[0].stat().st_size if jpgs else None
+    del mm
+    os.remove(path)
+    return [result("mapper.plot", {"resolution": res, "overlays": overlays}, stats,
+                   shapefile_load_s=load_s, jpg_bytes=size)]
+
+
+def bench_http(quick: bool) -> list[dict]:
+    """End-to-end request throughput with the Flask test client, serial and 8 threads."""
+    import app
+
+    n = 50 if quick else 400
+    requests_by_endpoint = {
+        "prayer_times":  lambda c: c.post("/prayer_times", json={"lat": 43.65, "lon": -79.38,
+                                                                   "date": "2025-03-01"}),
+        "vis_calc":      lambda c: c.post("/vis_calc", json={"lat": 43.65, "lon": -79.38,
+                                                               "hijri_month": 9, "hijri_year": 1446}),
+        "upcoming_hijri": lambda c: c.get("/upcoming_hijri?date=2025-03-01"),
+        "maps_index":    lambda c: c.get("/maps_index"),
+        "index":         lambda c: c.get("/"),
+    }
+    rows = []
+    for endpoint, call in requests_by_endpoint.items():
+        for threads in (1, 8):                  # 8 == gunicorn --threads in the Procfile
+            clients = [app.app.test_client() for _ in range(threads)]
+            def worker(i):
+                r = call(clients[i % threads])
+                assert r.status_code == 200, (endpoint, r.status_code)
+            t0 = perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(worker, range(n)))
+            elapsed = perf_counter() - t0
+            rows.append(result("http.throughput", {"endpoint": endpoint, "threads": threads},
+                               {"n": n, "mean_s": elapsed / n, "median_s": elapsed / n},
+                               requests_per_s=n / elapsed))
+    return rows
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _post_prayer_times(port: int, timeout: float = 5) -> bool:
+    # urllib, not requests: offline() stubs requests.get for the in-process suites
+    body = json.dumps({"lat": 43.65, "lon": -79.38, "date": "2025-03-01"}).encode()
+    req = urllib.request.Request(f"http://127.0.0.1:{port}/prayer_times", data=body,
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        return r.status == 200
+
+
+def bench_startup(quick: bool) -> list[dict]:
+    """gunicorn cold start (2 workers, as in the Dockerfile) with and without PRELOAD_APP:
+    time to the first successful request and per-worker RSS / PSS / USS once warm."""
+    rows = []
+    for preload in (False, True):
+        for _ in range(1 if quick else 3):
+            port = _free_port()
+            env = {**os.environ, "PRELOAD_APP": "1" if preload else "0"}
+            t0 = perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+                 "--workers", "2", "--threads", "8", "app:app"],
+                cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                first = None
+                while first is None and perf_counter() - t0 < 120:
+                    try:
+                        if _post_prayer_times(port):
+                            first = perf_counter() - t0
+                    except OSError:
+                        sleep(0.02)
+                # warm every worker so lazily-built state is counted too
+                for _ in range(40):
+                    _post_prayer_times(port)
+                mem = [w.memory_full_info() for w in psutil.Process(proc.pid).children()]
+            finally:
+                proc.terminate()
+                proc.wait(30)
+            mb = lambda v: round(v / (1024 * 1024), 1)
+            rows.append(result("startup.gunicorn", {"preload": preload, "workers": 2},
+                               {"n": 1, "mean_s": first, "median_s": first},
+                               worker_rss_mb=[mb(m.rss) for m in mem],
+                               worker_pss_mb=[mb(getattr(m, "pss", 0)) for m in mem],
+                               worker_uss_mb=[mb(m.uss) for m in mem]))
+    return rows
+
+
+SUITES = {
+    "prayer":  bench_prayer,
+    "hijri":   bench_hijri,
+    "vis":     bench_vis,
+    "compute": bench_mapper_compute,
+    "plot":    bench_mapper_plot,
+    "http":    bench_http,
+    "startup": bench_startup,
+}
+
+# ---------------------------------------------------------------------------#
+# Reporting                                                                  #
+# ---------------------------------------------------------------------------#
+
+def environment() -> dict:
+    try:
+        from importlib.metadata import version
+        it_version = version("islamic_times")
+    except Exception:
+        it_version = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=ROOT).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp":     datetime.now().isoformat(timespec="seconds"),
+        "commit":        commit,
+        "python":        platform.python_version(),
+        "islamic_times": it_version,
+        "platform":      platform.platform(),
+        "cpu_count":     os.cpu_count(),
+    }
+
+
+def _key(row: dict) -> str:
+    return row["name"] + json.dumps(row["params"], sort_keys=True, ensure_ascii=False)
+
+
+def compare(previous: dict, current: dict, threshold: float) -> list[str]:
+    """Return a line per benchmark whose median slowed by more than ``threshold``×."""
+    before = {_key(r): r for r in previous["results"]}
+    regressions = []
+    for row in current["results"]:
+        old = before.get(_key(row))
+        if not old or not old.get("median_s"):
+            continue
+        ratio = row["median_s"] / old["median_s"]
+        if ratio > threshold:
+            regressions.append(f"{row['name']} {row['params']}: "
+                               f"{old['median_s'] * 1000:.2f} -> {row['median_s'] * 1000:.2f} ms (x{ratio:.2f})")
+    return regressions
+
+
+def main(suites: list[str], quick: bool, out_dir: str, compare_to: str | None,
+         threshold: float) -> int:
+    os.chdir(ROOT)      # app.py and mapper.py resolve static/ and shapefiles relative to the root
+    report = {"environment": environment(), "quick": quick, "results": [], "rss_mb": {}}
+    with offline():
+        for name in suites:
+            print_ts(f"=== {name} ===")
+            report["results"].extend(SUITES[name](quick))
+            gc.collect()
+            report["rss_mb"][name] = round(rss_mb(), 1)
+
+    out = pathlib.Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f"bench_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.json"
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    print_ts(f"Results written to {path}")
+
+    if compare_to:
+        regressions = compare(json.loads(pathlib.Path(compare_to).read_text()), report, threshold)
+        for line in regressions:
+            print_ts(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print_ts(f"No regressions over x{threshold} against {compare_to}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the islamictimes hot paths offline")
+    parser.add_argument("--suite",     nargs="+", default=list(SUITES), choices=list(SUITES))
+    parser.add_argument("--quick",     action="store_true", help="Fewer repeats and smaller grids")
+    parser.add_argument("--out_dir",   type=str,   default="benchmarks", help="Where the JSON report goes")
+    parser.add_argument("--compare",   type=str,   default=None, help="Previous JSON report to diff against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    sys.exit(main(args.suite, args.quick, args.out_dir, args.compare, args.threshold))
@@ -0,0 +1,390 @@
+"""
+Open-loop load test of app.py under gunicorn, with local stand-ins for every
+upstream it calls (Nominatim, ipapi.co, the maps host), so nothing public is hit.
+
+For each gunicorn configuration found in the Procfile and the Dockerfile the
+server is started with ``OSM_NOMINATIM`` / ``IPINFO`` / ``MAPS_BASE`` pointed
+at the stub, and driven at increasing Poisson arrival rates with a mix of
+/prayer_times, /vis_calc, /maps_index and /upcoming_hijri requests.  Latency
+is measured from each request's *scheduled* send time, so a server that falls
+behind shows up in the percentiles instead of slowing the generator down.
+
+    python scripts/loadtest.py                                   # Procfile + Dockerfile configs
+    python scripts/loadtest.py --config procfile --rates 20 40 80
+    python scripts/loadtest.py --mix prayer_times=90 maps_index=10 --stub_latency_ms 400
+    python scripts/loadtest.py --url http://host:8000            # an already running server
+
+Each step reports p50/p95/p99 and achieved throughput; the saturation
+throughput of a configuration is the highest rate it sustained (≥ 95% of
+the requests sent answered in time, p99 within --slo_ms, < 1% errors).  The generator shares the CPU with
+the server when both run on one machine; steps where it was the bottleneck are
+flagged ``client_bound``.
+"""
+import os, sys, json, math, random, shlex, argparse, pathlib, subprocess, threading
+import urllib.request, urllib.error
+
+from time import perf_counter, sleep
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+from benchmark import ROOT, print_ts, environment, _free_port
+from scheduler import TOP_CITIES, WARM_METHODS
+from islamic_times.time_equations import gregorian_to_hijri
+
+DEFAULT_MIX = {"prayer_times": 80, "vis_calc": 5, "maps_index": 10, "upcoming_hijri": 5}
+
+SUSTAINED_RATIO = 0.95      # achieved / sent rate for a step to count as sustained
+MAX_ERROR_RATE  = 0.01
+
+# ---------------------------------------------------------------------------#
+# Server configurations                                                      #
+# ---------------------------------------------------------------------------#
+
+def _gunicorn_flags(command: str) -> dict:
+    """workers / threads / timeout from a gunicorn command line (gunicorn's defaults otherwise)."""
+    args = shlex.split(command[command.index("gunicorn"):])
+    flags = {"workers": 1, "threads": 1, "timeout": 30}
+    for i, arg in enumerate(args):
+        for name, short in (("workers", "-w"), ("threads", None), ("timeout", "-t")):
+            if arg in (f"--{name}", short) and i + 1 < len(args):
+                flags[name] = int(args[i + 1])
+            elif arg.startswith(f"--{name}="):
+                flags[name] = int(arg.split("=", 1)[1])
+    return flags
+
+
+def server_configs() -> dict[str, dict]:
+    """The gunicorn settings the app is deployed with: Procfile ``web:`` and Dockerfile ``CMD``."""
+    configs = {}
+    procfile = ROOT / "Procfile"
+    if procfile.exists():
+        for line in procfile.read_text().splitlines():
+            if line.startswith("web:") and "gunicorn" in line:
+                configs["procfile"] = _gunicorn_flags(line)
+    dockerfile = ROOT / "Dockerfile"
+    if dockerfile.exists():
+        for line in dockerfile.read_text().splitlines():
+            if line.startswith("CMD") and "gunicorn" in line:
+                cmd = line[3:].strip()
+                if cmd.startswith("["):
+                    cmd = " ".join(json.loads(cmd))
+                configs["dockerfile"] = _gunicorn_flags(cmd)
+    return configs
+
+# ---------------------------------------------------------------------------#
+# Upstream stand-ins                                                         #
+# ---------------------------------------------------------------------------#
+
+STUB_MAPS_INDEX = [
+    {"month": "Ramaḍān", "year": 1446, "file": "World/1446/2025-02-28 Ramadan 1446—Yallop.jpg"},
+    {"month": "Shawwāl", "year": 1446, "file": "World/1446/2025-03-29 Shawwal 1446—Yallop.jpg"},
+]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Nominatim ``/search``, ipapi ``/json/`` and the maps host's ``/maps_index.json``."""
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/search":
+            name, lat, lon = random.choice(TOP_CITIES)
+            body = [{"lat": str(lat), "lon": str(lon), "display_name": name}]
+        elif path == "/json/":
+            _, lat, lon = random.choice(TOP_CITIES)
+            body = {"latitude": lat, "longitude": lon}
+        elif path == "/maps_index.json":
+            body = STUB_MAPS_INDEX
+        else:
+            self.send_error(404)
+            return
+        srv = self.server
+        if srv.latency_ms > 0:
+            sleep(srv.latency_ms / 1000 * random.lognormvariate(0, srv.jitter))
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with srv.lock:
+            srv.hits[path] = srv.hits.get(path, 0) + 1
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency_ms: float, jitter: float) -> ThreadingHTTPServer:
+    """Serve the stand-ins on a free local port, with log-normal injected latency
+    (median ``latency_ms``, shape ``jitter``)."""
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    srv.daemon_threads = True
+    srv.latency_ms, srv.jitter = latency_ms, jitter
+    srv.lock, srv.hits = threading.Lock(), {}
+    threading.Thread(target=srv.serve_forever, name="stub", daemon=True).start()
+    return srv
+
+
+def stub_env(srv: ThreadingHTTPServer) -> dict:
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    return {"OSM_NOMINATIM": f"{base}/search", "IPINFO": f"{base}/json/", "MAPS_BASE": base}
+
+# ---------------------------------------------------------------------------#
+# Traffic                                                                    #
+# ---------------------------------------------------------------------------#
+
+class Traffic:
+    """Request generator.  Cities are drawn with Zipf-like weights (by their rank in
+    TOP_CITIES); a ``hot_fraction`` of prayer-time requests use the city's exact
+    (geocoded) coordinates, the rest a GPS fix scattered around it."""
+
+    def __init__(self, mix: dict[str, float], hot_fraction: float, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.endpoints, self.weights = zip(*[(k, v) for k, v in mix.items() if v > 0])
+        self.city_weights = [1 / (rank + 1) for rank in range(len(TOP_CITIES))]
+        self.hot_fraction = hot_fraction
+        today = datetime.now(timezone.utc).date()
+        self.dates = [today.isoformat(), (today + timedelta(days=1)).isoformat()]
+        h_year, h_month, _ = gregorian_to_hijri(today.year, today.month, today.day)
+        h_month, h_year = (1, h_year + 1) if h_month == 12 else (h_month + 1, h_year)
+        self.upcoming = (h_year, h_month)
+
+    def _place(self) -> tuple[float, float]:
+        _, lat, lon = self.rng.choices(TOP_CITIES, self.city_weights)[0]
+        if self.rng.random() >= self.hot_fraction:
+            lat += self.rng.gauss(0, 0.15)
+            lon += self.rng.gauss(0, 0.15)
+        return round(lat, 6), round(lon, 6)
+
+    def next(self) -> tuple[str, str, dict | None]:
+        """(endpoint, path, JSON body or None for GET)."""
+        endpoint = self.rng.choices(self.endpoints, self.weights)[0]
+        if endpoint == "prayer_times":
+            lat, lon = self._place()
+            date = self.dates[0] if self.rng.random() < 0.9 else self.dates[1]
+            return endpoint, "/prayer_times", {"lat": lat, "lon": lon, "date": date,
+                                               "method": self.rng.choice(WARM_METHODS)}
+        if endpoint == "vis_calc":
+            lat, lon = self._place()
+            h_year, h_month = self.upcoming
+            return endpoint, "/vis_calc", {"lat": lat, "lon": lon,
+                                           "hijri_month": h_month, "hijri_year": h_year}
+        if endpoint == "maps_index":
+            return endpoint, "/maps_index", None
+        if endpoint == "upcoming_hijri":
+            return endpoint, f"/upcoming_hijri?date={self.dates[0]}", None
+        raise ValueError(f"unknown endpoint {endpoint!r}")
+
+# ---------------------------------------------------------------------------#
+# Load generation                                                            #
+# ---------------------------------------------------------------------------#
+
+def _send(base_url: str, path: str, body: dict | None, scheduled: float, timeout: float):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data,
+                                 headers={"Content-Type": "application/json"} if data else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            r.read()
+            status = r.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, perf_counter() - scheduled
+
+
+def _percentile(sorted_vals: list[float], q: float) -> float | None:
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, max(0, math.ceil(q * len(sorted_vals)) - 1))]
+
+
+def _summary(latencies: list[float]) -> dict:
+    lat = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 2)
+    return {"n": len(lat), "p50_ms": ms(_percentile(lat, .50)), "p95_ms": ms(_percentile(lat, .95)),
+            "p99_ms": ms(_percentile(lat, .99)), "max_ms": ms(lat[-1] if lat else None)}
+
+
+def run_step(base_url: str, traffic: Traffic, rate: float, duration: float,
+             pool: ThreadPoolExecutor, timeout: float) -> dict:
+    """Offer Poisson arrivals at ``rate``/s for ``duration`` s and wait for every response."""
+    proc = psutil.Process()
+    proc.cpu_percent()
+    futures = []
+    start = perf_counter()
+    t = start
+    lag = 0.0
+    while True:
+        t += traffic.rng.expovariate(rate)
+        if t - start > duration:
+            break
+        delay = t - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        lag = max(lag, -delay)
+        endpoint, path, body = traffic.next()
+        futures.append((endpoint, pool.submit(_send, base_url, path, body, t, timeout)))
+
+    by_endpoint: dict[str, list[float]] = {}
+    latencies, errors = [], 0
+    for endpoint, fut in futures:
+        status, latency = fut.result()
+        if status == 200:
+            latencies.append(latency)
+            by_endpoint.setdefault(endpoint, []).append(latency)
+        else:
+            errors += 1
+    elapsed = perf_counter() - start
+    cpu = proc.cpu_percent() / 100
+
+    row = {"offered_rps": rate, "sent": len(futures), "sent_rps": round(len(futures) / duration, 1),
+           "errors": errors, "achieved_rps": round(len(latencies) / elapsed, 1), **_summary(latencies),
+           "endpoints": {k: _summary(v) for k, v in sorted(by_endpoint.items())},
+           # the generator is one GIL-bound process: near a full core, or unable to
+           # send on schedule, means the numbers measure it rather than the server
+           "client_cpu": round(cpu, 2), "client_bound": cpu > 0.9 or lag > 1.0}
+    return row
+
+
+def sustained(row: dict, slo_ms: float) -> bool:
+    # against what was actually sent: Poisson arrivals rarely hit the nominal rate exactly
+    return (row["achieved_rps"] >= SUSTAINED_RATIO * row["sent_rps"]
+            and row["errors"] <= MAX_ERROR_RATE * max(row["sent"], 1)
+            and row["p99_ms"] is not None and row["p99_ms"] <= slo_ms)
+
+
+def ramp(base_url: str, traffic: Traffic, rates: list[float], duration: float, slo_ms: float,
+         concurrency: int, timeout: float) -> dict:
+    """Step through ``rates`` until one isn't sustained; returns the steps and saturation point."""
+    steps = []
+    with ThreadPoolExecutor(concurrency) as pool:
+        for rate in rates:
+            row = run_step(base_url, traffic, rate, duration, pool, timeout)
+            row["sustained"] = sustained(row, slo_ms)
+            steps.append(row)
+            print_ts(f"  {rate:>7.1f}/s offered  {row['achieved_rps']:>7.1f}/s achieved  "
+                     f"p50 {row['p50_ms']} p95 {row['p95_ms']} p99 {row['p99_ms']} ms  "
+                     f"errors {row['errors']}/{row['sent']}"
+                     + ("  [client-bound]" if row["client_bound"] else "")
+                     + ("" if row["sustained"] else "  [not sustained]"))
+            if not row["sustained"]:
+                break
+    ok = [s for s in steps if s["sustained"]]
+    return {"steps": steps,
+            "saturation_rps": max((s["achieved_rps"] for s in ok), default=0.0),
+            "peak_achieved_rps": max((s["achieved_rps"] for s in steps), default=0.0)}
+
+# ---------------------------------------------------------------------------#
+# gunicorn                                                                   #
+# ---------------------------------------------------------------------------#
+
+def _wait_ready(base_url: str, deadline: float = 120):
+    t0 = perf_counter()
+    while perf_counter() - t0 < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/upcoming_hijri?date=2025-01-01", timeout=2) as r:
+                if r.status == 200:
+                    return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError(f"server at {base_url} did not come up within {deadline}s")
+
+
+def start_gunicorn(config: dict, env: dict) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    cmd = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+           "--workers", str(config["workers"]), "--threads", str(config["threads"]),
+           "--timeout", str(config["timeout"]), "app:app"]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url)
+    except Exception:
+        proc.terminate()
+        raise
+    return proc, base_url
+
+
+def _warm(base_url: str, traffic: Traffic, seconds: float, concurrency: int, timeout: float):
+    """Unmeasured traffic so lazy imports and per-worker state are in place first."""
+    with ThreadPoolExecutor(concurrency) as pool:
+        run_step(base_url, traffic, 20, seconds, pool, timeout)
+
+# ---------------------------------------------------------------------------#
+
+def main(args) -> int:
+    os.chdir(ROOT)      # --out_dir and --compare are relative to the root, as in benchmark.py
+    stub = start_stub(args.stub_latency_ms, args.stub_jitter)
+    env = {**stub_env(stub), **dict(kv.split("=", 1) for kv in args.server_env)}
+    mix = {k: float(v) for k, v in (kv.split("=", 1) for kv in args.mix)} if args.mix else DEFAULT_MIX
+    rates = args.rates or [args.start_rate * 2 ** i for i in range(args.max_steps)]
+
+    if args.url:
+        targets = {"url": None}
+        print_ts(f"Testing {args.url}; point its upstreams at the stub with: "
+                 + " ".join(f"{k}={v}" for k, v in stub_env(stub).items()))
+    else:
+        configs = server_configs()
+        targets = {name: configs[name] for name in (args.config or configs)}
+
+    report = {"environment": environment(), "mix": mix, "duration_s": args.duration,
+              "slo_ms": args.slo_ms, "hot_fraction": args.hot_fraction,
+              "stub_latency_ms": args.stub_latency_ms, "server_env": args.server_env, "configs": {}}
+    for name, config in targets.items():
+        print_ts(f"=== {name} {config or args.url} ===")
+        proc = None
+        base_url = args.url
+        if config is not None:
+            proc, base_url = start_gunicorn(config, env)
+        try:
+            _warm(base_url, Traffic(mix, args.hot_fraction, seed=1), args.warmup, args.concurrency, args.timeout)
+            traffic = Traffic(mix, args.hot_fraction, seed=args.seed)
+            result = ramp(base_url, traffic, rates, args.duration, args.slo_ms, args.concurrency, args.timeout)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(30)
+        report["configs"][name] = {"gunicorn": config, **result}
+        print_ts(f"{name}: saturation {result['saturation_rps']}/s "
+                 f"(peak achieved {result['peak_achieved_rps']}/s)")
+    report["stub_hits"] = stub.hits
+    stub.shutdown()
+
+    out = pathlib.Path(args.out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f"load_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.json"
+    path.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    print_ts(f"Results written to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-loop load test of the app with stubbed upstreams")
+    parser.add_argument("--config",          nargs="+", default=None, choices=("procfile", "dockerfile"),
+                        help="gunicorn configurations to test (default: all found)")
+    parser.add_argument("--url",             type=str,   default=None, help="Test a running server instead")
+    parser.add_argument("--mix",             nargs="+",  default=None, metavar="ENDPOINT=WEIGHT",
+                        help=f"Traffic mix (default {' '.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument("--rates",           nargs="+",  type=float, default=None,
+                        help="Offered request rates per step (default: doubling from --start_rate)")
+    parser.add_argument("--start_rate",      type=float, default=10)
+    parser.add_argument("--max_steps",       type=int,   default=8)
+    parser.add_argument("--duration",        type=float, default=15, help="Seconds per step")
+    parser.add_argument("--warmup",          type=float, default=3,  help="Unmeasured seconds before the ramp")
+    parser.add_argument("--slo_ms",          type=float, default=1000, help="p99 a sustained step must stay within")
+    parser.add_argument("--hot_fraction",    type=float, default=0.6,
+                        help="Share of prayer-time requests at exact city coordinates (cacheable)")
+    parser.add_argument("--stub_latency_ms", type=float, default=150, help="Median injected upstream latency")
+    parser.add_argument("--stub_jitter",     type=float, default=0.5, help="Log-normal shape of that latency")
+    parser.add_argument("--server_env",      nargs="*",  default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the server (e.g. PRELOAD_APP=1)")
+    parser.add_argument("--concurrency",     type=int,   default=256, help="Max requests in flight")
+    parser.add_argument("--timeout",         type=float, default=10)
+    parser.add_argument("--seed",            type=int,   default=0)
+    parser.add_argument("--out_dir",         type=str,   default="benchmarks")
+    sys.exit(main(parser.parse_args()))
@@ -1,11 +1,12 @@
-import os, sys, tempfile, gc, psutil, argparse
+import os, sys, math, glob, tempfile, gc, psutil, argparse, threading, atexit, signal
 
 import numpy as np
 import geopandas as gpd
 import islamic_times.astro_core as fast_astro
 
-from time import time
+from time import time, time_ns
 from typing import List, Tuple
+from contextlib import nullcontext
 from datetime import timedelta, datetime
 from multiprocessing import Pool, cpu_count, Process
 from islamic_times.time_equations import get_islamic_month, gregorian_to_hijri
@@ -20,113 +21,62 @@ from matplotlib.axes import Axes
 from matplotlib.patches import Rectangle
 from matplotlib.patheffects import Stroke, Normal
 
-AVERAGE_LUNAR_MONTH_DAYS: int = 29.53059
-
-CITIES_WORLD: list[str] = [
-        # PACIFIC
-        'Honolulu', 
-        
-        # NORTH AMERICA
-        'Vancouver', 'Los Angeles', 'Mexico City',
-        'Toronto', 'Miami', 'Washington,  D.C.',
-
-        # SOUTH AMERICA
-        'Lima', 'Bogota', 'Santiago', 'São Paulo',
-
-        # WEST AFRICA
-        'Dakar', 'Lagos',
-
-        # EUROPE
-        'Madrid', 'London', 'Vienna', 'Moscow',
-
-        # SOUTH AFRICA
-        'Cape Town', 
-
-        # MIDDLE EAST
-        'Istanbul', 'Cairo', 'Makkah', 'Tehran',
+# Project root on the path so the mapper shares app-side modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import mapper_phase
+from profiler import profile
+from grid_store import (GridStore, GridKey, RunCheckpoint, overlay_hash, render_key,
+                        render_is_current, record_render, record_index)
+from regions import REGION_COORDINATES, REGION_CITIES
 
-        # EAST AFRICA
-        'Nairobi', 'Addis Ababa', 
-
-        # SOUTH ASIA
-        'Islamabad', 'Mumbai',
-
-        # SOUTH EAST ASIA
-        'Bangkok',  'Singapore',
-
-        # EAST ASIA
-        'Hong Kong', 'Beijing', 'Tokyo', 
-        
-        # AUSTRALIA
-        'Sydney', 'Perth' 
-    ]
-
-CITIES_IRAN: list[str] = [
-    'Tehran', 'Mashhad', 'Kerman', 'Shiraz', 'Zanjan', 
-    'Ardabil', 'Isfahan', 'Gorgan', 'Tabriz', 'Semnan', 
-    'Yazd', 'Rasht', 'Arak', 'Boshruyeh', 'Mehran', 'Dargaz', 
-    'Chabahar', 'Zahedan', 'Birjand', 'Sanandaj', 'Ahvaz', 
-    'Saravan', 'Hamadan', 'Khorramabad', 'Qomsheh', 'Ilam', 
-    'Sari', 'Qazvin', 'Bandar-e-Abbas', 'Bandar-e Bushehr', 
-    'Sirjan', 'Kashmar', 'Bojnurd', 'Qom', 'Urmia', 'Khvoy',
-    'Yasuj'
-    ]
-
-CITIES_MIDDLE_EAST: list[str] = [
-    'Istanbul', 'Khartoum', 'Cairo', 'Luxor', 'Ankara', 
-    'Beirut', 'Aleppo', 'Medina', 'Makkah', 'Djibouti',
-    'Sanaa', 'Irbil', 'Baghdad', 'Riyadh', 'Kuwait City',
-    'Baku', 'Tehran', 'Doha', 'Dubai', 'Kerman', 'Muscat', 
-    'Mashhad', 'Karachi', 'Kabul'
-    ]
+AVERAGE_LUNAR_MONTH_DAYS: int = 29.53059
 
-CITIES_NORTH_AMERICA: list[str] = [
-    # Pacific
-    'Honolulu',
-    
-    # CANADA
-    'Vancouver', 'Edmonton', 'Calgary', 'Winnipeg', 'Thunder Bay', 
-    'Toronto', 'Montréal', 'Halifax', 'St. John\'s',
-
-    # UNITED STATES
-    'Portland', 'San Francisco', 'Los Angeles', 'Billings', 
-    'Albuquerque', 'Denver', 'Kansas City', 'Dallas', 'Houston', 
-    'Minneapolis', 'Chicago', 'Orlando', 'Atlanta', 'Miami', 
-    'Washington,  D.C.', 'Boston',
-
-    # MEXICO
-    'Hermosillo', 'Monterrey', 'Mexico City', 'Mérida',
-
-    # CARIBBEAN
-    'Havana', 'Kingston',
-]
-
-CITIES_EUROPE: list[str] = [
-    'Lisbon', 'Dublin', 'Madrid', 'Edinburgh',
-    'London', 'Barcelona', 'Paris', 'Amsterdam', 'Zürich', 
-    'Oslo', 'Rome', 'København', 'Venice', 'Berlin', 
-    'Vienna', 'Stockholm', 'Sarajevo', 'Warsaw', 'Athens',
-    'Riga', 'Bucharest', 'Minsk', 'Istanbul', 'Kyiv',
-    'Ankara', 'Moscow', 'Rostov', 'Tbilisi'
-]
-
-REGION_COORDINATES: dict[str, tuple[int, int, int, int]] = {
-    'WORLD'         :   (-179, 180, -61, 61),
-    'WORLD_FULL'    :   (-179, 180, -89, 90),
-    'NORTH_AMERICA' :   (-170, -40, 15, 61),
-    'EUROPE'        :   (-15, 50, 34, 61),
-    'MIDDLE_EAST'   :   (25, 75, 10, 45),
-    'IRAN'          :   (43.5, 63.5, 24.5, 40)
-}
-
-REGION_CITIES: dict[str, list[str]] = {
-    'WORLD'         : CITIES_WORLD,
-    'WORLD_FULL'    : CITIES_WORLD, # NOT YET SUPPORTED
-    'NORTH_AMERICA' : CITIES_NORTH_AMERICA,
-    'EUROPE'        : CITIES_EUROPE,
-    'MIDDLE_EAST'   : CITIES_MIDDLE_EAST,
-    'IRAN'          : CITIES_IRAN 
-}
+# Bump when plot_map's output changes so stored renders are redrawn.
+STYLE_VERSION: int = 1
+
+MB: int = 1024 * 1024
+MEMORY_EXIT_CODE: int = 75          # exit status when --memory_budget is exceeded
+CHUNKS_PER_WORKER: int = 4          # latitude chunks per worker: finer checkpoints, better balance
+
+# Temp grid files (vis_<pid>_<n>.dat) of this process.  They are removed when
+# done with, at exit, on SIGTERM and when the memory watchdog aborts; files
+# left behind by a killed run are swept by the next one.
+_TEMP_FILES: set = set()
+
+def temp_grid_path(prefix: str = "vis") -> str:
+    path = os.path.join(tempfile.gettempdir(), f"{prefix}_{os.getpid()}_{time_ns()}.dat")
+    _TEMP_FILES.add(path)
+    return path
+
+def remove_temp(path):
+    if path is None:
+        return
+    _TEMP_FILES.discard(path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _cleanup_temp_files():
+    for path in list(_TEMP_FILES):
+        remove_temp(path)
+
+atexit.register(_cleanup_temp_files)
+
+def sweep_stale_temp_files() -> int:
+    """Remove temp grids of mapper processes that no longer exist; returns bytes freed."""
+    freed = 0
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), "*_*_*.dat")):
+        prefix, pid, _ = os.path.basename(path).split("_", 2)
+        if prefix not in ("vis", "cat") or not pid.isdigit() or psutil.pid_exists(int(pid)):
+            continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except OSError:
+            pass
+    return freed
 
 class Tee:
     def __init__(self, filename, log_dir="mapper_logs", mode="w+", encoding="utf-8"):
@@ -143,75 +93,101 @@ class Tee:
         self.stdout.flush()
         self.file.flush()
 
+def _category_lut(criterion: int):
+    """uint8 lookup from the batch kernel's category codes to our category indices,
+    or None if this islamic_times build can't return codes."""
+    if not hasattr(fast_astro, "compute_visibilities_batch_codes"):
+        return None
+    try:
+        from islamic_times.mapper.palette import category_labels
+    except ImportError:
+        return None
+    ours = list(get_category_colors(criterion)[0].keys())
+    # polar "... doesn't exist" cases have no colour of their own here: no crescent either way
+    fallback = ours.index("Moonset before sunset.")
+    lut = np.full(256, fallback, dtype=np.uint8)
+    for code, label in enumerate(category_labels(criterion)):
+        if label in ours:
+            lut[code] = ours.index(label)
+    return lut
+
+def _compute_band(lat_chunk, lon_vals, new_moon_date, days, criterion,
+                  utc_offset, elev, temp, press, is_raw, cat_to_idx, lut=None):
+    """(rows, nx, days) float32 q-values or uint8 category indices for a latitude band."""
+    nx = len(lon_vals)
+    # flat coordinate arrays built directly (no meshgrid + ravel copies)
+    lats = np.repeat(np.asarray(lat_chunk, dtype=np.float64), nx)
+    lons = np.tile(np.asarray(lon_vals, dtype=np.float64), len(lat_chunk))
+
+    if is_raw:
+        res = fast_astro.compute_visibilities_batch(lats, lons, new_moon_date, days, criterion,
+                                                    utc_offset, elev, temp, press, "r")
+        return res.astype(np.float32).reshape(len(lat_chunk), nx, days)
+
+    if lut is not None:
+        codes = fast_astro.compute_visibilities_batch_codes(lats, lons, new_moon_date, days, criterion,
+                                                            utc_offset, elev, temp, press)
+        return lut[codes].reshape(len(lat_chunk), nx, days)
+
+    # map string labels → integers; labels we have no colour for go where _category_lut sends them
+    res = fast_astro.compute_visibilities_batch(lats, lons, new_moon_date, days, criterion,
+                                                utc_offset, elev, temp, press, "c")
+    mapped = np.full(res.shape, cat_to_idx["Moonset before sunset."], dtype=np.uint8)
+    for category, idx in cat_to_idx.items():
+        mapped[res == category] = idx
+    return mapped.reshape(len(lat_chunk), nx, days)
+
 def _write_chunk_to_memmap(args):
     (
-      i_chunk, chunk, lon_vals, new_moon_date, days, criterion,
+      start, chunk, lon_vals, new_moon_date, days, criterion,
       utc_offset, elev, temp, press, is_raw,
       cat_to_idx,
       vis_file, shape
     ) = args
 
-    # reopen the memmap for read/write:
-    vis_memmap = np.memmap(vis_file, dtype=(np.float32 if is_raw else np.uint8),
-                           mode="r+", shape=shape)
-
-    # do your batch compute
-    L, M = np.meshgrid(chunk, lon_vals, indexing="ij")
-    res_flat = fast_astro.compute_visibilities_batch(
-        np.ascontiguousarray(L.ravel(), dtype=np.float64),
-        np.ascontiguousarray(M.ravel(), dtype=np.float64),
-        new_moon_date, days, criterion,
-        utc_offset, elev, temp, press,
-        "r" if is_raw else "c"
-    )
-    res = res_flat.reshape(chunk.size, len(lon_vals), days)
-
-    # if in category mode, map string labels → integers
-    if not is_raw:
-        n_chunk = chunk.size
-        nx = len(lon_vals)
-        mapped = np.empty((n_chunk, nx, days), dtype=np.uint8)
-        for category, idx in cat_to_idx.items():
-            mask = (res == category)
-            if mask.any():
-                mapped[mask] = idx
-        res = mapped
+    res = _compute_band(chunk, lon_vals, new_moon_date, days, criterion,
+                        utc_offset, elev, temp, press, is_raw, cat_to_idx, _category_lut(criterion))
 
     # write into the right slice
-    start = sum(c.size for c in VIS_LAT_CHUNKS[:i_chunk])
     vis_memmap = np.memmap(vis_file, dtype=(np.float32 if is_raw else np.uint8),
                            mode="r+", shape=shape)
-    vis_memmap[start:start+n_chunk, :, :] = res
+    vis_memmap[start:start+chunk.size, :, :] = res
     vis_memmap.flush()
+    return start, start + chunk.size
 
 def _plot_worker(
     lon_vals, lat_vals, vis_file, shape, mode,
     shp_states_path, shp_places_path, cities,
     unique_categories, category_colors_rgba,
     start_date, amount, out_dir,
-    islamic_month_name, islamic_year, criterion, region
+    islamic_month_name, islamic_year, criterion, region,
+    band_rows=None, stats=None
 ):
     import geopandas as gpd, numpy as np, matplotlib
     matplotlib.use("Agg")
     import matplotlib.pyplot as plt
     from shapely.geometry import Polygon
-    # re-open memmap
-    vis_mm = np.memmap(vis_file,
-                       dtype=(np.float32 if mode=="raw" else np.uint8),
-                       mode="r", shape=shape)
+    # re-open memmap (streaming mode: read it band by band instead)
+    if band_rows is not None:
+        vis_mm = DiskGrid(vis_file, np.float32 if mode == "raw" else np.uint8, shape, band_rows)
+    else:
+        vis_mm = np.memmap(vis_file,
+                           dtype=(np.float32 if mode=="raw" else np.uint8),
+                           mode="r", shape=shape)
 
     # load & clip shapefiles here, in the child only
-    states = gpd.read_file(shp_states_path)
-    places = gpd.read_file(shp_places_path)
-    places = places[places["NAME"].isin(cities)]
-    places = places.loc[places.groupby("NAME")["POP_MAX"].idxmax()]
-
-    # create clip bbox & apply
-    minx, maxx, miny, maxy = REGION_COORDINATES[region]
-    bbox = Polygon([(minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy)])
-    bbox_gdf = gpd.GeoDataFrame([1], geometry=[bbox], crs=states.crs)
-    states_clip = gpd.overlay(states, bbox_gdf, how="intersection")
-    places_clip = places.cx[minx:maxx, miny:maxy]
+    with mapper_phase("shapefile_load"), profile("mapper.shapefile_load"):
+        states = gpd.read_file(shp_states_path)
+        places = gpd.read_file(shp_places_path)
+        places = places[places["NAME"].isin(cities)]
+        places = places.loc[places.groupby("NAME")["POP_MAX"].idxmax()]
+
+        # create clip bbox & apply
+        minx, maxx, miny, maxy = REGION_COORDINATES[region]
+        bbox = Polygon([(minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy)])
+        bbox_gdf = gpd.GeoDataFrame([1], geometry=[bbox], crs=states.crs)
+        states_clip = gpd.overlay(states, bbox_gdf, how="intersection")
+        places_clip = places.cx[minx:maxx, miny:maxy]
 
     # call your existing plot_map exactly as is,
     # passing vis_mm instead of an in-memory array
@@ -221,12 +197,35 @@ def _plot_worker(
         unique_categories, category_colors_rgba,
         start_date, amount, out_dir,
         islamic_month_name, islamic_year, criterion,
-        amount, mode
+        amount, mode, stats=stats
     )
 
 def print_ts(message: str):
     print(f"[{datetime.fromtimestamp(time()).strftime('%X %d-%m-%Y')}] {message}")
 
+def _grid_tag(lon_vals, lat_vals, new_moon_date, days, criterion, mode) -> str:
+    """Identity of a computed grid, for RunCheckpoint.partial."""
+    return (f"{new_moon_date.isoformat()}|{days}|c{criterion}|{mode}|"
+            f"{len(lon_vals)}:{lon_vals[0]:.6f}:{lon_vals[-1]:.6f}|{len(lat_vals)}:{lat_vals[0]:.6f}:{lat_vals[-1]:.6f}")
+
+def _pending_chunks(done, rows):
+    """(r0, r1) chunks of at most ``rows`` rows covering the rows not yet ``done``."""
+    todo = np.flatnonzero(~done)
+    if todo.size == 0:
+        return
+    for run in np.split(todo, np.flatnonzero(np.diff(todo) > 1) + 1):
+        stop = int(run[-1]) + 1
+        for r0 in range(int(run[0]), stop, rows):
+            yield r0, min(r0 + rows, stop)
+
+def _run_chunks(fn, args_list, num_workers, checkpoint=None):
+    """Run ``fn`` (which returns its chunk's row range) over ``args_list``, on a pool
+    if ``num_workers`` > 1, recording each finished chunk in ``checkpoint``."""
+    with (Pool(num_workers) if num_workers > 1 else nullcontext()) as pool:
+        for r0, r1 in (pool.imap_unordered(fn, args_list) if pool is not None else map(fn, args_list)):
+            if checkpoint is not None:
+                checkpoint.chunk_done(r0, r1)
+
 def split_lat_chunks(lat_vals, n_chunks):
     return np.array_split(lat_vals, n_chunks)
 
@@ -241,8 +240,10 @@ def batch_worker(lat_chunk, lon_vals, dt, days, criterion, utc_offset, elev, tem
 
 def compute_visibility_map_parallel(lon_vals, lat_vals, new_moon_date, days, criterion,
                                     utc_offset=0.0, elev=0.0, temp=20.0, press=101.325,
-                                    mode="category", max_workers=None):
-    """Compute and store (ny, nx, days) results on disk via memmap."""
+                                    mode="category", max_workers=None, checkpoint=None):
+    """Compute and store (ny, nx, days) results on disk via memmap.  With a
+    ``checkpoint`` the file is the run's partial grid and finished latitude
+    chunks are recorded, so an interrupted run picks up where it stopped."""
     # pick dtype: raw→float32, category→uint8
     is_raw = (mode == "raw")
     dtype = np.float32 if is_raw else np.uint8
@@ -250,7 +251,7 @@ def compute_visibility_map_parallel(lon_vals, lat_vals, new_moon_date, days, cri
     # figure out chunking & worker count
     num_workers = cpu_count() if max_workers is None else max_workers
     num_workers = min(num_workers, len(lat_vals))
-    lat_chunks = [c for c in np.array_split(lat_vals, num_workers) if c.size]
+    rows = math.ceil(len(lat_vals) / (num_workers * CHUNKS_PER_WORKER))
 
     print_ts(f"Conjunction Date: {new_moon_date.strftime('%Y-%m-%d %X')}")
 
@@ -259,38 +260,310 @@ def compute_visibility_map_parallel(lon_vals, lat_vals, new_moon_date, days, cri
         categories, _ = get_category_colors(criterion)
         cat_to_idx = { cat: i for i, cat in enumerate(categories.keys()) }
 
-    # create a temporary file to back our full array
-    global VIS_LAT_CHUNKS
-    VIS_LAT_CHUNKS = [c for c in np.array_split(lat_vals, num_workers) if c.size]
-
-    # create the temp memmap
-    vis_file = os.path.join(tempfile.gettempdir(),
-                            f"vis_{os.getpid()}_{int(time())}.dat")
+    # create the file backing our full array
     shape = (len(lat_vals), len(lon_vals), days)
-    dtype = np.float32 if is_raw else np.uint8
-    np.memmap(vis_file, dtype=dtype, mode="w+", shape=shape)
+    done = np.zeros(len(lat_vals), dtype=bool)
+    if checkpoint is not None:
+        vis_file, done = checkpoint.partial(
+            _grid_tag(lon_vals, lat_vals, new_moon_date, days, criterion, mode), shape, dtype)
+    else:
+        vis_file = temp_grid_path()
+        np.memmap(vis_file, dtype=dtype, mode="w+", shape=shape)
+    if done.any():
+        print_ts(f"Checkpoint: {done.sum()} of {len(lat_vals)} rows already computed")
 
     # build argument list
     args_list = []
-    for i, chunk in enumerate(VIS_LAT_CHUNKS):
+    for r0, r1 in _pending_chunks(done, rows):
         args_list.append((
-            i, chunk, lon_vals, new_moon_date, days, criterion,
+            r0, lat_vals[r0:r1], lon_vals, new_moon_date, days, criterion,
             utc_offset, elev, temp, press, is_raw,
             cat_to_idx,
             vis_file, shape
         ))
 
-    if num_workers == 1:
-        for a in args_list:
-            _write_chunk_to_memmap(a)
-    else:
-        with Pool(num_workers) as pool:
-            pool.map(_write_chunk_to_memmap, args_list)
+    _run_chunks(_write_chunk_to_memmap, args_list, num_workers, checkpoint)
 
     # return both objects so callers know where the file lives
     mm = np.memmap(vis_file, dtype=dtype, mode="r", shape=shape)
     return mm, vis_file
 
+def build_grid(store, key, bounds, lon_vals, lat_vals, new_moon_date, amount, workers=None, budget=None,
+               checkpoint=None):
+    """
+    Assemble the (ny, nx, amount) grid for ``key`` in a temp memmap, computing
+    only the days the grid store doesn't already hold.  A region covered by a
+    stored grid on an equal-or-finer lattice (e.g. WORLD) is sliced from it, in
+    which case the returned axes are that grid's.
+
+    With a ``budget`` everything is done in latitude bands and the grid is a
+    DiskGrid instead of a memmap.  With a ``checkpoint``, days being computed
+    are checkpointed chunk by chunk until they are in the store.
+
+    Returns (lon_vals, lat_vals, memmap, vis_file, grid_hash).
+    """
+    is_raw = (key.mode == "raw")
+    dtype = np.float32 if is_raw else np.uint8
+
+    def compute(start_date, days):
+        if budget is not None:
+            grid = compute_visibility_map_streaming(lon_vals, lat_vals, start_date, days, key.criterion,
+                                                    budget, mode=key.mode, max_workers=workers,
+                                                    checkpoint=checkpoint)
+            return grid, grid.path
+        return compute_visibility_map_parallel(lon_vals, lat_vals, start_date, days,
+                                               key.criterion, mode=key.mode, max_workers=workers,
+                                               checkpoint=checkpoint)
+
+    if store is None:
+        mm, vis_file = compute(new_moon_date, amount)
+        return lon_vals, lat_vals, mm, vis_file, None
+
+    source, window = key, (slice(None), slice(None))
+    missing = [d for d in range(amount) if d not in store.available_days(key, lon_vals, lat_vals)]
+    if missing:
+        covering = store.find_covering(key, bounds, lon_vals[1] - lon_vals[0], lat_vals[1] - lat_vals[0], amount)
+        if covering is not None:
+            source, lon_vals, lat_vals, window = covering
+            missing = []
+            print_ts(f"Grid store: slicing {key.region} from {source.region} at resolution {source.resolution}")
+
+    if missing:
+        # The kernel's day N depends on where its run starts, so it always starts
+        # at the conjunction; only the missing days of the result are stored.
+        last = max(missing)
+        print_ts(f"Grid store: computing day(s) {', '.join(str(d + 1) for d in missing)} of {amount}")
+        mm, tmp = compute(new_moon_date, last + 1)
+        for d in missing:
+            if budget is not None:
+                store.save_day(key, d, mm.day(d), lon_vals, lat_vals, band_rows=mm.band_rows)
+            else:
+                store.save_day(key, d, mm[:, :, d], lon_vals, lat_vals)
+        del mm
+        if checkpoint is not None:
+            checkpoint.drop_partial()
+        else:
+            remove_temp(tmp)
+    else:
+        print_ts(f"Conjunction Date: {new_moon_date.strftime('%Y-%m-%d %X')}")
+        print_ts("Grid store: all days cached")
+
+    vis_file = temp_grid_path()
+    shape = (len(lat_vals), len(lon_vals), amount)
+    if budget is not None:
+        grid = DiskGrid.create(vis_file, dtype, shape, budget.band_rows(len(lon_vals), amount))
+        row0, cols = window[0].start or 0, window[1]
+        for r0 in range(0, shape[0], grid.band_rows):
+            r1 = min(r0 + grid.band_rows, shape[0])
+            band = np.empty((r1 - r0, shape[1], amount), dtype=dtype)
+            for d in range(amount):
+                band[:, :, d] = store.read_rows(source, d, slice(row0 + r0, row0 + r1), cols)
+            grid.write_rows(r0, band)
+        return lon_vals, lat_vals, grid, vis_file, store.grid_hash(source, amount)
+
+    out = np.memmap(vis_file, dtype=dtype, mode="w+", shape=shape)
+    for d in range(amount):
+        out[:, :, d] = store.load_day(source, d)[window]
+    out.flush()
+    del out
+    mm = np.memmap(vis_file, dtype=dtype, mode="r", shape=shape)
+    return lon_vals, lat_vals, mm, vis_file, store.grid_hash(source, amount)
+
+class MemoryBudget:
+    """
+    Peak-memory budget for streaming mode.  Band sizes are derived from it, and
+    a watchdog thread aborts the run (exit status MEMORY_EXIT_CODE) if this
+    process's RSS plus its children's unique memory goes over it anyway.
+    """
+    WORKER_OVERHEAD = 48 * MB       # private pages a forked worker dirties on its own
+    SAFETY = 2                      # headroom on the per-row estimate
+    POLL = 0.2
+
+    def __init__(self, limit_mb: int):
+        self.limit = limit_mb * MB
+        self.baseline = psutil.Process(os.getpid()).memory_info().rss
+        self.peak = self.baseline
+        self._stop = threading.Event()
+
+    def band_rows(self, nx: int, days: int, workers: int = 1) -> int:
+        # float64 lat/lon inputs, float64/uint8 kernel output and our converted copy, per row
+        per_row = nx * (16 + days * 16) * self.SAFETY
+        free = self.limit - self.baseline - workers * self.WORKER_OVERHEAD
+        if free < workers * per_row:
+            raise MemoryError(f"--memory_budget {self.limit // MB} MB is too small: the mapper itself uses "
+                              f"{self.baseline // MB} MB and one row of {nx} points needs {per_row // 1024} KB "
+                              f"per worker ({workers} workers)")
+        return max(1, int(free // (workers * per_row)))
+
+    def usage(self) -> int:
+        me = psutil.Process(os.getpid())
+        total = me.memory_info().rss
+        for child in me.children(recursive=True):
+            try:
+                total += child.memory_full_info().uss
+            except psutil.Error:
+                pass
+        return total
+
+    def _watch(self):
+        while not self._stop.wait(self.POLL):
+            used = self.usage()
+            self.peak = max(self.peak, used)
+            if used > self.limit:
+                print_ts(f"Memory budget exceeded: {used // MB} MB > {self.limit // MB} MB, aborting.")
+                for child in psutil.Process(os.getpid()).children(recursive=True):
+                    child.kill()
+                sys.stdout.flush()
+                _cleanup_temp_files()
+                os._exit(MEMORY_EXIT_CODE)
+
+    def start(self):
+        threading.Thread(target=self._watch, name="memory-budget", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+class DiskGrid:
+    """
+    (ny, nx, days) grid in a raw C-order file that is read and written in row
+    bands with plain file I/O, so pages never stay mapped (or counted) in RSS.
+    """
+    def __init__(self, path, dtype, shape, band_rows):
+        self.path, self.dtype, self.shape, self.band_rows = path, np.dtype(dtype), tuple(shape), band_rows
+        self.row_items = shape[1] * shape[2]
+
+    @classmethod
+    def create(cls, path, dtype, shape, band_rows):
+        with open(path, "wb") as f:
+            f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        return cls(path, dtype, shape, band_rows)
+
+    def rows(self, r0: int, r1: int) -> np.ndarray:
+        return np.fromfile(self.path, dtype=self.dtype, count=(r1 - r0) * self.row_items,
+                           offset=r0 * self.row_items * self.dtype.itemsize
+                           ).reshape(r1 - r0, self.shape[1], self.shape[2])
+
+    def write_rows(self, r0: int, band: np.ndarray):
+        with open(self.path, "r+b") as f:
+            f.seek(r0 * self.row_items * self.dtype.itemsize)
+            f.write(np.ascontiguousarray(band, dtype=self.dtype).data)
+
+    def day(self, d: int):
+        """Row-sliceable (ny, nx) view of one day, for GridStore.save_day."""
+        grid = self
+        class _Day:
+            shape, dtype = grid.shape[:2], grid.dtype
+            def __getitem__(self, rows: slice):
+                r0, r1, _ = rows.indices(grid.shape[0])
+                return grid.rows(r0, r1)[:, :, d]
+        return _Day()
+
+    def bands(self):
+        for r0 in range(0, self.shape[0], self.band_rows):
+            r1 = min(r0 + self.band_rows, self.shape[0])
+            yield r0, self.rows(r0, r1)
+
+def _write_band(args):
+    (r0, lat_band, lon_vals, new_moon_date, days, criterion, is_raw, cat_to_idx, grid) = args
+    band = _compute_band(lat_band, lon_vals, new_moon_date, days, criterion,
+                         0.0, 0.0, 20.0, 101.325, is_raw, cat_to_idx, _category_lut(criterion))
+    grid.write_rows(r0, band)
+    return r0, r0 + len(lat_band)
+
+def compute_visibility_map_streaming(lon_vals, lat_vals, new_moon_date, days, criterion, budget,
+                                     mode="category", max_workers=None, checkpoint=None):
+    """Like compute_visibility_map_parallel, but in latitude bands sized from ``budget``
+    so peak memory doesn't grow with the grid.  Returns a DiskGrid."""
+    is_raw = (mode == "raw")
+    dtype = np.float32 if is_raw else np.uint8
+    num_workers = min(cpu_count() if max_workers is None else max_workers, len(lat_vals))
+    rows = min(budget.band_rows(len(lon_vals), days, num_workers), len(lat_vals))
+    shape = (len(lat_vals), len(lon_vals), days)
+
+    done = np.zeros(len(lat_vals), dtype=bool)
+    if checkpoint is not None:
+        vis_file, done = checkpoint.partial(
+            _grid_tag(lon_vals, lat_vals, new_moon_date, days, criterion, mode), shape, dtype)
+        grid = DiskGrid(vis_file, dtype, shape, budget.band_rows(len(lon_vals), days))
+    else:
+        grid = DiskGrid.create(temp_grid_path(), dtype, shape, budget.band_rows(len(lon_vals), days))
+
+    print_ts(f"Conjunction Date: {new_moon_date.strftime('%Y-%m-%d %X')}")
+    print_ts(f"Streaming: {math.ceil(len(lat_vals) / rows)} bands of {rows} rows on {num_workers} worker(s), "
+             f"budget {budget.limit // MB} MB")
+
+    cat_to_idx = {}
+    if not is_raw:
+        categories, _ = get_category_colors(criterion)
+        cat_to_idx = {cat: i for i, cat in enumerate(categories.keys())}
+
+    args_list = [(r0, lat_vals[r0:r1], lon_vals, new_moon_date, days, criterion, is_raw, cat_to_idx, grid)
+                 for r0, r1 in _pending_chunks(done, rows)]
+    if done.any():
+        print_ts(f"Checkpoint: {done.sum()} of {len(lat_vals)} rows already computed")
+
+    _run_chunks(_write_band, args_list, num_workers, checkpoint)
+    return grid
+
+class StreamingStats:
+    """
+    Single-pass statistics of raw q-values for the colour scale: exact min/max
+    and a log-binned histogram of |q| for percentiles (≈1% relative error).
+    """
+    BINS_PER_DECADE = 256
+    LOG_MIN, LOG_MAX = -6, 6
+
+    def __init__(self):
+        self.count = 0
+        self.vmin, self.vmax = np.inf, -np.inf
+        # bin 0: |q| < 1e-6, last bin: |q| ≥ 1e6
+        self.hist = np.zeros((self.LOG_MAX - self.LOG_MIN) * self.BINS_PER_DECADE + 2, dtype=np.int64)
+
+    def update(self, values: np.ndarray):
+        v = values[np.isfinite(values) & (values != -999) & (values != -998)]
+        if not v.size:
+            return
+        self.count += v.size
+        self.vmin = min(self.vmin, float(v.min()))
+        self.vmax = max(self.vmax, float(v.max()))
+        logs = np.log10(np.maximum(np.abs(v), 1e-300, dtype=np.float64))
+        idx = np.clip(np.floor((logs - self.LOG_MIN) * self.BINS_PER_DECADE) + 1, 0, len(self.hist) - 1)
+        self.hist += np.bincount(idx.astype(np.int64), minlength=len(self.hist))
+
+    def abs_percentile(self, p: float) -> float:
+        target = p / 100 * self.count
+        cum = np.cumsum(self.hist)
+        i = int(np.searchsorted(cum, target))
+        if i == 0:
+            return 0.0
+        if i >= len(self.hist) - 1:
+            return max(abs(self.vmin), abs(self.vmax))
+        frac = (target - cum[i - 1]) / self.hist[i]
+        return float(10 ** (self.LOG_MIN + (i - 1 + frac) / self.BINS_PER_DECADE))
+
+def grid_stats(grid) -> StreamingStats:
+    stats = StreamingStats()
+    for _, band in grid.bands():
+        stats.update(band)
+    return stats
+
+def display_day(grid, day, lon_vals, lat_vals, max_rows, max_cols):
+    """Strided copy (≤ max_rows × max_cols) of one day of a DiskGrid, read band by
+    band, with its axes -- all the figure can show anyway."""
+    ny, nx, _ = grid.shape
+    sr, sc = math.ceil(ny / max_rows), math.ceil(nx / max_cols)
+    out = np.empty((math.ceil(ny / sr), math.ceil(nx / sc)), dtype=grid.dtype)
+    step = max(sr, (grid.band_rows // sr) * sr)
+    for r0 in range(0, ny, step):
+        band = grid.rows(r0, min(r0 + step, ny))[::sr, ::sc, day]
+        out[r0 // sr:r0 // sr + band.shape[0]] = band
+    return lon_vals[::sc], lat_vals[::sr], out
+
+def _extent(lon_vals, lat_vals):
+    dx = (lon_vals[1] - lon_vals[0]) / 2 if len(lon_vals) > 1 else 0.5
+    dy = (lat_vals[1] - lat_vals[0]) / 2 if len(lat_vals) > 1 else 0.5
+    return (lon_vals[0] - dx, lon_vals[-1] + dx, lat_vals[0] - dy, lat_vals[-1] + dy)
+
 def load_shapefiles(states_path, places_path, cities):
     states_gdf = gpd.read_file(states_path)
     places_gdf = gpd.read_file(places_path)
@@ -364,8 +637,18 @@ def inverse_signed_log_transform(y, epsilon: float):
     """Reverse the signed_log_transform to recover original q_value from transformed."""
     return np.sign(y) * (np.expm1(np.abs(y)) * epsilon)
 
-def setup_color_mapping(mode, visibilities_mapped, unique_categories, category_colors_rgba):
-    if mode == "raw":
+def setup_color_mapping(mode, visibilities_mapped, unique_categories, category_colors_rgba, stats=None):
+    if mode == "raw" and stats is not None:
+        if stats.count == 0:
+            raise ValueError("No valid q_values to display in raw mode.")
+        # same scale as below, from the streaming pass: the transform is monotonic
+        epsilon = max(stats.abs_percentile(50), 0.1)
+        zmin_transformed = signed_log_transform(stats.vmin, epsilon=epsilon)
+        zmax_transformed = signed_log_transform(stats.vmax, epsilon=epsilon)
+        cmap = plt.get_cmap("viridis")
+        norm = mcolors.Normalize(vmin=zmin_transformed, vmax=zmax_transformed)
+        return cmap, norm, epsilon
+    elif mode == "raw":
         # Filter all valid values once across all days
         mask_valid = (~np.isin(visibilities_mapped, [-999, -998])) & (~np.isnan(visibilities_mapped))
         valid_data = visibilities_mapped[mask_valid]
@@ -422,6 +705,34 @@ def plot_raw_map(ax, lon_vals, lat_vals, z_data_raw, cmap, epsilon, norm):
 
     return mesh
 
+def plot_raw_image(ax, lon_vals, lat_vals, z_data_raw, cmap, epsilon, norm, contour_cols=1200):
+    """plot_raw_map for streaming mode: images instead of meshes, contours on a coarser grid."""
+    special = np.zeros(z_data_raw.shape, dtype=np.uint8)
+    special[z_data_raw == -999] = 1
+    special[z_data_raw == -998] = 2
+    z_data = np.where(special > 0, np.nan, z_data_raw)
+    z_data_transformed = signed_log_transform(z_data, epsilon=epsilon)
+    del z_data
+
+    extent = _extent(lon_vals, lat_vals)
+    mesh = ax.imshow(z_data_transformed, cmap=cmap, norm=norm, extent=extent, origin="lower",
+                     aspect="auto", interpolation="nearest")
+    if special.any():
+        ax.imshow(np.ma.masked_equal(special, 0), cmap=mcolors.ListedColormap(['#141414', '#393a3c']),
+                  norm=mcolors.BoundaryNorm([0.5, 1.5, 2.5], 2), extent=extent, origin="lower",
+                  aspect="auto", interpolation="nearest")
+
+    k = max(1, math.ceil(len(lon_vals) / contour_cols))
+    coarse = z_data_transformed[::k, ::k]
+    if np.isfinite(coarse).any():
+        contour_levels = np.linspace(norm.vmin, norm.vmax, 10)
+        cs = ax.contour(lon_vals[::k], lat_vals[::k], coarse, levels=contour_levels,
+                        colors='white', linewidths=1.2)
+        fmt = {lvl: f"{inverse_signed_log_transform(lvl, epsilon=epsilon):.1f}" for lvl in cs.levels}
+        ax.clabel(cs, cs.levels, fmt=fmt, inline=True, fontsize=10)
+
+    return mesh
+
 def plot_features(ax, states_clip, places_clip):
     states_clip.plot(ax=ax, facecolor="none", edgecolor="black", linewidth=0.65)
     places_clip.plot(ax=ax, color='violet', markersize=7)
@@ -498,56 +809,150 @@ def name_fig(start_date, islamic_month_name, islamic_year, criterion, mode):
 
 def plot_map(lon_vals, lat_vals, visibilities_mapped, states_clip, places_clip,
              unique_categories, category_colors_rgba, start_date, amount, out_dir, 
-             islamic_month_name, islamic_year, criterion, days_to_generate, mode="category"):
-    # Set up the color mapping and obtain epsilon if in raw mode.
-    print_ts("Plotting: Setting up colour map...")
-    cmap, norm, epsilon = setup_color_mapping(mode, visibilities_mapped, unique_categories, category_colors_rgba)
-
-    print_ts("Plotting: Adding subplots...")
-    width_x, width_y = 20, 15
-    dpi = 300
-    fig = plt.figure(figsize=(width_x, width_y), dpi=dpi, constrained_layout=False)
-    gs = gridspec.GridSpec(amount, 2, width_ratios=[50, 1], height_ratios=[2] * amount)
-    axes = [fig.add_subplot(gs[i, 0]) for i in range(amount)]
-    mesh = None
-
-    # Plot each day's visibility.
-    for i_day, ax in enumerate(axes):
-        print_ts(f"Plotting: Plotting Day {i_day + 1} ...")
-        if mode == "raw":
-            z_data_raw = visibilities_mapped[:, :, i_day]
-            print_ts(f"Plotting: Raw map plotting for Day {i_day + 1} ...")
-            mesh = plot_raw_map(ax, lon_vals, lat_vals, z_data_raw, cmap, epsilon, norm)
+             islamic_month_name, islamic_year, criterion, days_to_generate, mode="category", stats=None):
+    """With a DiskGrid as ``visibilities_mapped`` (streaming mode), each day is read
+    band by band into an image no larger than its axes' pixels."""
+    streaming = isinstance(visibilities_mapped, DiskGrid)
+    with mapper_phase("plot"), profile("mapper.plot"):
+        # Set up the color mapping and obtain epsilon if in raw mode.
+        print_ts("Plotting: Setting up colour map...")
+        cmap, norm, epsilon = setup_color_mapping(mode, visibilities_mapped, unique_categories, category_colors_rgba,
+                                                  stats=stats)
+
+        print_ts("Plotting: Adding subplots...")
+        width_x, width_y = 20, 15
+        dpi = 300
+        fig = plt.figure(figsize=(width_x, width_y), dpi=dpi, constrained_layout=False)
+        gs = gridspec.GridSpec(amount, 2, width_ratios=[50, 1], height_ratios=[2] * amount)
+        axes = [fig.add_subplot(gs[i, 0]) for i in range(amount)]
+        mesh = None
+
+        # Plot each day's visibility.
+        for i_day, ax in enumerate(axes):
+            print_ts(f"Plotting: Plotting Day {i_day + 1} ...")
+            if streaming:
+                lon_d, lat_d, data = display_day(visibilities_mapped, i_day, lon_vals, lat_vals,
+                                                 max_rows=width_y * dpi // amount, max_cols=width_x * dpi)
+                if mode == "raw":
+                    mesh = plot_raw_image(ax, lon_d, lat_d, data, cmap, epsilon, norm)
+                else:
+                    mesh = ax.imshow(data, cmap=cmap, norm=norm, extent=_extent(lon_d, lat_d), origin="lower",
+                                     aspect="auto", interpolation="nearest")
+                del data
+            elif mode == "raw":
+                z_data_raw = visibilities_mapped[:, :, i_day]
+                print_ts(f"Plotting: Raw map plotting for Day {i_day + 1} ...")
+                mesh = plot_raw_map(ax, lon_vals, lat_vals, z_data_raw, cmap, epsilon, norm)
+            else:
+                data = visibilities_mapped[:, :, i_day]
+                mesh = ax.pcolormesh(lon_vals, lat_vals, data, cmap=cmap, norm=norm, shading="auto")
+
+            print_ts(f"Plotting: Adding features for {i_day + 1} ...")
+            plot_features(ax, states_clip, places_clip)
+            ax.set_xlim(min(lon_vals), max(lon_vals))
+            ax.set_ylim(min(lat_vals), max(lat_vals))
+            ax.set_xlabel("Longitude")
+            ax.set_ylabel("Latitude")
+            ax.set_title(f"New Moon Visibility on {(start_date + timedelta(days=i_day)).strftime('%Y-%m-%d')} at Local Best Time")
+
+        if mode == "category":
+            print_ts("Plotting: Adding legend...")
+            create_legend(fig, gs, unique_categories, category_colors_rgba)
         else:
-            data = visibilities_mapped[:, :, i_day]
-            mesh = ax.pcolormesh(lon_vals, lat_vals, data, cmap=cmap, norm=norm, shading="auto")
+            print_ts("Plotting: Adding scale...")
+            create_scale(fig, mesh, norm)
 
-        print_ts(f"Plotting: Adding features for {i_day + 1} ...")
-        plot_features(ax, states_clip, places_clip)
-        ax.set_xlim(min(lon_vals), max(lon_vals))
-        ax.set_ylim(min(lat_vals), max(lat_vals))
-        ax.set_xlabel("Longitude")
-        ax.set_ylabel("Latitude")
-        ax.set_title(f"New Moon Visibility on {(start_date + timedelta(days=i_day)).strftime('%Y-%m-%d')} at Local Best Time")
+        print_ts("Plotting: Annotating plot...")
+        annotate_plot(fig, start_date, criterion, days_to_generate, islamic_month_name, islamic_year)
+        name, qual = name_fig(start_date, islamic_month_name, islamic_year, criterion, mode)
 
-    if mode == "category":
-        print_ts("Plotting: Adding legend...")
-        create_legend(fig, gs, unique_categories, category_colors_rgba)
-    else:
-        print_ts("Plotting: Adding scale...")
-        create_scale(fig, mesh, norm)
+    print_ts("Plotting: Saving...")
+    with mapper_phase("save"), profile("mapper.save"):
+        plt.savefig(os.path.join(out_dir, name), format='jpg',
+                    pil_kwargs={'optimize': True, 'progressive': True, 'quality': qual})
+        plt.close('all')
 
-    print_ts("Plotting: Annotating plot...")
-    annotate_plot(fig, start_date, criterion, days_to_generate, islamic_month_name, islamic_year)
-    name, qual = name_fig(start_date, islamic_month_name, islamic_year, criterion, mode)
+        print_ts("Plotting: Writing WebP/AVIF variants...")
+        save_image_variants(os.path.join(out_dir, name), qual)
 
-    print_ts("Plotting: Saving...")
-    plt.savefig(os.path.join(out_dir, name), format='jpg',
-                pil_kwargs={'optimize': True, 'progressive': True, 'quality': qual})
-    plt.close('all')
+def category_geojson(day_codes, lon_vals, lat_vals, criterion, tolerance=0.5, precision=1e-3):
+    """
+    One day's category grid as a GeoJSON FeatureCollection, one (multi)polygon per category.
+
+    Boundaries come from marching squares (contourpy) on the index grid.  The
+    nested "this category or better" regions are simplified with
+    ``preserve_topology=True`` and each category is taken as the difference of
+    two consecutive ones, so neighbouring categories share their edges exactly:
+    no gaps or overlaps.  ``tolerance`` is in grid cells, ``precision`` in degrees.
+    """
+    import contourpy, shapely
+    from shapely.geometry import Polygon, mapping
+
+    categories, colors = get_category_colors(criterion)
+    labels = list(categories)
+    codes = np.asarray(day_codes, dtype=np.float32)
+    step = min(abs(lon_vals[1] - lon_vals[0]), abs(lat_vals[1] - lat_vals[0]))
+    gen = contourpy.contour_generator(lon_vals, lat_vals, codes, fill_type=contourpy.FillType.OuterOffset)
+
+    def at_least(c):
+        points, offsets = gen.filled(c - 0.5, len(labels))
+        polys = [Polygon(pts[offs[0]:offs[1]], [pts[a:b] for a, b in zip(offs[1:-1], offs[2:])])
+                 for pts, offs in zip(points, offsets)]
+        geom = shapely.union_all(polys) if polys else Polygon()
+        return shapely.simplify(geom, tolerance * step, preserve_topology=True)
+
+    # simplifying each region separately can break their nesting; restore it from the top down
+    nested = [Polygon()]
+    for c in range(int(codes.max(initial=0)), 0, -1):
+        nested.insert(0, shapely.union(at_least(c), nested[0]))
+    features = []
+    for c, (outer, inner) in enumerate(zip(nested, nested[1:]), start=1):
+        band = shapely.set_precision(shapely.difference(outer, inner), precision)
+        if band.is_empty:
+            continue
+        features.append({
+            "type": "Feature",
+            "properties": {"category": labels[c].split(":")[0] if ":" in labels[c] else labels[c],
+                           "label": labels[c], "index": c,
+                           "fill": categories[labels[c]], "opacity": round(colors[labels[c]][3], 2)},
+            "geometry": mapping(band),
+        })
+    # what is left (index 0, moonset before the new moon) is the uncovered background
+    return {"type": "FeatureCollection", "features": features,
+            "bbox": [float(lon_vals[0]), float(lat_vals[0]), float(lon_vals[-1]), float(lat_vals[-1])]}
+
+def write_vector_maps(grid, lon_vals, lat_vals, amount, criterion, out_dir, name, tolerance=0.5):
+    """``<name> Day N.geojson`` per day next to where the JPEG would go; returns the file names."""
+    import json
+    stem = name.rsplit(".", 1)[0]
+    written = []
+    for d in range(amount):
+        day_codes = np.asarray(grid.day(d)[:]) if isinstance(grid, DiskGrid) else np.asarray(grid[:, :, d])
+        fc = category_geojson(day_codes, lon_vals, lat_vals, criterion, tolerance)
+        fc["day"] = d + 1
+        out_name = f"{stem} Day {d + 1}.geojson"
+        tmp = os.path.join(out_dir, f".{out_name}.{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(fc, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, os.path.join(out_dir, out_name))
+        written.append(out_name)
+    return written
+
+def save_image_variants(jpg_path: str, quality: int = 90):
+    """Write .webp (and .avif where Pillow supports it) next to a saved JPEG."""
+    from PIL import Image, features
+
+    base = os.path.splitext(jpg_path)[0]
+    with Image.open(jpg_path) as img:
+        img.save(f"{base}.webp", format="WEBP", quality=quality, method=6)
+        if features.check("avif"):
+            img.save(f"{base}.avif", format="AVIF", quality=quality - 20)
 
 def plotting_loop(new_moon_date: datetime, map_params: Tuple, master_path: str = "maps/", mode: str = "category", region: str = 'WORLD', 
-                  amount: int = 1, visibility_criterion: int = 0, workers: int = None):
+                  amount: int = 1, visibility_criterion: int = 0, workers: int = None, store: GridStore = None,
+                  budget: MemoryBudget = None, vector: bool = False, vector_tolerance: float = 0.5,
+                  checkpoint: RunCheckpoint = None) -> bool:
+    """Compute (or load) one month's grid and render it.  Returns whether its outputs are all written."""
     # Start timing for the month
     month_start_time: float = time()
     
@@ -565,7 +970,8 @@ def plotting_loop(new_moon_date: datetime, map_params: Tuple, master_path: str =
     states_path, places_path, lon_vals, lat_vals, nx, ny, cities = map_params
 
     # Create path
-    path = f"{master_path}{region.replace('_', ' ').title()}/{islamic_year}/"
+    rel_path = f"{region.replace('_', ' ').title()}/{islamic_year}/"
+    path = f"{master_path}{rel_path}"
     if not os.path.exists(path):
         print_ts(f"Creating {path}...")
         os.makedirs(path)
@@ -576,76 +982,125 @@ def plotting_loop(new_moon_date: datetime, map_params: Tuple, master_path: str =
     # Calculate
     print_ts(f"Calculating new moon crescent visibilities...")
     t1 = time()
-    visibilities_mm, vis_file = compute_visibility_map_parallel(
-        lon_vals, lat_vals, new_moon_date, amount,
-        visibility_criterion, mode=mode, max_workers=workers
-    )
+    key = GridKey(new_moon_date, region, nx, visibility_criterion, mode)
+    with mapper_phase("compute"), profile("mapper.compute"):
+        lon_vals, lat_vals, visibilities_mm, vis_file, grid_hash = build_grid(
+            store, key, REGION_COORDINATES[region], lon_vals, lat_vals,
+            new_moon_date, amount, workers, budget, checkpoint
+        )
     print_ts(f"Time taken: {(time() - t1):.2f}s")
 
-    # Categorization
-    print_ts(f"Getting colours for the categories...")
-    t1 = time()
-    categories, colors_rgba = get_category_colors(visibility_criterion)
-    print_ts(f"Time taken: {(time() - t1):.2f}s")
+    try:
+        # Streaming mode: raw-mode colour scale from one pass over the bands
+        stats = None
+        if budget is not None and mode == "raw":
+            print_ts("Streaming: computing q-value statistics...")
+            t1 = time()
+            stats = grid_stats(visibilities_mm)
+            print_ts(f"Time taken: {(time() - t1):.2f}s")
+
+        # Skip the render if this exact grid, overlay and style were already drawn
+        name, _ = name_fig(new_moon_date, islamic_month_name, islamic_year, visibility_criterion, mode)
+        # maps_index.json entry for the month, paths relative to master_path
+        entry = {"month": islamic_month_name, "year": islamic_year, "region": region,
+                 "criterion": visibility_criterion, "mode": mode}
+
+        if vector:
+            # GeoJSON per day instead of the JPEG: no shapefiles or figure involved
+            render = None
+            first = f"{name.rsplit('.', 1)[0]} Day 1.geojson"
+            if grid_hash is not None:
+                render = render_key(grid_hash, overlay_hash(REGION_COORDINATES[region], []),
+                                    f"v{STYLE_VERSION}:vector:{vector_tolerance}")
+            if render is not None and render_is_current(path, first, render):
+                print_ts(f"Render store: {first} is up to date, skipping")
+            else:
+                print_ts("Writing vector maps...")
+                t1 = time()
+                with mapper_phase("plot"):
+                    files = write_vector_maps(visibilities_mm, lon_vals, lat_vals, amount,
+                                              visibility_criterion, path, name, vector_tolerance)
+                if render is not None:
+                    record_render(path, first, render)
+                print_ts(f"Wrote {', '.join(files)}")
+                print_ts(f"Time taken: {(time() - t1):.2f}s")
+            stem = name.rsplit(".", 1)[0]
+            record_index(master_path, {**entry, "vector": [f"{rel_path}{stem} Day {d + 1}.geojson"
+                                                           for d in range(amount)]})
+            print_ts(f"===Map for {islamic_month_name}, {islamic_year} Complete===")
+            return True
+
+        render = None
+        if grid_hash is not None:
+            # streaming renders downsampled imshow images, in-memory renders pcolormesh
+            plot_path = "streaming" if budget is not None else "memory"
+            render = render_key(grid_hash,
+                                overlay_hash(REGION_COORDINATES[region], cities, states_path, places_path),
+                                f"v{STYLE_VERSION}:{mode}:{plot_path}")
+            if render_is_current(path, name, render):
+                print_ts(f"Render store: {name} is up to date, skipping plot")
+                record_index(master_path, {**entry, "file": f"{rel_path}{name}"})
+                print_ts(f"===Map for {islamic_month_name}, {islamic_year} Complete===")
+                return True
+
+        # Categorization
+        print_ts(f"Getting colours for the categories...")
+        t1 = time()
+        categories, colors_rgba = get_category_colors(visibility_criterion)
+        print_ts(f"Time taken: {(time() - t1):.2f}s")
 
-    # Categorize
-    if mode == "category":
-        visibilities_mapped = visibilities_mm        # already uint8
-    else:
-        print_ts("Colour-mapping raw values ...")
+        # Plotting
+        print_ts(f"Plotting...")
         t1 = time()
-        categories, _ = get_category_colors(visibility_criterion)
-        cat2idx = {c: i for i, c in enumerate(categories.keys())}
-
-        # raw → new uint8 memmap on disk (still tiny vs float32)
-        tmp_path = os.path.join(tempfile.gettempdir(), f"cat_{os.getpid()}_{int(time())}.dat")
-        visibilities_mapped = np.memmap(tmp_path, dtype=np.uint8,
-                                        mode="w+", shape=visibilities_mm.shape)
-
-        ny, nx, days = visibilities_mm.shape
-        for d in range(days):
-            for c, idx in cat2idx.items():
-                mask = (visibilities_mm[:, :, d] == c)
-                visibilities_mapped[:, :, d][mask] = idx
-        visibilities_mapped.flush()
-        print_ts(f"Time taken: {(time()-t1):.2f}s")
-
-    # Plotting
-    print_ts(f"Plotting...")
-    t1 = time()
-    p = Process(
-        target=_plot_worker,
-        args=(
-            lon_vals, lat_vals,
-            vis_file, visibilities_mm.shape, mode,
-            states_path, places_path, cities,
-            list(categories.keys()) if mode=="category" else [],
-            colors_rgba if mode=="category" else {},
-            new_moon_date, amount, path,
-            islamic_month_name, islamic_year, visibility_criterion, region
+        p = Process(
+            target=_plot_worker,
+            args=(
+                lon_vals, lat_vals,
+                vis_file, visibilities_mm.shape, mode,
+                states_path, places_path, cities,
+                list(categories.keys()) if mode=="category" else [],
+                colors_rgba if mode=="category" else {},
+                new_moon_date, amount, path,
+                islamic_month_name, islamic_year, visibility_criterion, region,
+                visibilities_mm.band_rows if budget is not None else None, stats
+            )
         )
-    )
-    p.start()
-    p.join()
-    print_ts(f"Time taken: {(time() - t1):.2f}s")
-
-    # ===== CLEAN-UP =====
-    del visibilities_mm
-    gc.collect()
-    print_ts(f"RSS after clean-up: {psutil.Process(os.getpid()).memory_info().rss // (1024*1024)} MB")
-
-    # Finished
-    print_ts(f"===Map for {islamic_month_name}, {islamic_year} Complete===")
-    print_ts(f"Time to generate map for {islamic_month_name}, {islamic_year}: {(time() - month_start_time):.2f}s")
+        p.start()
+        p.join()
+        print_ts(f"Time taken: {(time() - t1):.2f}s")
+        if render is not None and p.exitcode == 0:
+            record_render(path, name, render)
+        if p.exitcode == 0:
+            record_index(master_path, {**entry, "file": f"{rel_path}{name}"})
+
+        # ===== CLEAN-UP =====
+        del visibilities_mm
+        gc.collect()
+        print_ts(f"RSS after clean-up: {psutil.Process(os.getpid()).memory_info().rss // (1024*1024)} MB")
+        if budget is not None:
+            print_ts(f"Peak memory so far: {budget.peak // MB} MB of {budget.limit // MB} MB budget")
+
+        # Finished
+        print_ts(f"===Map for {islamic_month_name}, {islamic_year} Complete===")
+        print_ts(f"Time to generate map for {islamic_month_name}, {islamic_year}: {(time() - month_start_time):.2f}s")
+        return p.exitcode == 0
+    finally:
+        remove_temp(vis_file)
 
 def main(today: datetime = datetime.now(), master_path: str = "maps/", total_months: int = 1, map_region: str = "WORLD", 
          map_mode: str = "category", resolution: int = 300, days_to_generate: int = 3, criterion: int = 1, save_logs: bool = False,
-         max_workers: int = None):
+         max_workers: int = None, grid_store: str = None, use_store: bool = True, memory_budget: int = None,
+         vector: bool = False, vector_tolerance: float = 0.5, restart: bool = False):
     
     map_region = map_region.upper()
     if save_logs:
         sys.stdout = Tee(f"mapper_{datetime.fromtimestamp(time()).strftime('%Y-%m-%d_%H%M%S')}.log")
     start_time: float = time()
+    # SIGTERM unwinds normally, so temp grids are removed and the checkpoint is released
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    freed = sweep_stale_temp_files()
+    if freed:
+        print_ts(f"Removed {freed // MB} MB of temp grids left by killed runs")
 
     # Select region 
     cities: List[str] = REGION_CITIES[map_region]
@@ -653,17 +1108,52 @@ def main(today: datetime = datetime.now(), master_path: str = "maps/", total_mon
 
     states_path, places_path = "scripts/map_shp_files/combined_polygons.shp", "scripts/map_shp_files/combined_points.shp"
 
+    store = (GridStore(grid_store) if grid_store else GridStore()) if use_store else None
+    budget = None
+    if memory_budget:
+        budget = MemoryBudget(memory_budget)
+        budget.start()
+
     print_ts(f"Creating map grid...")
     t1 = time()
     lon_vals, lat_vals, nx, ny = create_grid(resolution, minx=coords[0], maxx=coords[1], miny=coords[2], maxy=coords[3])
     print_ts(f"Time taken: {(time() - t1):.2f}s")
 
+    # Checkpoints live in the grid store: a re-run of the same command resumes
+    checkpoint = None
+    if store is not None:
+        checkpoint = RunCheckpoint({
+            "first_conjunction": fast_astro.next_phases_of_moon_utc(today)[0].isoformat(),
+            "total_months": total_months, "region": map_region, "mode": map_mode, "resolution": resolution,
+            "days": days_to_generate, "criterion": criterion, "vector": vector,
+            "vector_tolerance": vector_tolerance, "master_path": os.path.abspath(master_path),
+        }, store.root, restart)
+        if checkpoint.resumed:
+            print_ts(f"Checkpoint: resuming run {checkpoint.id} "
+                     f"({len(checkpoint.manifest['months'])} of {total_months} month(s) done)")
+
+    complete = True
     for month in range(total_months):
         new_moon_date: datetime = fast_astro.next_phases_of_moon_utc(today + timedelta(days=month * AVERAGE_LUNAR_MONTH_DAYS))[0]
-
-        plotting_loop(new_moon_date, map_params=(states_path, places_path, lon_vals, lat_vals, nx, ny, cities), master_path=master_path, region=map_region, amount=days_to_generate, 
-                      visibility_criterion=criterion, mode=map_mode, workers=max_workers)
-
+        if checkpoint is not None and checkpoint.month_done(new_moon_date):
+            print_ts(f"Checkpoint: month of {new_moon_date.strftime('%Y-%m-%d')} already done, skipping")
+            continue
+
+        done = plotting_loop(new_moon_date, map_params=(states_path, places_path, lon_vals, lat_vals, nx, ny, cities), master_path=master_path, region=map_region, amount=days_to_generate, 
+                             visibility_criterion=criterion, mode=map_mode, workers=max_workers, store=store, budget=budget,
+                             vector=vector, vector_tolerance=vector_tolerance, checkpoint=checkpoint)
+        if checkpoint is not None and done:
+            checkpoint.finish_month(new_moon_date)
+        complete &= done
+
+    if checkpoint is not None:
+        checkpoint.close(remove=complete)
+        if not complete:
+            print_ts(f"Some maps failed; run the same command again to redo only those (checkpoint {checkpoint.id})")
+
+    if budget is not None:
+        budget.stop()
+        print_ts(f"Peak memory: {budget.peak // MB} MB of {budget.limit // MB} MB budget")
     print_ts(f"~~~ --- === Total time taken: {(time() - start_time):.2f}s === --- ~~~")
 
 if __name__ == "__main__":
@@ -678,8 +1168,20 @@ if __name__ == "__main__":
     parser.add_argument("--criterion",       type=int,   default=1, choices=(0,1))
     parser.add_argument("--save_logs",       action="store_true")
     parser.add_argument("--max_workers",     type=int,   default=None, help="Max parallel processes (default = cpu_count())")
+    parser.add_argument("--grid_store",      type=str,   default=None, help="Grid store directory (default = $GRID_STORE or grids/)")
+    parser.add_argument("--no_grid_store",   action="store_true", help="Recompute everything; don't read or write the grid store")
+    parser.add_argument("--restart",         action="store_true",
+                        help="Discard the checkpoint of an interrupted run with the same arguments instead of resuming it")
+    parser.add_argument("--memory_budget",   type=int,   default=None,
+                        help="Streaming mode: compute, store and render in latitude bands within this many MB (enforced)")
+
+    parser.add_argument("--vector",          action="store_true",
+                        help="Write simplified GeoJSON category polygons per day instead of the JPEG (category mode)")
+    parser.add_argument("--vector_tolerance",type=float, default=0.5, help="Simplification tolerance in grid cells")
 
     args = parser.parse_args()
+    if args.vector and args.map_mode != "category":
+        parser.error("--vector needs --map_mode category")
 
     # parse the "today" flag
     if args.today:
@@ -697,5 +1199,11 @@ if __name__ == "__main__":
         days_to_generate    = args.days_to_generate,
         criterion           = args.criterion,
         save_logs           = args.save_logs,
-        max_workers         = args.max_workers
+        max_workers         = args.max_workers,
+        grid_store          = args.grid_store,
+        use_store           = not args.no_grid_store,
+        memory_budget       = args.memory_budget,
+        vector              = args.vector,
+        vector_tolerance    = args.vector_tolerance,
+        restart             = args.restart
     )
\ No newline at end of file
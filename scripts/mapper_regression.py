@@ -0,0 +1,311 @@
+"""
+Golden-grid regression checks for mapper.py's grid computation.
+
+``compute_visibility_map_parallel`` is run at small resolutions for fixed
+conjunctions, criteria and modes, on each worker count, and every result is
+compared with the golden grid stored in ``scripts/golden_grids/``:
+
+* category grids (uint8) must match cell for cell (``--category_tol`` allows a
+  fraction of differing cells, e.g. across islamic_times releases);
+* raw grids (float32) must agree within ``--atol`` on finite q-values and
+  exactly on NaN/inf and the -999/-998 markers.
+
+Category cases are also run once through the label-mapping path (the one used
+when the C core can't return category codes), so both mappings stay in step.
+Every case is also built through the grid store as an incremental build: a
+1-day grid extended to DAYS. It is also built with the remaining days computed
+as tile_broker.py tiles. Both check that stored days match a fresh run.
+
+Wall time (median of ``--repeat`` runs) and peak RSS -- of the mapper process
+and of its largest worker -- are recorded per case and worker count, and the
+report is written to ``benchmarks/`` in benchmark.py's format:
+
+    python scripts/mapper_regression.py                     # check against the goldens
+    python scripts/mapper_regression.py --quick             # one run each, 1-2 workers
+    python scripts/mapper_regression.py --compare benchmarks/mapper_<previous>.json
+    python scripts/mapper_regression.py --record            # rewrite the goldens (intended change)
+
+Exits non-zero on any mismatch, or on a slowdown past ``--threshold`` with ``--compare``.
+"""
+import os, sys, json, hashlib, argparse, pathlib, tempfile, statistics, threading
+
+from time import perf_counter
+from datetime import datetime
+
+import numpy as np
+import psutil
+
+from benchmark import ROOT, FIXED_CONJUNCTION, print_ts, environment, compare
+
+GOLDEN_DIR = ROOT / "scripts" / "golden_grids"
+DAYS = 3
+MB = 1024 * 1024
+
+# (conjunction, resolution, criterion, mode): a late-winter month and one near
+# the June solstice, where the polar categories reach furthest south
+CASES: list[tuple[datetime, int, int, str]] = [
+    (conj, res, criterion, mode)
+    for conj in (FIXED_CONJUNCTION, datetime(2025, 6, 25, 10, 31, 0))
+    for criterion in (0, 1)
+    for res, mode in ((40, "category"), (80, "category"), (40, "raw"))
+]
+
+# How a grid is produced: the Pool computation (on every worker count), then
+# once each the label-mapping fallback (category only), the grid store's
+# build_grid extending a stored 1-day grid to DAYS (in memory and streaming),
+# and tile_broker.py filling in the missing days of such a grid from tiles
+PATHS = ("parallel", "labels", "incremental", "streaming", "tiles")
+TILE_ROWS = 16
+
+# ---------------------------------------------------------------------------#
+# Helpers                                                                    #
+# ---------------------------------------------------------------------------#
+
+def case_name(conj: datetime, res: int, criterion: int, mode: str) -> str:
+    return f"{conj.strftime('%Y%m%dT%H%M%S')}_{res}_c{criterion}_{mode}"
+
+
+def _child_peak(child: psutil.Process) -> int:
+    """Peak RSS of a child over its life so far (VmHWM on Linux, else its current RSS),
+    so a worker is measured right even if it is only sampled once before it exits."""
+    try:
+        with open(f"/proc/{child.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return child.memory_info().rss
+
+
+class PeakRSS:
+    """Peak RSS of this process and of its largest child (0 if it started none),
+    sampled on a thread while the block runs."""
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = self.peak_worker = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        me = psutil.Process(os.getpid())
+        own = me.memory_info().rss
+        kids = []
+        for child in me.children(recursive=True):
+            try:
+                kids.append(_child_peak(child))
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, own)
+        self.peak_worker = max(self.peak_worker, max(kids, default=0))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def compute(conj: datetime, res: int, criterion: int, mode: str, workers: int, path: str = "parallel") -> np.ndarray:
+    """In-memory copy of the (ny, nx, DAYS) grid, produced along one of PATHS."""
+    import mapper
+
+    lon_vals, lat_vals, _, _ = mapper.create_grid(res, *mapper.REGION_COORDINATES["WORLD"])
+    if path in ("incremental", "streaming"):
+        return _compute_incremental(mapper, conj, res, criterion, mode, workers, lon_vals, lat_vals,
+                                    streaming=(path == "streaming"))
+    if path == "tiles":
+        return _compute_tiles(mapper, conj, res, criterion, mode, workers, lon_vals, lat_vals)
+    lut = mapper._category_lut
+    if path == "labels":
+        mapper._category_lut = lambda criterion: None      # workers are forked, so they see it too
+    try:
+        mm, vis_file = mapper.compute_visibility_map_parallel(lon_vals, lat_vals, conj, DAYS, criterion,
+                                                              mode=mode, max_workers=workers)
+    finally:
+        mapper._category_lut = lut
+    grid = np.array(mm)
+    del mm
+    mapper.remove_temp(vis_file)
+    return grid
+
+
+def _compute_incremental(mapper, conj, res, criterion, mode, workers, lon_vals, lat_vals, streaming):
+    """build_grid on a fresh store: a 1-day build, then extended to DAYS from the stored day."""
+    from grid_store import GridStore, GridKey
+
+    key = GridKey(conj, "WORLD", res, criterion, mode)
+    budget = mapper.MemoryBudget(psutil.Process().memory_info().rss // MB + 256) if streaming else None
+    with tempfile.TemporaryDirectory() as root:
+        store = GridStore(root)
+        for days in (1, DAYS):
+            _, _, grid, vis_file, _ = mapper.build_grid(store, key, mapper.REGION_COORDINATES["WORLD"],
+                                                        lon_vals, lat_vals, conj, days, workers, budget)
+            out = grid.rows(0, grid.shape[0]) if streaming else np.array(grid)
+            del grid
+            mapper.remove_temp(vis_file)
+    return out
+
+
+def _compute_tiles(mapper, conj, res, criterion, mode, workers, lon_vals, lat_vals):
+    """A stored 1-day grid whose other days come from tile_broker.py: broker and one
+    worker in this process, talking over HTTP on localhost."""
+    import tile_broker
+    from grid_store import GridStore, GridKey
+
+    key = GridKey(conj, "WORLD", res, criterion, mode)
+    with tempfile.TemporaryDirectory() as root:
+        store = GridStore(root)
+        _, _, grid, vis_file, _ = mapper.build_grid(store, key, mapper.REGION_COORDINATES["WORLD"],
+                                                    lon_vals, lat_vals, conj, 1, workers)
+        del grid
+        mapper.remove_temp(vis_file)
+
+        tiles = tile_broker.plan_tiles(store, [conj], ["WORLD"], res, DAYS, criterion, mode, TILE_ROWS)
+        broker = tile_broker.Broker(store, tiles)
+        server = tile_broker.serve(broker, "127.0.0.1", 0)
+        try:
+            tile_broker.work(f"http://127.0.0.1:{server.server_address[1]}", "regression", idle_sleep=0.05)
+        finally:
+            server.shutdown()
+            server.server_close()
+        if broker.failed or not broker.done.is_set():
+            raise RuntimeError(f"tile broker did not finish: {broker.status()}")
+        return np.stack([np.array(store.load_day(key, d)) for d in range(DAYS)], axis=-1)
+
+
+def compare_grid(golden: np.ndarray, grid: np.ndarray, mode: str, atol: float, category_tol: float) -> dict:
+    if golden.shape != grid.shape or golden.dtype != grid.dtype:
+        return {"ok": False, "error": f"expected {golden.dtype}{golden.shape}, got {grid.dtype}{grid.shape}"}
+    if mode == "category":
+        differing = int(np.count_nonzero(golden != grid))
+        return {"ok": differing <= category_tol * golden.size, "cells_differing": differing}
+    finite_g, finite_c = np.isfinite(golden), np.isfinite(grid)
+    both = finite_g & finite_c
+    err = float(np.max(np.abs(golden[both] - grid[both]), initial=0.0))
+    special = int(np.count_nonzero(finite_g != finite_c))
+    special += int(np.count_nonzero(~(finite_g | finite_c) & ~((golden == grid) | (np.isnan(golden) & np.isnan(grid)))))
+    return {"ok": special == 0 and err <= atol, "max_abs_err": err, "special_mismatch": special}
+
+# ---------------------------------------------------------------------------#
+# Goldens                                                                    #
+# ---------------------------------------------------------------------------#
+
+def record() -> int:
+    """Compute every case on one worker and store it as the new golden."""
+    GOLDEN_DIR.mkdir(parents=True, exist_ok=True)
+    manifest = {"environment": environment(), "days": DAYS, "cases": {}}
+    for case in CASES:
+        name = case_name(*case)
+        grid = compute(*case, workers=1)
+        np.savez_compressed(GOLDEN_DIR / f"{name}.npz", grid=grid)
+        manifest["cases"][name] = {"shape": list(grid.shape), "dtype": str(grid.dtype),
+                                   "sha1": hashlib.sha1(grid.tobytes()).hexdigest()}
+        print_ts(f"Recorded {name} {grid.dtype}{grid.shape}")
+    (GOLDEN_DIR / "manifest.json").write_text(json.dumps(manifest, indent=2, default=str))
+    return 0
+
+
+def load_golden(name: str) -> np.ndarray:
+    with np.load(GOLDEN_DIR / f"{name}.npz") as f:
+        return f["grid"]
+
+# ---------------------------------------------------------------------------#
+# Checks                                                                     #
+# ---------------------------------------------------------------------------#
+
+def check_case(conj, res, criterion, mode, workers, repeat, atol, category_tol, path="parallel") -> dict:
+    name = case_name(conj, res, criterion, mode)
+    golden = load_golden(name)
+    samples, peak, peak_worker, verdict = [], 0, 0, None
+    for _ in range(repeat):
+        with PeakRSS() as rss:
+            t0 = perf_counter()
+            grid = compute(conj, res, criterion, mode, workers, path)
+            samples.append(perf_counter() - t0)
+        peak, peak_worker = max(peak, rss.peak), max(peak_worker, rss.peak_worker)
+        # every run is checked: a nondeterministic chunking bug need not show up the first time
+        result = compare_grid(golden, grid, mode, atol, category_tol)
+        if verdict is None or not result["ok"]:
+            verdict = result
+
+    params = {"case": name, "workers": workers, "path": path}
+    row = {"name": "mapper.golden", "params": params, "n": repeat,
+           "median_s": statistics.median(samples), "min_s": min(samples),
+           "points_per_s": golden.size / statistics.median(samples),
+           "peak_rss_mb": round(peak / MB, 1), "peak_worker_rss_mb": round(peak_worker / MB, 1), **verdict}
+    print_ts(f"{name} workers={workers}{'' if path == 'parallel' else f' ({path})'}: "
+             f"median {row['median_s'] * 1000:.1f} ms, peak RSS {row['peak_rss_mb']} MB "
+             f"(worker {row['peak_worker_rss_mb']} MB) -- {'ok' if verdict['ok'] else 'MISMATCH ' + json.dumps(verdict)}")
+    return row
+
+
+def main(quick: bool, repeat: int, atol: float, category_tol: float, out_dir: str,
+         compare_to: str | None, threshold: float) -> int:
+    missing = [case_name(*c) for c in CASES if not (GOLDEN_DIR / f"{case_name(*c)}.npz").exists()]
+    if missing:
+        print_ts(f"No golden grid for {', '.join(missing)}; run with --record first")
+        return 2
+    manifest = json.loads((GOLDEN_DIR / "manifest.json").read_text())
+    recorded_with = manifest["environment"].get("islamic_times")
+    report = {"environment": environment(), "quick": quick, "golden_islamic_times": recorded_with, "results": []}
+    if recorded_with != report["environment"]["islamic_times"]:
+        print_ts(f"Note: goldens were recorded with islamic_times {recorded_with}, "
+                 f"running {report['environment']['islamic_times']}")
+
+    cpus = os.cpu_count() or 1
+    workers = (1, 2) if quick else sorted({1, 2, min(4, cpus), cpus})
+    repeat = 1 if quick else repeat
+    for case in CASES:
+        for w in workers:
+            report["results"].append(check_case(*case, w, repeat, atol, category_tol))
+        for path in PATHS[1:]:
+            if path != "labels" or case[3] == "category":
+                report["results"].append(check_case(*case, 1, 1, atol, category_tol, path))
+
+    out = pathlib.Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    report_path = out / f"mapper_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.json"
+    report_path.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    print_ts(f"Results written to {report_path}")
+
+    failed = [r for r in report["results"] if not r["ok"]]
+    for r in failed:
+        print_ts(f"MISMATCH {r['params']}")
+    status = 1 if failed else 0
+    if compare_to:
+        regressions = compare(json.loads(pathlib.Path(compare_to).read_text()), report, threshold)
+        for line in regressions:
+            print_ts(f"REGRESSION {line}")
+        if regressions:
+            status = 1
+        else:
+            print_ts(f"No slowdowns over x{threshold} against {compare_to}")
+    if not failed:
+        print_ts(f"All {len(report['results'])} runs match the goldens")
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check mapper grids against stored goldens and record their cost")
+    parser.add_argument("--record",       action="store_true", help="Rewrite the golden grids from the current code")
+    parser.add_argument("--quick",        action="store_true", help="One run per case on 1 and 2 workers")
+    parser.add_argument("--repeat",       type=int,   default=3, help="Timed runs per case and worker count")
+    parser.add_argument("--atol",         type=float, default=1e-5, help="Raw mode: allowed |q - golden q|")
+    parser.add_argument("--category_tol", type=float, default=0.0, help="Category mode: allowed fraction of differing cells")
+    parser.add_argument("--out_dir",      type=str,   default="benchmarks", help="Where the JSON report goes")
+    parser.add_argument("--compare",      type=str,   default=None, help="Previous report to diff timings against")
+    parser.add_argument("--threshold",    type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)      # mapper.py resolves its shapefiles relative to the root
+    sys.exit(record() if args.record else
+             main(args.quick, args.repeat, args.atol, args.category_tol, args.out_dir, args.compare, args.threshold))
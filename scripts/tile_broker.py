@@ -0,0 +1,431 @@
+"""
+Distributed grid computation: a broker splits mapper grids into tiles and hands
+them to workers on other nodes over plain HTTP.
+
+    # on the node that owns the grid store
+    python scripts/tile_broker.py serve --today 2025-01-01 --total_months 12 \\
+        --regions WORLD NORTH_AMERICA EUROPE MIDDLE_EAST IRAN --resolution 500
+
+    # on every compute node (N = cores to use)
+    python scripts/tile_broker.py work --broker http://<broker-host>:8765 --processes N
+
+    # then render from the filled store as usual
+    python scripts/mapper.py --today 2025-01-01 --total_months 12 --resolution 500 ...
+
+A tile is a band of latitude rows of one grid, over every day that grid is
+missing, described entirely by JSON (conjunction, lattice bounds, row range,
+days, criterion, mode).  Workers compute it with mapper.py's own kernel wrapper
+(``_compute_band``, same category mapping) from the conjunction, exactly as a
+local run does, so a grid is the same whoever computed it.  Workers need a
+checkout of this repository.  Protocol:
+
+    GET  /lease?worker=<name>        200 tile JSON | 204 nothing free yet | 410 all done
+    POST /result/<tile>?lease=<id>   body = tile as .npy; duplicates are acknowledged and ignored
+    POST /fail/<tile>?lease=<id>     body = error text; tile is retried up to --max_attempts,
+                                     then it and the rest of its grid are given up on
+    GET  /status                     progress counters
+
+Leases that aren't answered within ``--lease_timeout`` seconds are handed out
+again, so a dead worker costs at most one timeout.  Results are deterministic,
+so whichever copy of a tile arrives first wins.  Once all its tiles are in, a
+grid's missing days are written to the grid store atomically
+(``GridStore.save_day``); only then do its tiles count as finished, and if the
+write fails they are handed out again.  Days already in the store are never
+planned again, which makes restarting the broker safe.
+"""
+import os, sys, io, json, uuid, socket, argparse, threading
+import urllib.request, urllib.error
+from time import time, sleep
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import Process, cpu_count
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import islamic_times.astro_core as fast_astro
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from grid_store import GridStore, GridKey
+
+DEFAULT_PORT = 8765
+
+# ---------------------------------------------------------------------------#
+# Tiles                                                                      #
+# ---------------------------------------------------------------------------#
+
+def compute_tile(tile: dict) -> np.ndarray:
+    """Compute one tile, (rows, nx, days) float32 (raw) or uint8 category indices."""
+    from mapper import _compute_band, _category_lut, get_category_colors
+
+    minx, maxx, nx = tile["lon"]
+    miny, maxy, ny = tile["lat"]
+    lon_vals = np.linspace(minx, maxx, nx)
+    lat_vals = np.linspace(miny, maxy, ny)[tile["row_start"]:tile["row_stop"]]
+    is_raw = tile["mode"] == "raw"
+    criterion = tile["criterion"]
+    cat_to_idx = {} if is_raw else {cat: i for i, cat in enumerate(get_category_colors(criterion)[0])}
+    # from the conjunction, like build_grid: the kernel's day N depends on where its run starts
+    return _compute_band(lat_vals, lon_vals, datetime.fromisoformat(tile["conjunction"]), tile["days"],
+                         criterion, 0.0, 0.0, 20.0, 101.325, is_raw, cat_to_idx, _category_lut(criterion))
+
+
+def plan_tiles(store: GridStore, conjunctions, regions, resolution, days, criterion, mode, tile_rows):
+    """Tiles for every (conjunction, region) grid with days the store doesn't hold yet."""
+    from mapper import REGION_COORDINATES, create_grid
+
+    tiles = []
+    for conjunction in conjunctions:
+        for region in regions:
+            minx, maxx, miny, maxy = REGION_COORDINATES[region]
+            lon_vals, lat_vals, nx, ny = create_grid(resolution, minx, maxx, miny, maxy)
+            key = GridKey(conjunction, region, resolution, criterion, mode)
+            have = store.available_days(key, lon_vals, lat_vals)
+            missing = [day for day in range(days) if day not in have]
+            if not missing:
+                continue
+            for row in range(0, ny, tile_rows):
+                tiles.append({
+                    "conjunction": conjunction.isoformat(), "region": region,
+                    "resolution": resolution, "criterion": criterion, "mode": mode,
+                    "days": max(missing) + 1, "save_days": missing,
+                    "row_start": row, "row_stop": min(row + tile_rows, ny),
+                    "lon": [minx, maxx, nx], "lat": [miny, maxy, ny],
+                })
+    for i, tile in enumerate(tiles):
+        tile["id"] = i
+    return tiles
+
+# ---------------------------------------------------------------------------#
+# Broker                                                                     #
+# ---------------------------------------------------------------------------#
+
+class Broker:
+    def __init__(self, store: GridStore, tiles: list[dict], lease_timeout: float = 120.0, max_attempts: int = 3):
+        self.store = store
+        self.tiles = {t["id"]: t for t in tiles}
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+        self.pending = [t["id"] for t in reversed(tiles)] # stack: pop() hands out in plan order
+        self.leases: dict[int, tuple[str, float]] = {}    # tile id → (lease id, deadline)
+        self.attempts: dict[int, int] = {}
+        self.received: set[int] = set()                   # in a grid buffer, grid not saved yet
+        self.finished: set[int] = set()                   # grid saved to the store
+        self.failed: dict[int, str] = {}
+        self.abandoned: set[tuple] = set()                # grids with a tile that failed for good
+        self.per_worker: dict[str, int] = {}
+        self.started = time()
+
+        # grid buffers: grid id → [array, tile ids]
+        self.grids: dict[tuple, list] = {}
+        for t in tiles:
+            self.grids.setdefault(self._grid_id(t), [None, set()])[1].add(t["id"])
+        if not tiles:
+            self.done.set()
+
+    @staticmethod
+    def _grid_id(tile):
+        return (tile["conjunction"], tile["region"], tile["resolution"], tile["criterion"], tile["mode"])
+
+    def _check_done(self):
+        if len(self.finished) + len(self.failed) == len(self.tiles):
+            self.done.set()
+
+    def _retry(self, tid: int, error: str):
+        # caller holds the lock
+        if tid in self.failed:
+            return
+        if self.attempts.get(tid, 0) >= self.max_attempts:
+            self._abandon(self._grid_id(self.tiles[tid]), tid, error)
+        elif tid not in self.pending:
+            self.pending.append(tid)
+
+    def _abandon(self, grid_id, tid: int, error: str):
+        """A tile failed for good, so its grid can't be saved: fail the grid's other
+        unfinished tiles with it, including ones already received or leased."""
+        # caller holds the lock
+        buf = self.grids[grid_id]
+        buf[0] = None
+        self.abandoned.add(grid_id)
+        for t in buf[1] - self.finished:
+            self.received.discard(t)
+            self.leases.pop(t, None)
+            self.failed[t] = error if t == tid else f"tile {tid} of the same grid failed: {error}"
+        self._check_done()
+
+    def lease(self, worker: str) -> dict | None:
+        with self.lock:
+            now = time()
+            for tid, (_, deadline) in list(self.leases.items()):
+                if deadline < now:
+                    del self.leases[tid]
+                    self._retry(tid, "lease expired")
+            while self.pending:
+                tid = self.pending.pop()
+                if tid in self.received or tid in self.finished or tid in self.failed:
+                    continue
+                lease_id = uuid.uuid4().hex
+                self.leases[tid] = (lease_id, now + self.lease_timeout)
+                self.attempts[tid] = self.attempts.get(tid, 0) + 1
+                return dict(self.tiles[tid], lease=lease_id)
+            return None
+
+    def result(self, tid: int, worker: str, arr: np.ndarray) -> str:
+        tile = self.tiles[tid]
+        shape = (tile["row_stop"] - tile["row_start"], tile["lon"][2], tile["days"])
+        dtype = np.float32 if tile["mode"] == "raw" else np.uint8
+        if arr.shape != shape or arr.dtype != dtype:
+            raise ValueError(f"tile {tid}: expected {shape} {np.dtype(dtype)}, got {arr.shape} {arr.dtype}")
+
+        with self.lock:
+            if tid in self.received or tid in self.finished:
+                return "duplicate"
+            if self._grid_id(tile) in self.abandoned:
+                return "abandoned"
+            self.leases.pop(tid, None)
+            self.received.add(tid)
+            self.per_worker[worker] = self.per_worker.get(worker, 0) + 1
+
+            buf = self.grids[self._grid_id(tile)]
+            if buf[0] is None:
+                buf[0] = np.empty((tile["lat"][2],) + shape[1:], dtype=dtype)
+            buf[0][tile["row_start"]:tile["row_stop"]] = arr
+            complete = buf[0] if buf[1] <= self.received else None
+
+        if complete is None:
+            return "ok"
+        key = GridKey(datetime.fromisoformat(tile["conjunction"]), tile["region"],
+                      tile["resolution"], tile["criterion"], tile["mode"])
+        try:
+            for day in tile["save_days"]:
+                self.store.save_day(key, day, complete[:, :, day],
+                                    np.linspace(*tile["lon"]), np.linspace(*tile["lat"]))
+        except OSError as e:
+            # nothing counts as done until the store has it: hand the grid's tiles out again
+            with self.lock:
+                buf[0] = None
+                for t in sorted(buf[1]):
+                    self.received.discard(t)
+                for t in sorted(buf[1]):
+                    self._retry(t, f"saving the grid failed: {e!r}")
+            raise
+        with self.lock:
+            buf[0] = None
+            self.received -= buf[1]
+            self.finished |= buf[1]
+            self._check_done()
+        return "ok"
+
+    def fail(self, tid: int, lease_id: str, error: str):
+        with self.lock:
+            if tid in self.received or tid in self.finished or tid in self.failed:
+                return
+            if self.leases.get(tid, (None,))[0] != lease_id:
+                return                                  # stale: the tile was already re-leased
+            del self.leases[tid]
+            self._retry(tid, error)
+
+    def status(self) -> dict:
+        with self.lock:
+            elapsed = time() - self.started
+            done = len(self.received) + len(self.finished)
+            return {
+                "tiles": len(self.tiles), "finished": len(self.finished), "received": len(self.received),
+                "pending": len(self.tiles) - done - len(self.failed) - len(self.leases),
+                "leased": len(self.leases),
+                "failed": {str(k): v for k, v in self.failed.items()},
+                "per_worker": self.per_worker, "elapsed_s": round(elapsed, 2),
+                "tiles_per_s": round(done / elapsed, 2) if elapsed else 0.0,
+            }
+
+
+def _handler(broker: Broker):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _reply(self, code: int, payload=None):
+            body = b"" if payload is None else json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/lease":
+                tile = broker.lease(query.get("worker", ["?"])[0])
+                if tile is not None:
+                    self._reply(200, tile)
+                else:
+                    self._reply(410 if broker.done.is_set() else 204)
+            elif url.path == "/status":
+                self._reply(200, broker.status())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip("/").split("/")
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                tid = int(parts[1])
+                broker.tiles[tid]
+            except (IndexError, ValueError, KeyError):
+                return self._reply(404, {"error": "unknown tile"})
+
+            if parts[0] == "result":
+                try:
+                    arr = np.load(io.BytesIO(body), allow_pickle=False)
+                    status = broker.result(tid, query.get("worker", ["?"])[0], arr)
+                except ValueError as e:
+                    return self._reply(400, {"error": str(e)})
+                except OSError as e:
+                    return self._reply(503, {"error": f"grid not saved, its tiles are requeued: {e!r}"})
+                self._reply(200, {"status": status})
+            elif parts[0] == "fail":
+                broker.fail(tid, query.get("lease", [""])[0], body.decode(errors="replace"))
+                self._reply(200, {"status": "requeued"})
+            else:
+                self._reply(404, {"error": "not found"})
+
+    return Handler
+
+
+def serve(broker: Broker, host: str = "0.0.0.0", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """Start the broker's HTTP server in a background thread and return it."""
+    server = ThreadingHTTPServer((host, port), _handler(broker))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="tile-broker", daemon=True).start()
+    return server
+
+# ---------------------------------------------------------------------------#
+# Worker                                                                     #
+# ---------------------------------------------------------------------------#
+
+def _request(url: str, data: bytes | None = None, timeout: float = 60):
+    req = urllib.request.Request(url, data=data, method="POST" if data is not None else "GET")
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.status, resp.read()
+
+
+def work(broker_url: str, name: str | None = None, idle_sleep: float = 1.0, exit_when_done: bool = True) -> int:
+    """Lease, compute and return tiles until the broker reports it is done; returns tiles computed."""
+    broker_url = broker_url.rstrip("/")
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    computed = 0
+    while True:
+        try:
+            status, body = _request(f"{broker_url}/lease?worker={name}")
+        except urllib.error.HTTPError as e:
+            if e.code == 410 and exit_when_done:
+                return computed
+            sleep(idle_sleep)
+            continue
+        except OSError:
+            sleep(idle_sleep)          # broker restarting / unreachable: keep polling
+            continue
+        if status == 204:
+            sleep(idle_sleep)
+            continue
+
+        tile = json.loads(body)
+        query = f"lease={tile['lease']}&worker={name}"
+        try:
+            arr = compute_tile(tile)
+        except Exception as e:
+            try:
+                _request(f"{broker_url}/fail/{tile['id']}?{query}", repr(e).encode())
+            except OSError:
+                pass                   # the lease expires and the tile is retried anyway
+            continue
+
+        buf = io.BytesIO()
+        np.save(buf, arr, allow_pickle=False)
+        for attempt in range(3):
+            try:
+                _request(f"{broker_url}/result/{tile['id']}?{query}", buf.getvalue())
+                computed += 1
+                break
+            except OSError:
+                sleep(idle_sleep * (attempt + 1))
+
+
+def work_processes(broker_url: str, processes: int, exit_when_done: bool = True):
+    """Run ``processes`` independent worker loops on this node."""
+    procs = [Process(target=work, args=(broker_url, f"{socket.gethostname()}:{i}", 1.0, exit_when_done))
+             for i in range(processes)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+# ---------------------------------------------------------------------------#
+# CLI                                                                        #
+# ---------------------------------------------------------------------------#
+
+def _conjunctions(today: datetime, total_months: int) -> list[datetime]:
+    from mapper import AVERAGE_LUNAR_MONTH_DAYS
+    return [fast_astro.next_phases_of_moon_utc(today + timedelta(days=m * AVERAGE_LUNAR_MONTH_DAYS))[0]
+            for m in range(total_months)]
+
+
+if __name__ == "__main__":
+    from mapper import print_ts, REGION_COORDINATES
+
+    parser = argparse.ArgumentParser(description="Distribute visibility-grid computation across nodes")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("serve", help="Plan tiles for missing grid days and hand them out")
+    s.add_argument("--today",           type=str,   default=None, help="ISO datetime for the first month")
+    s.add_argument("--total_months",    type=int,   default=1)
+    s.add_argument("--regions",         type=str,   nargs="+", default=["WORLD"], choices=list(REGION_COORDINATES))
+    s.add_argument("--resolution",      type=int,   default=300)
+    s.add_argument("--days_to_generate",type=int,   default=3)
+    s.add_argument("--criterion",       type=int,   default=1, choices=(0, 1))
+    s.add_argument("--map_mode",        type=str,   default="category", choices=("raw", "category"))
+    s.add_argument("--tile_rows",       type=int,   default=16, help="Latitude rows per tile")
+    s.add_argument("--grid_store",      type=str,   default=None)
+    s.add_argument("--host",            type=str,   default="0.0.0.0")
+    s.add_argument("--port",            type=int,   default=DEFAULT_PORT)
+    s.add_argument("--lease_timeout",   type=float, default=120.0)
+    s.add_argument("--max_attempts",    type=int,   default=3)
+    s.add_argument("--keep_alive",      action="store_true", help="Keep serving /status after all tiles finish")
+
+    w = sub.add_parser("work", help="Compute tiles leased from a broker")
+    w.add_argument("--broker",          type=str,   default=f"http://localhost:{DEFAULT_PORT}")
+    w.add_argument("--processes",       type=int,   default=cpu_count())
+    w.add_argument("--keep_alive",      action="store_true", help="Keep polling after the broker is done")
+
+    args = parser.parse_args()
+
+    if args.command == "work":
+        work_processes(args.broker, args.processes, not args.keep_alive)
+        sys.exit(0)
+
+    today = datetime.fromisoformat(args.today) if args.today else datetime.now()
+    store = GridStore(args.grid_store) if args.grid_store else GridStore()
+    tiles = plan_tiles(store, _conjunctions(today, args.total_months), [r.upper() for r in args.regions],
+                       args.resolution, args.days_to_generate, args.criterion, args.map_mode, args.tile_rows)
+    broker = Broker(store, tiles, args.lease_timeout, args.max_attempts)
+    server = serve(broker, args.host, args.port)
+    print_ts(f"Broker on {args.host}:{args.port}: {len(tiles)} tiles planned")
+
+    while not broker.done.wait(10):
+        st = broker.status()
+        print_ts(f"{st['finished']}/{st['tiles']} tiles, {st['leased']} leased, {st['tiles_per_s']} tiles/s")
+    st = broker.status()
+    print_ts(f"Done: {st['finished']} tiles in {st['elapsed_s']}s ({st['tiles_per_s']} tiles/s), "
+             f"{len(st['failed'])} failed")
+
+    if args.keep_alive:
+        threading.Event().wait()
+    # let workers see 410 before the server goes away
+    sleep(2)
+    server.shutdown()
+    sys.exit(1 if st["failed"] else 0)
@@ -87,6 +87,8 @@ async function fetchPrayers() {
             asr_type: $("#asr").value==="hanafi"?1:0,
             midnight_type: $("#midnight").value==="jafari"?1:0
         };
+        // only sent when changed, so default requests share cache keys with the scheduler's warm-up
+        if ($("#highlat").value !== "ANGLEBASED") method.extreme_lats = $("#highlat").value;
         if (m==="CUSTOM") {
             method.name = "custom"; 
             method.fajr_angle    = parseFloat($("#fajr_angle").value)||undefined;
@@ -228,6 +230,10 @@ $("#method").addEventListener("change", () => {
     } else {
       $("#midnight").value = $("#method").value === "JAFARI" ? "jafari" : "standard";
     }
+    // Makkah's ʿIshāʾ is a fixed delay after Maghrib, which the nearest-latitude rule can't re-solve
+    const isMakkah = $("#method").value === "MAKKAH";
+    $('#highlat option[value="NEARESTLAT"]').disabled = isMakkah;
+    if (isMakkah && $("#highlat").value === "NEARESTLAT") $("#highlat").value = "ANGLEBASED";
 });
 
 // On load
@@ -284,6 +290,9 @@ window.addEventListener("DOMContentLoaded", async () => {
         $("#date-picker").value = todayISO;
     }
 
+    // apply the selected method's defaults (e.g. Jaʿfarī midnight) before the first request
+    $("#method").dispatchEvent(new Event("change"));
+
     // Initial IP lookup + field population
     try {
         const ip = await fetch("https://ipapi.co/json/").then(r => r.json());
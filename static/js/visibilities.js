@@ -89,13 +89,65 @@ function showMap(indexData) {
   const selMonth = $("#month-select").value;
   const selYear  = parseInt($("#year-select").value,10);
 
-  // Find the entry that matches both month & year
-  const entry = indexData.find(e => e.month === selMonth && e.year === selYear);
-  if (entry) {
-    $("#map-output").src = `https://islamictimes-maps.onrender.com/${entry.file}`;
+  // Find the world Yallop category map for that month & year (the hosted
+  // index leaves region/criterion/mode out; those are its defaults)
+  const entry = indexData.find(e => e.month === selMonth && e.year === selYear
+    && (e.region || "WORLD") === "WORLD" && (e.mode || "category") === "category"
+    && (e.criterion ?? 1) === 1);
+  if (entry && entry.file) {
+    $("#map-output").src = `/maps/${entry.file}`;
   } else {
     $("#map-output").src = "/static/img/not-found.png";
   }
+  showVectorMap(entry && entry.vector);
+}
+
+// ─── Interactive map from per-day GeoJSON (index entries with `vector`) ───────
+let vectorMap = null;
+let vectorLayer = null;
+
+function showVectorMap(files) {
+  if (!files || !files.length || !window.L) {
+    hide($("#vector-section"));
+    return;
+  }
+  show($("#vector-section"));
+  if (!vectorMap) {
+    vectorMap = L.map("vector-map", { worldCopyJump: true }).setView([20, 20], 2);
+    L.tileLayer("https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png", {
+      maxZoom: 8,
+      attribution: "&copy; OpenStreetMap contributors"
+    }).addTo(vectorMap);
+  }
+
+  const days = $("#vector-days");
+  days.innerHTML = "";
+  files.forEach((file, i) => {
+    const btn = document.createElement("button");
+    btn.textContent = `Day ${i + 1}`;
+    btn.className = "px-3 py-1 rounded border dark:border-gray-600";
+    btn.onclick = () => loadVectorDay(file, btn);
+    days.append(btn);
+  });
+  loadVectorDay(files[0], days.firstChild);
+}
+
+async function loadVectorDay(file, btn) {
+  $$("#vector-days button").forEach(b => b.classList.remove("bg-emerald-600", "text-white"));
+  btn.classList.add("bg-emerald-600", "text-white");
+  try {
+    const fc = await fetch(`/maps/${file}`).then(r => r.json());
+    if (vectorLayer) vectorLayer.remove();
+    vectorLayer = L.geoJSON(fc, {
+      style: f => ({
+        color: f.properties.fill, weight: 1,
+        fillColor: f.properties.fill, fillOpacity: Math.min(f.properties.opacity, 0.55)
+      }),
+      onEachFeature: (f, layer) => layer.bindTooltip(f.properties.label, { sticky: true })
+    }).addTo(vectorMap);
+  } catch (e) {
+    console.error(e);
+  }
 }
 
 // ─── Autocomplete for “City” (Nominatim) ─────────────────────────────────────
@@ -188,6 +240,7 @@ $("#use-manual").onclick = () => {
 async function fetchVisibilities() {
   if (!currentCoords) return;
   show($("#map-spinner"));
+  fetchOutlook();
 
   // Include the selected hijri month & year in the payload:
   const payload = {
@@ -241,6 +294,50 @@ function renderVisTable({ criterion, entries }) {
   });
 }
 
+// ─── Year outlook: the next 12 months in one /vis_range request ───────────────
+let outlookFor = null;   // "lat,lon" the outlook table currently shows
+
+async function fetchOutlook() {
+  const key = `${currentCoords.lat},${currentCoords.lon}`;
+  if (key === outlookFor) return;   // only depends on the location
+  outlookFor = key;
+
+  try {
+    const { month, year } = await getUpcomingHijri();
+    const res = await fetch("/vis_range", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ ...currentCoords, hijri_month: month, hijri_year: year, months: 12 })
+    });
+    if (!res.ok) throw new Error(await res.text());
+    renderOutlook(await res.json());
+  } catch (e) {
+    console.error(e);
+    outlookFor = null;
+    $("#outlook-body").innerHTML = `
+      <tr><td colspan="4" class="px-4 py-2 text-red-500">Error: ${e.message}</td></tr>
+    `;
+  }
+}
+
+function renderOutlook({ days, hijri_year, hijri_month, datetime, q, category, description }) {
+  const tbody = $("#outlook-body");
+  tbody.innerHTML = "";
+  for (let i = 0; i < hijri_month.length; i += days) {
+    const tr = document.createElement("tr");
+    let cells = `<td class="px-4 py-2">${HIJRI_MONTHS[hijri_month[i] - 1]} ${hijri_year[i]}</td>`;
+    for (let d = i; d < i + days; d++) {
+      const sign = q[d] >= 0 ? "+" : "";
+      cells += `<td class="px-4 py-2" title="${description[d]}">
+        <div>${datetime[d].split(" ")[1]}</div>
+        <div>${category[d]} (${sign}${q[d].toFixed(3)})</div>
+      </td>`;
+    }
+    tr.innerHTML = cells;
+    tbody.append(tr);
+  }
+}
+
 // ─── Initial setup on page load ───────────────────────────────────────────────
 window.addEventListener("DOMContentLoaded", async () => {
   // 1) Build the big map selector
@@ -0,0 +1,7 @@
+import sys, pathlib
+
+# the app's modules live at the repository root, the tools in scripts/
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "scripts"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,42 @@
+import re, json, pathlib
+from datetime import datetime, timezone
+
+import pytest
+
+import app, scheduler
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def page_default_method() -> dict:
+    """The method object static/js/main.js sends before anything is changed: the
+    first #method option, with the midnight its change handler picks for it."""
+    name = re.search(r'<select id="method"[^>]*>\s*<option value="(\w+)"',
+                     (ROOT / "templates" / "index.html").read_text(encoding="utf-8")).group(1)
+    js = (ROOT / "static" / "js" / "main.js").read_text(encoding="utf-8")
+    jafari_for = re.search(r'\$\("#midnight"\)\.value = \$\("#method"\)\.value === "(\w+)"', js).group(1)
+    return {"name": name, "asr_type": 0, "midnight_type": 1 if name == jafari_for else 0}
+
+
+@pytest.fixture
+def warm_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "WARM_DIR", tmp_path)
+    monkeypatch.setattr(scheduler, "_warm_files", {})
+    monkeypatch.setattr(scheduler, "TOP_CITIES", [("Makkah", 21.4225, 39.8262)])
+    app.cached_prayer_times.cache_clear()
+    yield tmp_path
+    app.cached_prayer_times.cache_clear()
+
+
+def test_page_default_request_is_warmed(warm_dir, monkeypatch):
+    assert scheduler.warm(geocode=False) > 0
+    method = page_default_method()
+    date = datetime.now(timezone.utc).astimezone(app.lookup_tz(21.4225, 39.8262)).date().isoformat()
+    assert scheduler.warmed(21.4225, 39.8262, date, json.dumps(method, sort_keys=True)) is not None
+
+    # and a worker answers it from the shared file, without computing
+    app.cached_prayer_times.cache_clear()
+    monkeypatch.setattr(app, "compute_prayer_times", lambda payload: pytest.fail("computed a warmed request"))
+    resp = app.app.test_client().post("/prayer_times", json={
+        "lat": 21.4225, "lon": 39.8262, "date": date, "method": method})
+    assert resp.status_code == 200
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import numpy as np
+
+from tile_broker import Broker
+from grid_store import GridStore, GridKey
+
+CONJ = datetime(2025, 2, 28, 0, 44, 0)
+
+
+def _tiles(region: str, first_id: int, rows: int = 4, n: int = 2) -> list[dict]:
+    return [{"id": first_id + i, "conjunction": CONJ.isoformat(), "region": region, "resolution": 8,
+             "criterion": 1, "mode": "category", "days": 1, "save_days": [0],
+             "row_start": i * rows, "row_stop": (i + 1) * rows,
+             "lon": [-10.0, 10.0, 8], "lat": [-10.0, 10.0, rows * n]}
+            for i in range(n)]
+
+
+def _band(tile: dict) -> np.ndarray:
+    return np.full((tile["row_stop"] - tile["row_start"], tile["lon"][2], tile["days"]), 3, dtype=np.uint8)
+
+
+def test_tile_failing_for_good_fails_its_grid_and_finishes(tmp_path):
+    store = GridStore(tmp_path)
+    broken, ok = _tiles("EUROPE", 0), _tiles("IRAN", 2)
+    broker = Broker(store, broken + ok, max_attempts=1)
+
+    leased = {}
+    while (tile := broker.lease("w")) is not None:
+        leased[tile["id"]] = tile
+    assert broker.result(0, "w", _band(broken[0])) == "ok"        # accepted, grid not complete yet
+    broker.fail(1, leased[1]["lease"], "boom")                    # its neighbour fails for good
+    for tile in ok:
+        assert broker.result(tile["id"], "w", _band(tile)) == "ok"
+
+    assert broker.done.is_set()
+    status = broker.status()
+    assert status["finished"] == 2 and status["received"] == 0
+    assert set(status["failed"]) == {"0", "1"}
+    assert "boom" in status["failed"]["1"]
+    # a late copy of the accepted tile doesn't bring the grid back
+    assert broker.result(1, "w", _band(broken[1])) == "abandoned"
+    assert broker.lease("w") is None
+    assert store.meta(GridKey(CONJ, "EUROPE", 8, 1, "category")) is None
+    assert store.meta(GridKey(CONJ, "IRAN", 8, 1, "category"))["days"].keys() == {"0"}
+
+
+def test_expired_lease_at_max_attempts_fails_the_grid(tmp_path):
+    broker = Broker(GridStore(tmp_path), _tiles("EUROPE", 0), lease_timeout=-1, max_attempts=1)
+    first = broker.lease("w")
+    broker.result(first["id"], "w", _band(first))
+    broker.lease("w")                                             # tile 1, already past its deadline
+    assert broker.lease("w") is None                              # expiry is noticed here
+    assert broker.done.is_set()
+    assert set(broker.status()["failed"]) == {"0", "1"}